@@ -0,0 +1,28 @@
+"""ASGI variant of the server for the visualizer's live editing: each
+WebSocket connection to /session is one editor session, compiled with the
+same engine, options, scheduler, cache and metrics as server.py. Run it
+with any ASGI server, e.g. uvicorn asgi:app. The REST endpoints stay on
+server.py"""
+
+import os
+
+from server import CACHE, CACHE_OPTIONS, SCHEDULER, compile_request
+from src.sessions import SessionApp
+
+
+def compile_edit(source_code, cancelled, on_ast):
+    """Compiles one edit of a session, from the cache if it is there"""
+
+    def compile_function(source_code):
+        return compile_request(source_code, cancelled=cancelled, on_ast=on_ast)
+
+    if CACHE is not None:
+        return CACHE.get_or_compile(
+            source_code, compile_function, CACHE_OPTIONS, SCHEDULER.timeout, cancelled
+        )
+    return compile_function(source_code)
+
+
+# Worker threads compiling edits, ThreadPoolExecutor's default count unless
+# SESSION_WORKERS is set. The scheduler still bounds how many compile at once
+app = SessionApp(compile_edit, int(os.environ.get("SESSION_WORKERS", 0)) or None)
@@ -0,0 +1,88 @@
+"""Benchmark showing CodeGenerator output time grows linearly with nesting
+depth, statement count and expression length.
+
+Run with: python -m benchmarks.bench_emitter
+"""
+
+import sys
+import time
+
+from src.ast import Bin_Op, If, Let, Num, Program, Var
+from src.code_gen import CodeGenerator
+from src.string_token import Token
+from src.token_type import TokenType
+
+REPEATS = 5
+
+
+def let(name, expression):
+    """Builds LET name = expression"""
+
+    return Let(Token(name, TokenType.IDENT), expression)
+
+
+def num(text):
+    """Builds an integer literal"""
+
+    return Num(Token(text, TokenType.INTEGER))
+
+
+def nested_ifs(depth):
+    """IF blocks nested depth levels deep, one LET per level"""
+
+    body = [let("a", num("1"))]
+    for _ in range(depth):
+        condition = Bin_Op(num("1"), Token(">", TokenType.GT), num("0"))
+        body = [let("a", num("1")), If(condition, body)]
+    return Program(body)
+
+
+def flat_statements(count):
+    """count top level LET statements"""
+
+    return Program([let("a", num(str(i))) for i in range(count)])
+
+
+def long_expression(length):
+    """One LET whose right hand side chains length additions"""
+
+    expression = num("0")
+    plus = Token("+", TokenType.PLUS)
+    for i in range(length):
+        expression = Bin_Op(expression, plus, Var(Token("a", TokenType.IDENT)))
+    return Program([let("a", num("0")), let("a", expression)])
+
+
+def best_time(program):
+    """Fastest of REPEATS runs of CodeGenerator.generate over program"""
+
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        CodeGenerator().generate(program)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report(name, build, sizes):
+    """Prints time and time per unit for each size; a flat per unit column
+    means linear scaling"""
+
+    print(f"{name:<18}{'size':>8}{'ms':>10}{'us/unit':>10}")
+    for size in sizes:
+        elapsed = best_time(build(size))
+        print(f"{'':<18}{size:>8}{elapsed * 1e3:>10.2f}{elapsed / size * 1e6:>10.3f}")
+
+
+def main():
+    """Runs every scaling benchmark"""
+
+    sys.setrecursionlimit(100000)
+
+    report("nesting depth", nested_ifs, [250, 500, 1000, 2000])
+    report("statement count", flat_statements, [10000, 20000, 40000, 80000])
+    report("expression length", long_expression, [1000, 2000, 4000, 8000])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Synthetic source programs for benchmarks. Every generator takes a size and
+returns program text whose length grows linearly with it"""
+
+
+def long_expression(size):
+    """One LET whose right hand side has size terms"""
+
+    ops = ["+", "-", "*", "/"]
+    terms = ["a"]
+    for i in range(1, size):
+        terms.append(ops[i % 4])
+        terms.append("a" if i % 3 else str(i))
+    return "LET a = 1\nLET b = " + " ".join(terms) + "\nPRINT b\n"
+
+
+def deep_nesting(size):
+    """IF and WHILE blocks alternately nested size levels deep"""
+
+    lines = ["LET a = 0"]
+    for depth in range(size):
+        if depth % 2:
+            lines.append("WHILE a < " + str(depth) + " REPEAT")
+        else:
+            lines.append("IF a >= 0 THEN")
+        lines.append("LET a = a + 1")
+    for depth in reversed(range(size)):
+        lines.append("ENDWHILE" if depth % 2 else "ENDIF")
+    return "\n".join(lines) + "\n"
+
+
+def many_variables(size):
+    """size distinct variables, each assigned from the one before it"""
+
+    lines = ["LET v0 = 0"]
+    for i in range(1, size):
+        lines.append("LET v" + str(i) + " = v" + str(i - 1) + " + " + str(i))
+    lines.append("PRINT v" + str(size - 1))
+    return "\n".join(lines) + "\n"
+
+
+def labels_and_gotos(size):
+    """size LABEL/GOTO pairs, each GOTO jumping to the next label"""
+
+    lines = []
+    for i in range(size):
+        lines.append("GOTO L" + str(i))
+        lines.append("LABEL L" + str(i))
+    return "\n".join(lines) + "\n"
+
+
+def string_literals(size):
+    """size PRINT statements of 200 character string literals"""
+
+    text = ("The quick brown fox jumps over the lazy dog. " * 5)[:200]
+    return ('PRINT "' + text + '"\n') * size
+
+
+def mixed(size):
+    """size blocks mixing every statement kind"""
+
+    lines = ["LET total = 0", "LET i = 0"]
+    for i in range(size):
+        n = str(i)
+        lines += [
+            "LABEL top" + n,
+            'PRINT "block ' + n + '"',
+            "LET x" + n + " = i * 2 + " + n + " / 3",
+            "IF x" + n + " > 10 THEN",
+            "  WHILE i < 5 REPEAT",
+            "    LET i = i + 1",
+            "    LET total = total + x" + n,
+            "  ENDWHILE",
+            "ENDIF",
+            "PRINT total",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+# name -> (generator, default size)
+WORKLOADS = {
+    "long_expression": (long_expression, 20000),
+    "deep_nesting": (deep_nesting, 2000),
+    "many_variables": (many_variables, 10000),
+    "labels_and_gotos": (labels_and_gotos, 10000),
+    "string_literals": (string_literals, 5000),
+    "mixed": (mixed, 2000),
+}
@@ -0,0 +1,213 @@
+"""Benchmark suite timing each compiler phase over synthetic programs, with
+throughput, peak memory and comparison against a stored baseline.
+
+Run with: python -m benchmarks.suite [--save] [--only NAME ...]
+
+Phases are timed separately: lex drains the lexer, parse runs
+Parser.program over pre-lexed tokens, generate runs CodeGenerator.generate,
+to_dict builds the tree's dicts, and to_json and to_binary serialize the tree
+as compact JSON and in the binary AST format. Timings are the best of --repeat runs;
+peak memory is measured in a separate tracemalloc run so it does not slow
+the timed ones. Baselines are machine specific, so save one on the machine
+that compares against it.
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from src.code_gen import CodeGenerator
+from src.lex import ENGINES, create_lexer
+from src.parse import Parser
+from src.serialize import dumps_binary, to_json
+from src.token_type import TokenType
+
+from .programs import WORKLOADS
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+class ReplayLexer:
+    """Hands the parser tokens lexed ahead of time, repeating the final EOF
+    as a real lexer does. Offsets are not replayed, so every span is empty"""
+
+    token_start = 0
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.index = 0
+
+    def get_token(self):
+        """Return the next token"""
+
+        index = self.index
+        if index < len(self.tokens) - 1:
+            self.index = index + 1
+        return self.tokens[index]
+
+
+def lex_all(source, engine):
+    """Return every token of source, EOF included"""
+
+    lexer = create_lexer(source, engine)
+    tokens = []
+    while True:
+        token = lexer.get_token()
+        tokens.append(token)
+        if token.kind == TokenType.EOF:
+            return tokens
+
+
+def phase_runners(source, engine):
+    """Return name -> callable for each phase, with its inputs prepared by
+    the phases before it"""
+
+    tokens = lex_all(source, engine)
+    program = Parser(ReplayLexer(tokens)).program()
+
+    return {
+        "lex": lambda: lex_all(source, engine),
+        "parse": lambda: Parser(ReplayLexer(tokens)).program(),
+        "generate": lambda: CodeGenerator().generate(program),
+        "to_dict": program.to_dict,
+        "to_json": lambda: to_json(program),
+        "to_binary": lambda: dumps_binary(program),
+    }
+
+
+def best_time(run, repeat):
+    """Fastest of repeat calls to run, in seconds. The garbage collector is
+    paused while timing, as timeit does, to cut noise"""
+
+    best = float("inf")
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best
+
+
+def peak_memory(run):
+    """Peak bytes allocated while run executes"""
+
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(name, scale, engine, repeat):
+    """Return phase -> {seconds, mb_per_s, peak_bytes} for one workload"""
+
+    generate, size = WORKLOADS[name]
+    source = generate(max(1, int(size * scale)))
+    megabytes = len(source.encode()) / 1e6
+    results = {}
+
+    for phase, run in phase_runners(source, engine).items():
+        seconds = best_time(run, repeat)
+        results[phase] = {
+            "seconds": seconds,
+            "mb_per_s": megabytes / seconds if seconds else 0.0,
+            "peak_bytes": peak_memory(run),
+        }
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of messages for every phase slower or hungrier than the
+    baseline by more than tolerance, as a fraction"""
+
+    regressions = []
+
+    for name, phases in results.items():
+        for phase, current in phases.items():
+            previous = baseline.get(name, {}).get(phase)
+            if previous is None:
+                continue
+
+            for metric in ["seconds", "peak_bytes"]:
+                limit = previous[metric] * (1 + tolerance)
+                if current[metric] > limit:
+                    regressions.append(
+                        f"{name}/{phase}: {metric} {current[metric]:.6g}"
+                        f" > {previous[metric]:.6g} baseline"
+                    )
+
+    return regressions
+
+
+def report(results):
+    """Prints one row per workload and phase"""
+
+    print(f"{'workload':<18}{'phase':<10}{'ms':>10}{'MB/s':>10}{'peak KB':>12}")
+    for name, phases in results.items():
+        for phase, result in phases.items():
+            print(
+                f"{name:<18}{phase:<10}{result['seconds'] * 1e3:>10.2f}"
+                f"{result['mb_per_s']:>10.2f}{result['peak_bytes'] / 1024:>12.0f}"
+            )
+
+
+def main(argv=None):
+    """Runs the suite, returning 1 if a baseline comparison found regressions"""
+
+    parser = argparse.ArgumentParser(description="Compiler phase benchmarks")
+    parser.add_argument("--only", nargs="+", choices=sorted(WORKLOADS))
+    parser.add_argument("--scale", type=float, default=1.0, help="size multiplier")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--lexer", choices=sorted(ENGINES), default="char")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="overwrite baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100000))
+
+    settings = {"scale": args.scale, "lexer": args.lexer}
+    results = {
+        name: measure(name, args.scale, args.lexer, args.repeat)
+        for name in args.only or WORKLOADS
+    }
+    report(results)
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(
+                {"settings": settings, "results": results}, baseline_file, indent=4
+            )
+        print("Saved baseline to " + args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+
+    if baseline["settings"] != settings:
+        print("Baseline was recorded with " + json.dumps(baseline["settings"]))
+        return 0
+
+    regressions = compare(results, baseline["results"], args.tolerance)
+
+    for message in regressions:
+        print("REGRESSION " + message)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
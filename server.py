@@ -1,45 +1,559 @@
 """Represents server"""
 
+import hashlib
+import json
+import io
 import os
+import signal
+import tempfile
+import threading
+import time
+from functools import partial
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 
-from src.code_gen import CodeGenerator
-from src.lex import Lexer
-from src.parse import Parser
+from src.ast_store import AstStore
+from src.batch import BatchCompiler
+from src.cache import CompileCache
+from src.metrics import CompileMetrics, memory_samples, stats_samples
+from src.native import MAX_OUTPUT, OPT_LEVELS, NativeBuilder
+from src.scheduler import (
+    DEADLINE,
+    PHASES,
+    QUEUE_FULL,
+    QUEUE_TIMEOUT,
+    REASONS,
+    TOO_LARGE,
+    Rejected,
+    Scheduler,
+)
+from src.serialize import dumps, to_json
+from src.trace import ProfileTracer
+from src.vm import TIMED_OUT, TRUNCATED, VM, Trap
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# Lexer engine used for every request, see src.lex.ENGINES
+LEXER_ENGINE = os.environ.get("LEXER_ENGINE", "table")
+
+# compile_source options: OPTIMIZE optimizes the generated C, INFER_TYPES
+# gives variables inferred int, long long or double types,
+# ELIMINATE_DEAD_CODE leaves dead statements out of it and OPTIMIZE_LOOPS
+# hoists invariant computations out of its loops. The AST is always the tree
+# as parsed
+COMPILE_OPTIONS = {
+    "optimize": bool(os.environ.get("OPTIMIZE")),
+    "infer_types": bool(os.environ.get("INFER_TYPES")),
+    "eliminate_dead_code": bool(os.environ.get("ELIMINATE_DEAD_CODE")),
+    "optimize_loops": bool(os.environ.get("OPTIMIZE_LOOPS")),
+}
+
+# Compile options that change the output, part of every cache key
+CACHE_OPTIONS = ",".join(name for name, on in COMPILE_OPTIONS.items() if on)
+
+# Per-production parser profile, aggregated over requests when PARSER_PROFILE is set
+PARSER_PROFILE = ProfileTracer() if os.environ.get("PARSER_PROFILE") else None
+PARSER_PROFILE_LOCK = threading.Lock()
+
+# Compile cache file shared by every worker on the host; set to "" to disable
+CACHE_PATH = os.environ.get(
+    "COMPILE_CACHE_PATH", os.path.join(tempfile.gettempdir(), "pytoc-cache.sqlite3")
+)
+CACHE = (
+    CompileCache(
+        CACHE_PATH,
+        max_entries=int(os.environ.get("COMPILE_CACHE_MAX_ENTRIES", 10000)),
+        max_bytes=int(os.environ.get("COMPILE_CACHE_MAX_BYTES", 256 << 20)),
+    )
+    if CACHE_PATH
+    else None
+)
+
+# Compiled ASTs kept for /ast paging, and the levels a page holds when the
+# request does not say. Trees another worker compiled are loaded from the
+# compile cache
+AST_STORE = AstStore(
+    int(os.environ.get("AST_STORE_ENTRIES", 64)),
+    load=(lambda key: (CACHE.get(key) or (None, None))[1]) if CACHE else None,
+)
+AST_PAGE_DEPTH = int(os.environ.get("AST_PAGE_DEPTH", 3))
+# Most items of each child list a page holds; clients page through longer
+# lists with /ast's offset and limit
+AST_PAGE_CHILDREN = int(os.environ.get("AST_PAGE_CHILDREN", 200))
+# Levels of the AST /compile returns when the request gives no depth; unset
+# returns the whole tree
+AST_COMPILE_DEPTH = os.environ.get("AST_COMPILE_DEPTH")
+AST_COMPILE_DEPTH = int(AST_COMPILE_DEPTH) if AST_COMPILE_DEPTH else None
+
+# Worker processes for /compile/batch, one per core by default, the most
+# sources a batch may hold and the seconds it may take to compile
+BATCH = BatchCompiler(
+    int(os.environ.get("BATCH_WORKERS", 0)) or None, LEXER_ENGINE, **COMPILE_OPTIONS
+)
+BATCH_MAX_SOURCES = int(os.environ.get("BATCH_MAX_SOURCES", 256))
+BATCH_TIMEOUT = float(os.environ.get("BATCH_TIMEOUT", 30))
+
+# Phase latencies, source sizes, AST sizes and errors of compiles, served
+# with cache, scheduler and memory statistics on /metrics
+METRICS = CompileMetrics()
+
+# Admission control for compiles: the longest source accepted, how many
+# compiles run at once, how many may wait for a slot and for how long, and
+# the seconds each phase (COMPILE_LEX_TIMEOUT, COMPILE_PARSE_TIMEOUT, ...) and
+# the whole compile may take. Unset phase timeouts leave that phase bounded
+# only by COMPILE_TIMEOUT_MAX
+SCHEDULER = Scheduler(
+    int(os.environ.get("COMPILE_CONCURRENCY", 0)) or os.cpu_count() or 1,
+    queue_limit=int(os.environ.get("COMPILE_QUEUE_LIMIT", 32)),
+    queue_timeout=float(os.environ.get("COMPILE_QUEUE_TIMEOUT", 1)),
+    max_chars=int(os.environ.get("COMPILE_MAX_CHARS", 1 << 20)),
+    budgets={
+        phase: float(os.environ[f"COMPILE_{phase.upper()}_TIMEOUT"])
+        for phase in PHASES
+        if os.environ.get(f"COMPILE_{phase.upper()}_TIMEOUT")
+    },
+    timeout=float(os.environ.get("COMPILE_TIMEOUT_MAX", 10)),
+    metrics=METRICS,
+)
+METRICS.registry.collect(
+    lambda: stats_samples(
+        "pytoc_scheduler",
+        SCHEDULER.stats(),
+        ("admitted", "completed", *REASONS),
+        "Compile admission statistics",
+    )
+)
+METRICS.registry.collect(memory_samples)
+if CACHE is not None:
+    METRICS.registry.collect(
+        lambda: stats_samples(
+            "pytoc_cache",
+            CACHE.stats(),
+            ("hits", "memory_hits", "misses", "coalesced", "evictions"),
+            "Compile cache statistics",
+        )
+    )
+
+# Response status for each reason a compile is refused or stopped
+REJECTED_STATUS = {TOO_LARGE: 413, QUEUE_FULL: 429, QUEUE_TIMEOUT: 503, DEADLINE: 504}
+
+# Native executables built for /run, and how many may build or run at once
+NATIVE = NativeBuilder(os.environ.get("RUN_CACHE_DIR"))
+RUN_SLOTS = threading.BoundedSemaphore(
+    int(os.environ.get("RUN_CONCURRENCY", 0)) or os.cpu_count() or 1
+)
+# Seconds a /run request waits for a slot, and the longest run allowed
+RUN_QUEUE_TIMEOUT = float(os.environ.get("RUN_QUEUE_TIMEOUT", 10))
+RUN_TIMEOUT_MAX = float(os.environ.get("RUN_TIMEOUT_MAX", 5))
+
+# How /run executes programs by default: "vm" runs them in-process on the
+# bytecode VM, "native" builds them with cc
+RUN_ENGINE = os.environ.get("RUN_ENGINE", "vm")
+RUN_ENGINES = ("vm", "native")
+
+
+def compile_request(source_code, timeout=None, cancelled=None, on_ast=None):
+    """Runs the compile pipeline for one request once the scheduler admits
+    it, within timeout seconds if given. See Scheduler.compile for cancelled
+    and on_ast"""
+
+    tracer = ProfileTracer() if PARSER_PROFILE is not None else None
+    c_code, ast_json = SCHEDULER.compile(
+        source_code,
+        LEXER_ENGINE,
+        tracer,
+        timeout,
+        cancelled,
+        on_ast,
+        **COMPILE_OPTIONS,
+    )
+
+    if tracer is not None:
+        with PARSER_PROFILE_LOCK:
+            PARSER_PROFILE.merge(tracer)
+
+    return c_code, ast_json
+
+
+def ast_id(source_code, spans=False):
+    """Return the ID /compile gives the AST of source_code, the compile
+    cache key when there is a cache, so every worker agrees on it. The AST
+    with spans gets an ID of its own, which no cache entry has"""
+
+    if CACHE is not None and not spans:
+        return CACHE.key(source_code, CACHE_OPTIONS)
+    key = CACHE_OPTIONS + ("\0spans" if spans else "") + "\0" + source_code
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def count_argument(value):
+    """Return value if it is a valid page depth, offset or limit, a
+    non-negative integer, or None"""
+
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+    return None
+
+
+def query_count(name, default):
+    """Return the query argument name as a page depth, offset or limit,
+    default when it is absent, or None when it is not a non-negative
+    integer, so "?depth=abc" is refused rather than ignored"""
+
+    value = request.args.get(name)
+    if value is None:
+        return default
+    if value.isascii() and value.isdigit():
+        return int(value)
+    return None
+
+
+def json_response(obj):
+    """Return a JSON response for obj, which may hold AST pages deeper than
+    jsonify's recursion allows"""
+
+    return app.response_class(dumps(obj), mimetype="application/json")
+
+
+def rejected_response(error):
+    """Return the response for a compile the scheduler refused or stopped.
+    Clients told the server is busy are asked to retry shortly"""
+
+    response = jsonify({"error": str(error), "reason": error.reason})
+    response.status_code = REJECTED_STATUS[error.reason]
+    if error.reason in (QUEUE_FULL, QUEUE_TIMEOUT):
+        response.headers["Retry-After"] = "1"
+    return response
+
 
 @app.route("/compile", methods=["POST"])
 def compile_code():
     """Endpoint for source code"""
 
-    data = request.json
+    start = time.perf_counter()
+    try:
+        return compile_response(request.get_json(silent=True))
+    finally:
+        METRICS.request_seconds.observe(time.perf_counter() - start, "/compile")
+
+
+def compile_response(data):
+    """Return the /compile response for request data"""
+
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+
+    source_code = data.get("code", "")
+
+    if not source_code:
+        return jsonify({"error": "No code provided"}), 400
+
+    timeout = data.get("timeout")
+    if timeout is not None and (
+        not isinstance(timeout, (int, float)) or timeout <= 0
+    ):
+        return jsonify({"error": "timeout must be a positive number"}), 400
+
+    # With a depth, only that many levels of the AST are returned and the
+    # rest is paged in from /ast
+    depth = data.get("depth", AST_COMPILE_DEPTH)
+    if depth is not None and count_argument(depth) is None:
+        return jsonify({"error": "depth must be a non-negative integer"}), 400
+
+    # With source_map, AST nodes carry their source offsets and the response
+    # maps each C line to the source line it came from
+    mapped = data.get("source_map", False)
+    if not isinstance(mapped, bool):
+        return jsonify({"error": "source_map must be true or false"}), 400
+
+    try:
+        compile_function = partial(compile_request, timeout=timeout)
+        source_map = None
+
+        if mapped:
+            # Spans and source maps are not cached, so these always compile
+            program, c_code, source_map = SCHEDULER.compile_mapped(
+                source_code, LEXER_ENGINE, timeout, **COMPILE_OPTIONS
+            )
+            ast_json = to_json(program, spans=True)
+        elif CACHE is not None:
+            # Waiting on another worker's compile counts against the timeout
+            wait = SCHEDULER.timeout
+            if timeout is not None and timeout < wait:
+                wait = timeout
+            c_code, ast_json = CACHE.get_or_compile(
+                source_code, compile_function, CACHE_OPTIONS, wait
+            )
+        else:
+            c_code, ast_json = compile_function(source_code)
+
+        start = time.perf_counter()
+
+        if depth is not None:
+            tree_id = ast_id(source_code, mapped)
+            tree = AST_STORE.put(tree_id, ast_json)
+            fields = {
+                "c_code": c_code,
+                "ast": tree.page(0, depth, limit=AST_PAGE_CHILDREN),
+                "ast_id": tree_id,
+                "nodes": len(tree.nodes),
+            }
+            if source_map is not None:
+                fields["source_map"] = source_map.to_dict()
+            response = json_response(fields)
+        else:
+            # The AST is already JSON text, so splice it in, not re-encode it
+            body = '{"c_code": ' + json.dumps(c_code) + ', "ast": ' + ast_json
+            if source_map is not None:
+                body += ', "source_map": ' + source_map.to_json()
+            response = app.response_class(body + "}", mimetype="application/json")
+
+        METRICS.phase_seconds.observe(time.perf_counter() - start, "respond")
+        return response
+
+    except Rejected as e:
+        return rejected_response(e)
+
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/compile/batch", methods=["POST"])
+def compile_batch():
+    """Endpoint for many sources at once, compiled in parallel"""
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+
+    sources = data.get("sources")
+
+    if not isinstance(sources, list) or not sources:
+        return jsonify({"error": "No sources provided"}), 400
+
+    if len(sources) > BATCH_MAX_SOURCES:
+        error = (
+            f"Batch has {len(sources)} sources, over the limit of {BATCH_MAX_SOURCES}"
+        )
+        return jsonify({"error": error}), 413
+
+    results = [None] * len(sources)
+    keys = [None] * len(sources)
+    misses = []
+
+    for index, source in enumerate(sources):
+        if not isinstance(source, str) or not source:
+            results[index] = ("No code provided", None, None)
+            continue
+
+        try:
+            SCHEDULER.check_size(source)
+        except Rejected as e:
+            results[index] = (str(e), None, None)
+            continue
+
+        if CACHE is not None:
+            keys[index] = CACHE.key(source, CACHE_OPTIONS)
+            entry = CACHE.get(keys[index])
+            if entry is not None:
+                results[index] = (None,) + entry
+                continue
+
+        misses.append(index)
+
+    compiled = BATCH.compile(
+        (sources[index] for index in misses), timeout=BATCH_TIMEOUT
+    )
+
+    for index, result in zip(misses, compiled):
+        results[index] = result
+        error, c_code, ast_json = result
+        if CACHE is not None and error is None:
+            CACHE.put(keys[index], c_code, ast_json)
+
+    items = []
+    for error, c_code, ast_json in results:
+        if error is not None:
+            items.append(json.dumps({"error": error}))
+        else:
+            items.append(
+                '{"c_code": ' + json.dumps(c_code) + ', "ast": ' + ast_json + "}"
+            )
+
+    body = '{"results": [' + ", ".join(items) + "]}"
+    return app.response_class(body, mimetype="application/json")
+
+
+def run_in_vm(source_code, input_text, timeout):
+    """Runs source on the bytecode VM, returning a result shaped like
+    NativeBuilder.run, with the exit codes of a native executable killed by
+    SIGFPE on a trapping division or SIGKILL on timeout. The compile runs
+    under the scheduler like any other"""
+
+    start = time.perf_counter()
+    code = SCHEDULER.compile_bytecode(
+        source_code, LEXER_ENGINE, COMPILE_OPTIONS["infer_types"]
+    )
+    build_seconds = time.perf_counter() - start
+
+    output = io.StringIO()
+    vm = VM(output, io.StringIO(input_text), MAX_OUTPUT)
+    exit_code = 0
+    start = time.perf_counter()
+
+    try:
+        status = vm.run(code, timeout)
+    except Trap:
+        status = None
+        exit_code = -signal.SIGFPE
+
+    if status == TIMED_OUT:
+        exit_code = -signal.SIGKILL
+
+    return {
+        "stdout": output.getvalue(),
+        "exit_code": exit_code,
+        "timed_out": status == TIMED_OUT,
+        "truncated": status == TRUNCATED,
+        "run_seconds": time.perf_counter() - start,
+        "build_cached": False,
+        "build_seconds": build_seconds,
+    }
+
+
+@app.route("/ast/<tree_id>/<int:node_id>", methods=["GET"])
+def ast_page(tree_id, node_id):
+    """Endpoint for the subtree of a compiled AST at a node, down to the
+    depth query argument. The node's child lists start at the offset query
+    argument, and every list holds at most limit items"""
+
+    depth = query_count("depth", AST_PAGE_DEPTH)
+    if depth is None:
+        return jsonify({"error": "depth must be a non-negative integer"}), 400
+
+    offset = query_count("offset", 0)
+    if offset is None:
+        return jsonify({"error": "offset must be a non-negative integer"}), 400
+
+    limit = query_count("limit", AST_PAGE_CHILDREN)
+    if limit is None:
+        return jsonify({"error": "limit must be a non-negative integer"}), 400
+
+    tree = AST_STORE.get(tree_id)
+    if tree is None:
+        return jsonify({"error": "Unknown AST, compile it again"}), 404
+    if node_id >= len(tree.nodes):
+        return jsonify({"error": "Unknown node: " + str(node_id)}), 404
+
+    limit = min(limit, AST_PAGE_CHILDREN)
+    return json_response(
+        {"ast_id": tree_id, "ast": tree.page(node_id, depth, offset, limit)}
+    )
+
+
+@app.route("/run", methods=["POST"])
+def run_code():
+    """Endpoint running source, in-process on the bytecode VM or as a native
+    executable built with cc"""
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+
     source_code = data.get("code", "")
 
     if not source_code:
-        return jsonify({"error", "No code provided"}), 400
+        return jsonify({"error": "No code provided"}), 400
+
+    engine = data.get("engine", RUN_ENGINE)
+    if engine not in RUN_ENGINES:
+        return jsonify({"error": "Unknown engine: " + str(engine)}), 400
+
+    opt_level = str(data.get("opt_level", "2"))
+    if opt_level not in OPT_LEVELS:
+        return jsonify({"error": "Unknown opt_level: " + opt_level}), 400
+
+    timeout = data.get("timeout", RUN_TIMEOUT_MAX)
+    if not isinstance(timeout, (int, float)) or timeout <= 0:
+        return jsonify({"error": "timeout must be a positive number"}), 400
+    timeout = min(timeout, RUN_TIMEOUT_MAX)
 
     try:
+        SCHEDULER.check_size(source_code)
+    except Rejected as e:
+        return rejected_response(e)
 
-        lexer = Lexer(source_code)
-        parser = Parser(lexer)
+    if not RUN_SLOTS.acquire(timeout=RUN_QUEUE_TIMEOUT):
+        return jsonify({"error": "Too many runs in progress"}), 503
 
-        program = parser.program()
+    try:
+        if engine == "vm":
+            result = run_in_vm(source_code, data.get("stdin", ""), timeout)
+            result["engine"] = engine
+            return jsonify(result)
 
-        generator = CodeGenerator()
-        c_code = generator.visit_program(program)
+        if CACHE is not None:
+            c_code, _ = CACHE.get_or_compile(
+                source_code, compile_request, CACHE_OPTIONS, SCHEDULER.timeout
+            )
+        else:
+            c_code, _ = compile_request(source_code)
 
-        ast_json = program.to_dict()
+        path, cached, build_seconds = NATIVE.build(c_code, opt_level)
+        result = NATIVE.run(path, data.get("stdin", ""), timeout)
 
-        return jsonify({"c_code": c_code, "ast": ast_json})
+    except Rejected as e:
+        return rejected_response(e)
 
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({"error": str(e)}), 500
 
+    finally:
+        RUN_SLOTS.release()
+
+    result.update(build_cached=cached, build_seconds=build_seconds, engine=engine)
+    return jsonify(result)
+
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Endpoint for compile cache statistics"""
+
+    if CACHE is None:
+        return jsonify({"error": "Compile cache is disabled"}), 404
+
+    return jsonify(CACHE.stats())
+
+
+@app.route("/scheduler/stats", methods=["GET"])
+def scheduler_stats():
+    """Endpoint for compile admission and deadline statistics"""
+
+    return jsonify(SCHEDULER.stats())
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Endpoint for compile metrics in the Prometheus text format"""
+
+    return app.response_class(
+        METRICS.render(), mimetype="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.route("/trace", methods=["GET"])
+def parser_trace():
+    """Endpoint for the aggregated parser profile"""
+
+    if PARSER_PROFILE is None:
+        return jsonify({"error": "Parser profiling is disabled"}), 404
+
+    with PARSER_PROFILE_LOCK:
+        return jsonify(PARSER_PROFILE.to_dict())
+
 
 if __name__ == "__main__":
     # Use the PORT provided by the cloud, or default to 5000 locally
@@ -1,65 +1,136 @@
+import sys
+
+from .string_token import Token
+from .token_type import TokenType
+
+
 class AST:
-    """Represemts an AST node"""
+    """Represemts an AST node. Nodes declare __slots__ so a tree carries no
+    per-instance __dict__. The parser sets start and end, the source offsets
+    a node was parsed from; nodes built otherwise have neither"""
+
+    __slots__ = ("start", "end")
 
     def to_dict(self):
-        """*"""
+        """Return a dictionary format of current object. The tree is walked
+        with an explicit stack, so deep trees do not recurse"""
+
+        root = {}
+        stack = [(self, root, "node")]
+
+        while stack:
+            node, parent, key = stack.pop()
+            fields, children = node.fields()
+            parent[key] = fields
+
+            for name, child in children:
+                if isinstance(child, list):
+                    items = fields[name] = [None] * len(child)
+                    stack.extend((item, items, i) for i, item in enumerate(child))
+                else:
+                    # Reserve the key now so entries keep their order
+                    fields[name] = None
+                    stack.append((child, fields, name))
+
+        return root["node"]
+
+    def fields(self):
+        """Return the node's scalar entries and its (key, child) pairs"""
+
+    @property
+    def span(self):
+        """Return the (start, end) source offsets of the node, or None"""
+
+        start = getattr(self, "start", None)
+        if start is None:
+            return None
+        return start, self.end
+
+    def copy_span(self, node):
+        """Gives this node the span of node, if it has one, and returns it"""
+
+        start = getattr(node, "start", None)
+        if start is not None:
+            self.start = start
+            self.end = node.end
+        return self
 
 
 class Num(AST):
-    """Represents a Num type node"""
+    """Represents a Num type node. Only the token text is kept"""
+
+    __slots__ = ("value",)
 
     def __init__(self, token):
-        self.token = token
         self.value = token.text
 
-    def to_dict(self):
-        """Return a dictionary format of current object"""
-        return {"type": "Num", "value": self.value}
+    @property
+    def token(self):
+        """Return a token equivalent to the one the node was built from"""
+        return Token(self.value, TokenType.INTEGER)
+
+    def fields(self):
+        return {"type": "Num", "value": self.value}, ()
 
     def __repr__(self):
         return f"Num({self.value})"
 
 
 class Float(AST):
-    """Represents a Float type node"""
+    """Represents a Float type node. Only the token text is kept"""
+
+    __slots__ = ("value",)
 
     def __init__(self, token):
-        self.token = token
         self.value = token.text
 
-    def to_dict(self):
-        """Return a dictionary format of current object"""
-        return {"type": "Float", "value": self.value}
+    @property
+    def token(self):
+        """Return a token equivalent to the one the node was built from"""
+        return Token(self.value, TokenType.FLOAT)
+
+    def fields(self):
+        return {"type": "Float", "value": self.value}, ()
 
     def __repr__(self):
         return f"Float({self.value})"
 
 
 class String(AST):
-    """Represents a String type node"""
+    """Represents a String type node. Only the token text is kept"""
+
+    __slots__ = ("value",)
 
     def __init__(self, token):
-        self.token = token
         self.value = token.text
 
-    def to_dict(self):
-        """Return a dictionary format of current object"""
-        return {"type": "String", "value": self.value}
+    @property
+    def token(self):
+        """Return a token equivalent to the one the node was built from"""
+        return Token(self.value, TokenType.STRING)
+
+    def fields(self):
+        return {"type": "String", "value": self.value}, ()
 
     def __repr__(self):
         return f"String({self.value})"
 
 
 class Var(AST):
-    """Represents a Var type node"""
+    """Represents a Var type node. Only the token text is kept"""
+
+    __slots__ = ("value",)
 
     def __init__(self, token):
-        self.token = token
-        self.value = token.text
+        self.value = sys.intern(token.text)
 
-    def to_dict(self):
-        """Return a dictionary format of current object"""
-        return {"type": "Var", "value": self.value}
+    @property
+    def token(self):
+        """Return a token equivalent to the one the node was built from"""
+        return Token(self.value, TokenType.IDENT)
+
+    def fields(self):
+        return {"type": "Var", "value": self.value}, ()
 
     def __repr__(self):
         return f"Var({self.value})"
@@ -68,20 +139,18 @@ class Var(AST):
 class Bin_Op(AST):
     """Represents conjunction of right and left children in the tree"""
 
+    __slots__ = ("left", "op", "right")
+
     def __init__(self, left, op, right):
         self.left = left
         self.op = op
         self.right = right
 
-    def to_dict(self):
-        """Return a dictionary format of current object"""
-
-        return {
-            "type": "Bin_Op",
-            "operator": self.op.text,
-            "left": self.left.to_dict(),
-            "right": self.right.to_dict(),
-        }
+    def fields(self):
+        return {"type": "Bin_Op", "operator": self.op.text}, (
+            ("left", self.left),
+            ("right", self.right),
+        )
 
     def __repr__(self):
         return f"Bin_Op{self.left, self.op.text, self.right}"
@@ -90,11 +159,13 @@ class Bin_Op(AST):
 class Print(AST):
     """Represents the print token"""
 
+    __slots__ = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
-    def to_dict(self):
-        return {"type": "Print", "expression": self.expression.to_dict()}
+    def fields(self):
+        return {"type": "Print"}, (("expression", self.expression),)
 
     def __repr__(self):
         return f"Print({self.expression})"
@@ -103,15 +174,13 @@ class Print(AST):
 class Program(AST):
     """Represents a program (collection of statements)"""
 
+    __slots__ = ("statements",)
+
     def __init__(self, statements):
         self.statements = statements
 
-    def to_dict(self):
-        """Return a dictionary format of current object"""
-        return {
-            "type": "Program",
-            "statements": [stm.to_dict() for stm in self.statements],
-        }
+    def fields(self):
+        return {"type": "Program"}, (("statements", self.statements),)
 
     def __repr__(self):
         return f"Program({self.statements})"
@@ -120,16 +189,16 @@ class Program(AST):
 class Let(AST):
     """Represets a LET token"""
 
+    __slots__ = ("name_token", "expression")
+
     def __init__(self, name_token, expression):
         self.name_token = name_token
         self.expression = expression
 
-    def to_dict(self):
-        return {
-            "type": "Let",
-            "name_token": self.name_token.text,
-            "value": self.expression.to_dict(),
-        }
+    def fields(self):
+        return {"type": "Let", "name_token": self.name_token.text}, (
+            ("value", self.expression),
+        )
 
     def __repr__(self):
         return f"Let({self.name_token.text}, {self.expression})"
@@ -138,11 +207,13 @@ class Let(AST):
 class Input(AST):
     """Represents an Input token"""
 
+    __slots__ = ("input_token",)
+
     def __init__(self, input_token):
         self.input_token = input_token
 
-    def to_dict(self):
-        return {"type": "Input", "value": self.input_token.text}
+    def fields(self):
+        return {"type": "Input", "value": self.input_token.text}, ()
 
     def __repr__(self):
         return f"Input({self.input_token.text})"
@@ -151,11 +222,13 @@ class Input(AST):
 class Label(AST):
     """Represents a Label token"""
 
+    __slots__ = ("value",)
+
     def __init__(self, token):
         self.value = token
 
-    def to_dict(self):
-        return {"type": "Label", "value": self.value.text}
+    def fields(self):
+        return {"type": "Label", "value": self.value.text}, ()
 
     def __repr__(self):
         return f"Label({self.value.text})"
@@ -164,11 +237,13 @@ class Label(AST):
 class Goto(AST):
     """Represents a Goto token"""
 
+    __slots__ = ("value",)
+
     def __init__(self, token):
         self.value = token
 
-    def to_dict(self):
-        return {"type": "Goto", "value": self.value.text}
+    def fields(self):
+        return {"type": "Goto", "value": self.value.text}, ()
 
     def __repr__(self):
         return f"Goto({self.value.text})"
@@ -177,16 +252,14 @@ class Goto(AST):
 class If(AST):
     """Represents an If token"""
 
+    __slots__ = ("condition", "body")
+
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
 
-    def to_dict(self):
-        return {
-            "type": "If",
-            "condition": self.condition.to_dict(),
-            "body": [b.to_dict() for b in self.body],
-        }
+    def fields(self):
+        return {"type": "If"}, (("condition", self.condition), ("body", self.body))
 
     def __repr__(self):
         return f"If{self.condition, self.body}"
@@ -195,16 +268,14 @@ class If(AST):
 class While(AST):
     """Represents a While token"""
 
+    __slots__ = ("condition", "body")
+
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
 
-    def to_dict(self):
-        return {
-            "type": "While",
-            "condition": self.condition.to_dict(),
-            "body": [b.to_dict() for b in self.body],
-        }
+    def fields(self):
+        return {"type": "While"}, (("condition", self.condition), ("body", self.body))
 
     def __repr__(self):
         return f"While({self.condition, self.body})"
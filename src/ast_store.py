@@ -0,0 +1,145 @@
+"""Compiled ASTs kept for paging: clients get the top levels of a tree and
+fetch deeper subtrees as they expand them, by stable node ID"""
+
+import collections
+import threading
+
+from .serialize import loads
+
+
+class AstTree:
+    """An AST in its to_dict form, numbered for paging. A node's ID is its
+    index in pre-order, children in field order, so the same source always
+    gets the same IDs"""
+
+    def __init__(self, root):
+        # nodes[id] is the node dict, sizes[id] the nodes in its subtree
+        self.nodes = nodes = []
+        stack = [root]
+
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+
+            for value in reversed(list(node.values())):
+                if isinstance(value, dict):
+                    stack.append(value)
+                elif isinstance(value, list):
+                    stack.extend(reversed(value))
+
+        # A subtree's children all follow it, so sizes fill in backwards
+        self.sizes = sizes = [1] * len(nodes)
+        for index in range(len(nodes) - 1, -1, -1):
+            child = index + 1
+            for _ in range(count_children(nodes[index])):
+                sizes[index] += sizes[child]
+                child += sizes[child]
+
+    def page(self, node_id, depth, offset=0, limit=None):
+        """Return the subtree at node_id down to depth levels below it, as
+        nested dicts shaped like to_dict's. Every node also gets its "id"
+        and "children", its number of child nodes. Nodes at the last level
+        keep their scalar fields only. Child lists hold at most limit items,
+        those of node_id starting at offset, and each list field also gets
+        "<field>_total", the length of the whole list, so the rest can be
+        paged in"""
+
+        nodes = self.nodes
+        sizes = self.sizes
+        root = {}
+        stack = [(node_id, 0, root, "node")]
+
+        while stack:
+            index, level, parent, key = stack.pop()
+            node = nodes[index]
+
+            entry = parent[key] = {"id": index}
+            children = []
+            for name, value in node.items():
+                if isinstance(value, (dict, list)):
+                    children.append((name, value))
+                else:
+                    entry[name] = value
+            entry["children"] = count_children(node)
+
+            if level == depth:
+                continue
+
+            child = index + 1
+            for name, value in children:
+                if isinstance(value, dict):
+                    entry[name] = None
+                    stack.append((child, level + 1, entry, name))
+                    child += sizes[child]
+                    continue
+
+                entry[name + "_total"] = len(value)
+                first = offset if level == 0 else 0
+                stop = len(value) if limit is None else min(first + limit, len(value))
+                items = entry[name] = [None] * max(0, stop - first)
+
+                for i in range(len(value)):
+                    if first <= i < stop:
+                        stack.append((child, level + 1, items, i - first))
+                    child += sizes[child]
+
+        return root["node"]
+
+
+def count_children(node):
+    """Return the number of child nodes of a node dict"""
+
+    count = 0
+    for value in node.values():
+        if isinstance(value, dict):
+            count += 1
+        elif isinstance(value, list):
+            count += len(value)
+    return count
+
+
+class AstStore:
+    """The most recently used AstTrees by AST ID, up to max_entries. load,
+    if given, returns the AST JSON for an ID this store does not hold, or
+    None, so a tree compiled by another worker can be paged from the
+    shared compile cache"""
+
+    def __init__(self, max_entries=64, load=None):
+        self.max_entries = max_entries
+        self.load = load
+        self.lock = threading.Lock()
+        self.trees = collections.OrderedDict()
+
+    def put(self, ast_id, ast_json):
+        """Return the tree for ast_id, built from ast_json unless held"""
+
+        with self.lock:
+            tree = self.trees.get(ast_id)
+            if tree is not None:
+                self.trees.move_to_end(ast_id)
+                return tree
+
+        tree = AstTree(loads(ast_json))
+
+        with self.lock:
+            self.trees[ast_id] = tree
+            self.trees.move_to_end(ast_id)
+            while len(self.trees) > self.max_entries:
+                self.trees.popitem(last=False)
+
+        return tree
+
+    def get(self, ast_id):
+        """Return the tree for ast_id, or None if it is not held and cannot
+        be loaded"""
+
+        with self.lock:
+            tree = self.trees.get(ast_id)
+            if tree is not None:
+                self.trees.move_to_end(ast_id)
+                return tree
+
+        ast_json = None if self.load is None else self.load(ast_id)
+        if ast_json is None:
+            return None
+        return self.put(ast_id, ast_json)
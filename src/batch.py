@@ -0,0 +1,171 @@
+"""Compiles many sources in parallel across a pool of worker processes"""
+
+import concurrent.futures
+import itertools
+import os
+import threading
+import time
+
+from .pipeline import compile_source, compile_tree
+from .serialize import dumps_binary, to_json
+
+# Batches this small compile in the calling process, skipping the round trip
+INLINE_LIMIT = 1
+
+
+def compile_item(source, engine="char", options=None):
+    """Compiles one source, returning (error, c_code, ast_json). Errors are
+    returned rather than raised so one bad source does not fail the batch.
+    Each call builds its own lexer, parser and code generator. options are
+    keyword arguments for compile_source"""
+
+    try:
+        c_code, ast_json = compile_source(source, engine, **(options or {}))
+    except Exception as e:
+        return str(e), None, None
+
+    return None, c_code, ast_json
+
+
+def compile_file(job, engine="char", options=None, ast_format="json"):
+    """Compiles the file of a (source path, C path, AST path) job, writing the
+    C and the AST, as indented JSON or in the binary format. Returns (error,
+    seconds), with errors returned like compile_item's"""
+
+    source_path, c_path, ast_path = job
+    start = time.perf_counter()
+
+    try:
+        with open(source_path, "r", encoding="utf-8") as source_file:
+            source = source_file.read()
+
+        program, c_code = compile_tree(source, engine, **(options or {}))
+        if ast_format == "binary":
+            ast = dumps_binary(program)
+        else:
+            ast = to_json(program, indent=4)
+
+        write_atomic(c_path, c_code.encode())
+        write_atomic(ast_path, ast if isinstance(ast, bytes) else ast.encode())
+    except Exception as e:
+        return str(e), time.perf_counter() - start
+
+    return None, time.perf_counter() - start
+
+
+def write_atomic(path, data):
+    """Writes data to path through a temporary file renamed into place, so an
+    interrupted run never leaves a partial output"""
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as output:
+            output.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class BatchCompiler:
+    """Fans a batch of sources out over a lazily started process pool and
+    returns the results in submission order. A pool whose worker died or
+    whose batch timed out is dropped and a new one started for the next
+    batch"""
+
+    def __init__(self, workers=None, engine="char", **options):
+        self.workers = workers or os.cpu_count() or 1
+        self.engine = engine
+        self.options = options
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def pool(self):
+        """Return the process pool, starting it on first use"""
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+            return self.executor
+
+    def discard(self, executor):
+        """Shuts down a broken or timed out pool, killing the workers still
+        running its tasks. Another thread may already have replaced it"""
+
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+
+        # Other threads' batches on this pool fail as if a worker died
+        processes = list((executor._processes or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    def compile(self, sources, timeout=None):
+        """Return one (error, c_code, ast_json) per source, in order, giving
+        up on the sources not compiled within timeout seconds, if given"""
+
+        return self.map(
+            compile_item,
+            list(sources),
+            self.engine,
+            self.options,
+            failed=lambda error: (error, None, None),
+            timeout=timeout,
+        )
+
+    def compile_files(self, jobs, ast_format="json"):
+        """Compiles (source path, C path, AST path) jobs, returning one
+        (error, seconds) per job, in order. Workers read and write the files
+        themselves, so no program text crosses between processes"""
+
+        return self.map(
+            compile_file,
+            list(jobs),
+            self.engine,
+            self.options,
+            ast_format,
+            failed=lambda error: (error, 0.0),
+        )
+
+    def map(self, function, items, *arguments, failed, timeout=None):
+        """Return function(item, *arguments) for each item, in order. Items
+        left without a result when a worker dies or timeout seconds pass
+        get failed(error message) instead"""
+
+        repeated = [itertools.repeat(argument) for argument in arguments]
+
+        if self.workers == 1 or len(items) <= INLINE_LIMIT:
+            return list(map(function, items, *repeated))
+
+        # A few tasks per worker keeps them busy without a round trip per item
+        chunksize = max(1, len(items) // (self.workers * 4))
+        executor = self.pool()
+        results = []
+
+        try:
+            for result in executor.map(
+                function, items, *repeated, timeout=timeout, chunksize=chunksize
+            ):
+                results.append(result)
+            return results
+        except concurrent.futures.BrokenExecutor:
+            self.discard(executor)
+            error = "Error: A compile worker process died"
+        except concurrent.futures.TimeoutError:
+            # The late tasks would otherwise keep their workers busy
+            self.discard(executor)
+            error = "Error: Batch compile timed out"
+
+        return results + [failed(error) for _ in items[len(results) :]]
+
+    def shutdown(self):
+        """Stops the worker processes"""
+
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
@@ -0,0 +1,390 @@
+"""Compiles a Program AST to bytecode for the stack VM in src/vm.py.
+
+Every value has a static C kind, the same one the generated C gives it, and
+the compiler picks a typed instruction for each operation, inserting
+conversions where C applies its usual arithmetic conversions. Variables are
+resolved to slot indices, and IF, WHILE and GOTO lower to jumps"""
+
+from .ast import Bin_Op, Float, Goto, If, Input, Label, Let, Num, Print, String
+from .ast import Var, While
+from .code_gen import PRECEDENCE, starts_with_string
+from .token_type import TokenType
+
+# Value kinds: C int, long long, float, double and char *
+I32, I64, F32, F64, STR = range(5)
+
+C_KINDS = {"int": I32, "long long": I64, "float": F32, "double": F64, "char *": STR}
+
+# Opcodes. Each instruction is an (opcode, argument) pair
+(
+    CONST,
+    LOAD,
+    STORE,
+    ADD_I32,
+    SUB_I32,
+    MUL_I32,
+    DIV_I32,
+    ADD_I64,
+    SUB_I64,
+    MUL_I64,
+    DIV_I64,
+    ADD_F32,
+    SUB_F32,
+    MUL_F32,
+    DIV_F32,
+    ADD_F64,
+    SUB_F64,
+    MUL_F64,
+    DIV_F64,
+    EQ,
+    NE,
+    LT,
+    LE,
+    GT,
+    GE,
+    TO_I32,
+    TO_I64,
+    TO_F32,
+    TO_F64,
+    DUP,
+    JUMP,
+    JUMP_IF_FALSE,
+    PRINT_INT,
+    PRINT_FLOAT,
+    PRINT_STR,
+    INPUT,
+    HALT,
+) = range(37)
+
+ARITHMETIC = {
+    TokenType.PLUS: (ADD_I32, ADD_I64, ADD_F32, ADD_F64),
+    TokenType.MINUS: (SUB_I32, SUB_I64, SUB_F32, SUB_F64),
+    TokenType.ASTERISK: (MUL_I32, MUL_I64, MUL_F32, MUL_F64),
+    TokenType.SLASH: (DIV_I32, DIV_I64, DIV_F32, DIV_F64),
+}
+
+COMPARISONS = {
+    TokenType.EQEQ: EQ,
+    TokenType.NOTEQ: NE,
+    TokenType.LT: LT,
+    TokenType.LTEQ: LE,
+    TokenType.GT: GT,
+    TokenType.GTEQ: GE,
+}
+
+CONVERSIONS = {I32: TO_I32, I64: TO_I64, F32: TO_F32, F64: TO_F64}
+
+ZEROS = {I32: 0, I64: 0, F32: 0.0, F64: 0.0, STR: ""}
+
+INT_MAX = (1 << 31) - 1
+
+
+class Code:
+    """A compiled program: instructions plus the name and kind of each slot"""
+
+    __slots__ = ("instructions", "names", "kinds")
+
+    def __init__(self, instructions, names, kinds):
+        self.instructions = instructions
+        self.names = names
+        self.kinds = kinds
+
+    def initial_slots(self):
+        """Return the zeroed slot values a run starts from"""
+
+        return [ZEROS[kind] for kind in self.kinds]
+
+
+class BytecodeCompiler:
+    """Lowers a Program to bytecode. Without types, variables get the types
+    CodeGenerator declares them with and PRINT converts through float like
+    the generated printf; with a {variable: C type} map from type_infer they
+    get the inferred types and PRINT formats like the typed generator.
+    Variables live for the whole program, so a variable read after the
+    block declaring it runs here though the generated C does not compile"""
+
+    def __init__(self, types=None):
+        self.typed = types is not None
+        self.slots = {}
+        self.names = []
+        self.kinds = []
+        self.instructions = []
+        self.labels = {}
+        self.gotos = []
+
+        for name, c_type in (types or {}).items():
+            self.declare(name, C_KINDS[c_type])
+
+    def abort(self, message):
+        """Handle errors"""
+
+        raise Exception("Error: " + message)
+
+    def emit(self, opcode, argument=None):
+        """Appends an instruction, returning its address"""
+
+        self.instructions.append((opcode, argument))
+        return len(self.instructions) - 1
+
+    def patch(self, address, target):
+        """Points the jump at address to target"""
+
+        self.instructions[address] = (self.instructions[address][0], target)
+
+    def declare(self, name, kind):
+        """Return the slot of a variable, giving it kind on first sight"""
+
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = len(self.names)
+            self.names.append(name)
+            self.kinds.append(kind)
+        return slot
+
+    def slot(self, name):
+        """Return the slot of a declared variable"""
+
+        slot = self.slots.get(name)
+        if slot is None:
+            self.abort(f"Variable '{name}' not found")
+        return slot
+
+    def program(self, node):
+        """Return the Code for a Program. Blocks are expanded on an explicit
+        stack of statements and callables, so nesting does not recurse"""
+
+        stack = list(reversed(node.statements))
+
+        while stack:
+            item = stack.pop()
+
+            if callable(item):
+                item()
+            elif isinstance(item, (If, While)):
+                stack.extend(reversed(self.block_items(item)))
+            else:
+                self.simple_statement(item)
+
+        self.emit(HALT)
+
+        for address, label in self.gotos:
+            if label not in self.labels:
+                self.abort("GOTO label undeclared: " + label)
+            self.patch(address, self.labels[label])
+
+        return Code(self.instructions, self.names, self.kinds)
+
+    def block_items(self, node):
+        """Return the work items lowering an IF or WHILE to jumps"""
+
+        addresses = []
+
+        def start():
+            addresses.append(len(self.instructions))
+            self.condition(node.condition)
+            addresses.append(self.emit(JUMP_IF_FALSE))
+
+        def end():
+            if isinstance(node, While):
+                self.emit(JUMP, addresses[0])
+            self.patch(addresses[1], len(self.instructions))
+
+        return [start, *node.body, end]
+
+    def simple_statement(self, node):
+        """Lowers a statement other than IF and WHILE"""
+
+        if isinstance(node, Let):
+            name = node.name_token.text
+            if name not in self.slots:
+                self.declare(name, self.declared_kind(node.expression))
+            slot = self.slot(name)
+            self.expression(node.expression, self.kinds[slot])
+            self.emit(STORE, slot)
+
+        elif isinstance(node, Print):
+            self.print_statement(node.expression)
+
+        elif isinstance(node, Input):
+            slot = self.declare(node.input_token.text, F32)
+            if self.kinds[slot] == STR:
+                self.abort("Cannot INPUT string variable " + node.input_token.text)
+            self.emit(INPUT, slot)
+
+        elif isinstance(node, Label):
+            self.labels[node.value.text] = len(self.instructions)
+
+        elif isinstance(node, Goto):
+            self.gotos.append((self.emit(JUMP), node.value.text))
+
+    def declared_kind(self, expression):
+        """The kind CodeGenerator.get_c_type declares a LET value with"""
+
+        if isinstance(expression, String):
+            return STR
+        if isinstance(expression, Num):
+            return I32
+        if isinstance(expression, Var):
+            return self.kinds[self.slot(expression.value)]
+        return F32
+
+    def print_statement(self, expression):
+        """Lowers PRINT like the generated printf"""
+
+        if self.typed:
+            kind = self.expression(expression)
+            self.emit(
+                PRINT_STR if kind == STR else PRINT_FLOAT if kind == F64 else PRINT_INT
+            )
+            return
+
+        if starts_with_string(expression):
+            if not isinstance(expression, String):
+                self.abort("Cannot use a string in arithmetic")
+            self.emit(CONST, expression.value)
+            self.emit(PRINT_STR)
+            return
+
+        self.expression(expression, cast=cast_operand(expression))
+        self.emit(PRINT_FLOAT)
+
+    def condition(self, node):
+        """Lowers a block condition. x = e assigns in the generated C and
+        tests the value assigned"""
+
+        if isinstance(node, Bin_Op) and node.op.kind == TokenType.EQ:
+            if not isinstance(node.left, Var):
+                self.abort("Cannot assign to an expression")
+            slot = self.slot(node.left.value)
+            self.expression(node.right, self.kinds[slot])
+            self.emit(DUP)
+            self.emit(STORE, slot)
+        else:
+            self.expression(node)
+
+    def expression(self, node, target=None, cast=None):
+        """Lowers an expression, converting the result to target if given.
+        cast is the operand the legacy PRINT casts to float. Return the kind
+        of the value left on the stack"""
+
+        kinds = self.kinds_of(node, cast)
+        stack = [node]
+
+        while stack:
+            item = stack.pop()
+
+            if isinstance(item, tuple):
+                self.emit(*item)
+
+            elif isinstance(item, Bin_Op):
+                left, right = kinds[item.left], kinds[item.right]
+                operand = max(left, right)
+                comparison = COMPARISONS.get(item.op.kind)
+
+                if comparison is not None:
+                    opcode = comparison
+                elif item.op.kind in ARITHMETIC:
+                    opcode = ARITHMETIC[item.op.kind][operand]
+                else:
+                    self.abort("Unexpected operator " + item.op.text)
+
+                if item is cast:
+                    stack.append((TO_F32, None))
+                stack.append((opcode, None))
+                if right != operand:
+                    stack.append((CONVERSIONS[operand], None))
+                stack.append(item.right)
+                if left != operand:
+                    stack.append((CONVERSIONS[operand], None))
+                stack.append(item.left)
+
+            else:
+                self.leaf(item)
+                if item is cast:
+                    self.emit(TO_F32)
+
+        kind = kinds[node]
+        if target is not None and target != kind:
+            if STR in (target, kind):
+                self.abort("Cannot mix strings and numbers")
+            self.emit(CONVERSIONS[target])
+            return target
+        return kind
+
+    def leaf(self, node):
+        """Lowers a literal or variable"""
+
+        if isinstance(node, Var):
+            self.emit(LOAD, self.slot(node.value))
+        elif isinstance(node, Num):
+            self.emit(CONST, literal_value(node.value))
+        elif isinstance(node, Float):
+            self.emit(CONST, float(node.value))
+        elif isinstance(node, String):
+            self.emit(CONST, node.value)
+        else:
+            self.abort(f"Cannot lower {node}")
+
+    def kinds_of(self, node, cast=None):
+        """Return {subexpression: kind}, following C's usual arithmetic
+        conversions; the cast operand is float whatever its own kind"""
+
+        kinds = {}
+        stack = [(node, False)]
+
+        while stack:
+            item, done = stack.pop()
+
+            if isinstance(item, Bin_Op) and not done:
+                stack += ((item, True), (item.right, False), (item.left, False))
+                continue
+
+            if isinstance(item, Bin_Op):
+                left, right = kinds[item.left], kinds[item.right]
+                if STR in (left, right):
+                    self.abort("Cannot use a string in arithmetic")
+                kind = I32 if item.op.kind in COMPARISONS else max(left, right)
+            elif isinstance(item, Var):
+                kind = self.kinds[self.slot(item.value)]
+            elif isinstance(item, Num):
+                kind = I32 if abs(literal_value(item.value)) <= INT_MAX else I64
+            elif isinstance(item, Float):
+                kind = F64
+            else:
+                kind = STR
+
+            kinds[item] = F32 if item is cast else kind
+
+        return kinds
+
+
+def literal_value(text):
+    """Return an integer literal's value as C reads it"""
+
+    digits = text.lstrip("-")
+    value = int(digits, 8) if len(digits) > 1 and digits[0] == "0" else int(digits)
+    return -value if text.startswith("-") else value
+
+
+def cast_operand(expression):
+    """Return the operand the legacy PRINT's (float) cast applies to: the
+    leftmost operand of the emitted C, which is a whole parenthesized group
+    when CodeGenerator had to bracket a left operand"""
+
+    node = expression
+
+    while isinstance(node, Bin_Op):
+        left = node.left
+        if isinstance(left, Bin_Op) and PRECEDENCE.get(
+            left.op.kind, 0
+        ) < PRECEDENCE.get(node.op.kind, 0):
+            return left
+        node = left
+
+    return node
+
+
+def compile_program(program, types=None):
+    """Return the Code for program"""
+
+    return BytecodeCompiler(types).program(program)
@@ -0,0 +1,341 @@
+"""Content addressed compile cache shared by server workers through SQLite"""
+
+import collections
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from .scheduler import CANCELLED, DEADLINE, Rejected
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    c_code TEXT NOT NULL,
+    ast_json TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE TABLE IF NOT EXISTS inflight (
+    key TEXT PRIMARY KEY,
+    started REAL NOT NULL
+);
+"""
+
+# Seconds between last_used updates for an entry, so hits rarely write
+TOUCH_INTERVAL = 1.0
+# Seconds a follower sleeps between checks for another worker's result
+POLL_INTERVAL = 0.005
+# Seconds a follower in the same process waits between deadline checks
+WAIT_INTERVAL = 0.05
+# Seconds after which an unfinished compile is presumed dead and taken over
+LEASE = 30.0
+
+
+def compiler_version():
+    """Return a digest of the compiler's own source files, so cached output
+    is invalidated whenever the compiler changes"""
+
+    digest = hashlib.sha256()
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+
+    for name in sorted(os.listdir(package_dir)):
+        if name.endswith(".py"):
+            with open(os.path.join(package_dir, name), "rb") as source_file:
+                digest.update(name.encode() + b"\0" + source_file.read())
+
+    return digest.hexdigest()
+
+
+def wait_time(expires, interval, cancelled=None):
+    """Return how long a follower may wait before checking again, at most
+    interval seconds, or raises Rejected once expires, a time.monotonic()
+    deadline, has passed or the threading.Event cancelled is set"""
+
+    if cancelled is not None and cancelled.is_set():
+        raise Rejected(CANCELLED, "Compile cancelled")
+
+    if expires is None:
+        return interval
+
+    remaining = expires - time.monotonic()
+    if remaining <= 0:
+        raise Rejected(
+            DEADLINE, "Compile deadline exceeded waiting for another compile"
+        )
+    return min(interval, remaining)
+
+
+class CompileCache:
+    """Caches generated C and AST JSON keyed by a hash of the source, the
+    compiler version and the compile options.
+
+    Entries live in a SQLite file that every worker process opens, evicted
+    least recently used first once max_entries or max_bytes is exceeded. A
+    small per-process LRU sits in front of the file. Concurrent requests for
+    the same key compile once: within a process through an in-flight event,
+    across processes through a lease row in the inflight table, taken over
+    once it is lease seconds old"""
+
+    def __init__(
+        self,
+        path,
+        max_entries=10000,
+        max_bytes=256 << 20,
+        memory_entries=256,
+        version=None,
+        lease=LEASE,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.version = version if version is not None else compiler_version()
+        self.lease = lease
+
+        self.memory = collections.OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.counts = collections.Counter()
+
+        self.connection().executescript(SCHEMA)
+
+    def connection(self):
+        """Return this thread's connection to the cache file"""
+
+        connection = getattr(self.local, "connection", None)
+
+        # Connections must not cross a fork, e.g. gunicorn --preload
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+
+        return connection
+
+    def key(self, source, options=""):
+        """Return the cache key for source compiled with options"""
+
+        digest = hashlib.sha256()
+        digest.update(self.version.encode() + b"\0" + options.encode() + b"\0")
+        digest.update(source.encode("utf-8", "surrogatepass"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached (c_code, ast_json) for key, or None"""
+
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                self.counts["hits"] += 1
+                self.counts["memory_hits"] += 1
+                return entry
+
+        entry = self.load(key)
+
+        if entry is None:
+            return None
+
+        with self.lock:
+            self.counts["hits"] += 1
+            self.remember(key, entry)
+
+        return entry
+
+    def load(self, key):
+        """Reads key from the cache file, refreshing its recency"""
+
+        row = (
+            self.connection()
+            .execute(
+                "SELECT c_code, ast_json, last_used FROM entries WHERE key = ?", (key,)
+            )
+            .fetchone()
+        )
+
+        if row is None:
+            return None
+
+        now = time.time()
+        if now - row[2] > TOUCH_INTERVAL:
+            self.connection().execute(
+                "UPDATE entries SET last_used = ? WHERE key = ?", (now, key)
+            )
+
+        return row[0], row[1]
+
+    def put(self, key, c_code, ast_json):
+        """Stores an entry and evicts the least recently used ones over budget"""
+
+        entry = (c_code, ast_json)
+        size = len(c_code) + len(ast_json)
+        connection = self.connection()
+
+        connection.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+            (key, c_code, ast_json, size, time.time()),
+        )
+        self.evict(connection)
+
+        with self.lock:
+            self.remember(key, entry)
+
+    def evict(self, connection):
+        """Deletes least recently used entries until the file is in budget"""
+
+        count, total = connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        evicted = 0
+        rows = connection.execute(
+            "SELECT key, size FROM entries ORDER BY last_used"
+        ).fetchall()
+
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+
+            connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+            evicted += 1
+
+        with self.lock:
+            self.counts["evictions"] += evicted
+
+    def remember(self, key, entry):
+        """Adds entry to the per-process LRU. Caller holds self.lock"""
+
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get_or_compile(
+        self, source, compile_source, options="", timeout=None, cancelled=None
+    ):
+        """Return (c_code, ast_json) for source, calling compile_source(source)
+        only if no worker has the result cached or is already compiling it.
+        Waiting for another thread or worker gives up after timeout seconds,
+        if given, raising Rejected with reason DEADLINE, or as soon as the
+        threading.Event cancelled is set, with reason CANCELLED"""
+
+        key = self.key(source, options)
+        expires = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            entry = self.get(key)
+            if entry is not None:
+                return entry
+
+            with self.lock:
+                event = self.pending.get(key)
+                leader = event is None
+                if leader:
+                    event = self.pending[key] = threading.Event()
+
+            if not leader:
+                # Another thread in this process is compiling it
+                with self.lock:
+                    self.counts["coalesced"] += 1
+                while not event.wait(wait_time(expires, WAIT_INTERVAL, cancelled)):
+                    pass
+                continue
+
+            try:
+                return self.compile_once(
+                    key, source, compile_source, expires, cancelled
+                )
+            finally:
+                with self.lock:
+                    del self.pending[key]
+                event.set()
+
+    def compile_once(self, key, source, compile_source, expires=None, cancelled=None):
+        """Compiles under the cross-process lease for key, or waits until
+        expires, or until cancelled is set, for the worker that holds it to
+        finish or its lease to run out"""
+
+        connection = self.connection()
+
+        while True:
+            now = time.time()
+            connection.execute(
+                "DELETE FROM inflight WHERE key = ? AND started < ?",
+                (key, now - self.lease),
+            )
+            acquired = connection.execute(
+                "INSERT OR IGNORE INTO inflight VALUES (?, ?)", (key, now)
+            ).rowcount
+
+            if acquired:
+                break
+
+            with self.lock:
+                self.counts["coalesced"] += 1
+
+            while True:
+                row = connection.execute(
+                    "SELECT started FROM inflight WHERE key = ?", (key,)
+                ).fetchone()
+                # Past its lease the holder is presumed dead, so go take it
+                if row is None or row[0] < time.time() - self.lease:
+                    break
+                time.sleep(wait_time(expires, POLL_INTERVAL, cancelled))
+
+            entry = self.get(key)
+            if entry is not None:
+                return entry
+
+        try:
+            # The holder of an expired lease may have finished meanwhile
+            entry = self.get(key)
+            if entry is not None:
+                return entry
+
+            with self.lock:
+                self.counts["misses"] += 1
+
+            c_code, ast_json = compile_source(source)
+            self.put(key, c_code, ast_json)
+            return c_code, ast_json
+        finally:
+            connection.execute("DELETE FROM inflight WHERE key = ?", (key,))
+
+    def stats(self):
+        """Return hit, miss and size statistics"""
+
+        count, total = (
+            self.connection()
+            .execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries")
+            .fetchone()
+        )
+
+        with self.lock:
+            stats = {
+                name: self.counts[name]
+                for name in ["hits", "memory_hits", "misses", "coalesced", "evictions"]
+            }
+
+        stats["entries"] = count
+        stats["bytes"] = total
+        return stats
+
+    def clear(self):
+        """Drops every cached entry"""
+
+        self.connection().execute("DELETE FROM entries")
+
+        with self.lock:
+            self.memory.clear()
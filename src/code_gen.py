@@ -1,90 +1,307 @@
 """Class defines an emitter"""
 
 from .ast import *
+from .emitter import Emitter
+from .optimize import is_negation
+from .source_map import SourceMap
+from .type_infer import INT, LONG_LONG, PRINT_FORMATS, SCAN_FORMATS, STRING, ZEROS
+from .type_infer import expression_type
+
+PROLOGUE = "#include <stdio.h>\n\nint main(void) {\n"
+EPILOGUE = "    return 0; \n}"
+
+# Statement prefix by block depth, and the closing line of every block
+INDENTS = ("  ", "    ")
+BLOCK_END = "  }"
+
+# Binding strength of arithmetic operators; comparisons bind loosest
+PRECEDENCE = {
+    TokenType.PLUS: 1,
+    TokenType.MINUS: 1,
+    TokenType.ASTERISK: 2,
+    TokenType.SLASH: 2,
+}
+# Binding strength of a 0 - x emitted as C's unary minus
+UNARY = 3
 
 
 class CodeGenerator:
-    """Represents a code generator object that goes through the AST to emit C code"""
+    """Represents a code generator object that goes through the AST to emit C code.
+    Visitors return work items instead of recursing into children: strings
+    are written, nodes are visited and callables are called, in order.
 
-    def __init__(self):
+    With types, a {variable: C type} map from type_infer, every variable is
+    declared once at the top of main with that type, and PRINT and INPUT use
+    the matching formats instead of converting through float"""
+
+    def __init__(self, types=None):
         self.code = ""
+        self.types = types
         self.vars_declared = {}
+        self.emitter = Emitter(indents=INDENTS)
+        self.visitors = {}
+        # (emitter part index, source offset) of each line start to map, while
+        # generate_mapped runs
+        self.marks = None
 
     def generate(self, node):
-        """Calls visit function respective to node"""
+        """Returns the C code for node"""
+
+        outer = self.emitter
+        self.emitter = Emitter(indents=INDENTS)
+
+        try:
+            self.emit(node)
+            return self.emitter.getvalue()
+        finally:
+            self.emitter = outer
+
+    def generate_mapped(self, node, location):
+        """Returns the C code for node and a SourceMap from its lines to the
+        source lines of the statements they came from. location turns a
+        source offset into a (line, column) pair, like Lexer.location"""
+
+        outer = self.emitter
+        self.emitter = emitter = Emitter(indents=INDENTS)
+        self.marks = marks = []
+
+        try:
+            self.emit(node)
+        finally:
+            self.emitter = outer
+            self.marks = None
+
+        parts = emitter.parts
+        source_map = SourceMap()
+        c_line = 1
+        counted = 0
+
+        for index, offset in marks:
+            for part in parts[counted:index]:
+                c_line += part.count("\n")
+            counted = index
+            source_map.add(c_line, 0 if offset is None else location(offset)[0])
+
+        return "".join(parts), source_map
+
+    def mark(self, offset):
+        """Work item recording that the C written next comes from the source
+        line holding offset, or from no source line if offset is None"""
+
+        return lambda: self.marks.append((len(self.emitter.parts), offset))
+
+    def emit(self, node):
+        """Emits node, expanding work items on an explicit stack so deep
+        trees do not recurse"""
+
+        write = self.emitter.write
+        visitors = self.visitors
+        stack = [node]
+
+        while stack:
+            item = stack.pop()
 
-        method_name = f"visit_{node.__class__.__name__.lower()}"
-        visitor = getattr(self, method_name, self.generic_visit)
-        return visitor(node)
+            if isinstance(item, str):
+                write(item)
+
+            elif isinstance(item, AST):
+                visitor = visitors.get(item.__class__)
+
+                if visitor is None:
+                    method_name = f"visit_{item.__class__.__name__.lower()}"
+                    visitor = getattr(self, method_name, self.generic_visit)
+                    visitors[item.__class__] = visitor
+
+                stack.extend(reversed(visitor(item)))
+
+            else:
+                item()
 
     def visit_num(self, node):
         """Emits value at AST node type Num"""
-        return node.value
+        return (node.value,)
 
     def visit_float(self, node):
         """Emits value at AST node type Float"""
-        return node.value
+        return (node.value,)
 
     def visit_string(self, node):
         """Emits value at AST node type String"""
-        return f'"{node.value}"'
+        return (f'"{node.value}"',)
 
     def visit_var(self, node):
         """Emits value at AST node type Var"""
-        return node.value
+        return (node.value,)
 
     def visit_bin_op(self, node):
-        """Emits value at AST node type Bin_Op"""
-        return f"{self.generate(node.left)} {node.op.text} {self.generate(node.right)}"
+        """Emits value at AST node type Bin_Op. Operands that C would group
+        differently from the tree, like the 0 - x the parser builds for unary
+        minus, are parenthesized. That 0 - x is emitted as -x where C gives
+        both the same value"""
+
+        if self.negates(node):
+            operand = node.right
+            if operand.value.startswith("-"):
+                return ("-(", operand, ")")
+            return ("-", operand)
+
+        binding = PRECEDENCE.get(node.op.kind, 0)
+        left, right = node.left, node.right
+        items = (left, f" {node.op.text} ", right)
+
+        if isinstance(left, Bin_Op) and self.binding(left) < binding:
+            items = ("(", left, ")") + items[1:]
+
+        if isinstance(right, Bin_Op) and self.binding(right) <= binding:
+            items = items[:-1] + ("(", right, ")")
+
+        return items
+
+    def binding(self, node):
+        """Return how tightly the C emitted for Bin_Op node binds"""
+
+        if self.negates(node):
+            return UNARY
+        return PRECEDENCE.get(node.op.kind, 0)
+
+    def negates(self, node):
+        """Return true if node is a 0 - x to emit as -x: x is an int literal
+        or an int variable. A float x of zero would give -0 instead of 0"""
+
+        if not is_negation(node):
+            return False
+
+        operand = node.right
+        if isinstance(operand, Num):
+            return True
+        return (
+            isinstance(operand, Var)
+            and self.types is not None
+            and self.types.get(operand.value) in (INT, LONG_LONG)
+        )
 
     def visit_print(self, node):
         """Emits value at AST node type Print"""
 
-        expr_code = self.generate(node.expression)
+        if self.types is not None:
+            c_type = expression_type(node.expression, self.types)
+            return (f'printf("{PRINT_FORMATS[c_type]}\\n", ', node.expression, ");")
 
-        if expr_code.startswith('"'):
-            return f'printf("%s\\n", {expr_code});'
+        if starts_with_string(node.expression):
+            return ('printf("%s\\n", ', node.expression, ");")
 
         else:
-            return f'printf("%.2f\\n", (float) {expr_code});'
+            return ('printf("%.2f\\n", (float) ', node.expression, ");")
 
     def visit_program(self, node):
         """Emits value at AST node type Program"""
 
-        full_code = "#include <stdio.h>\n\n"
-        full_code += "int main(void) {\n"
+        epilogue = (EPILOGUE,) if self.marks is None else (self.mark(None), EPILOGUE)
+
+        return (
+            PROLOGUE,
+            *self.declarations(),
+            *self.statement_items(node.statements),
+            *epilogue,
+        )
+
+    def declarations(self):
+        """Lines declaring every variable up front when types are known"""
+
+        if self.types is None:
+            return ()
+
+        return tuple(
+            f"{INDENTS[0]}{c_type}{'' if c_type == STRING else ' '}{name} = "
+            f"{ZEROS[c_type]};\n"
+            for name, c_type in self.types.items()
+        )
+
+    def write_program(self, statements, output):
+        """Writes the C program for an iterable of top level statements to
+        output, one statement at a time"""
+
+        outer = self.emitter
+        self.emitter = emitter = Emitter(output, INDENTS)
+
+        try:
+            emitter.write(PROLOGUE)
+            for line in self.declarations():
+                emitter.write(line)
+
+            for stm in statements:
+                emitter.write_indent()
+                self.emit(stm)
+                emitter.write("\n")
+
+            emitter.write(EPILOGUE)
+        finally:
+            self.emitter = outer
+
+    def statement_items(self, statements):
+        """Work items emitting one line per statement at the current depth"""
+
+        items = []
+        write_indent = self.emitter.write_indent
+
+        if self.marks is not None:
+            for stm in statements:
+                start = getattr(stm, "start", None)
+                if start is not None:
+                    items.append(self.mark(start))
+                items += (write_indent, stm, "\n")
+            return items
+
+        for stm in statements:
+            items += (write_indent, stm, "\n")
 
-        for stm in node.statements:
-            code_segment = self.generate(stm)
-            full_code += "  " + code_segment + "\n"
+        return items
 
-        full_code += "    return 0; \n"
-        full_code += "}"
+    def block_items(self, node):
+        """Work items emitting the body and closing brace of a block. With a
+        source map the brace maps to the line closing the block"""
 
-        return full_code
+        end = getattr(node, "end", None)
+        closing = (BLOCK_END,)
+        if self.marks is not None and end is not None:
+            closing = (self.mark(end - 1), BLOCK_END)
+
+        return (
+            self.emitter.indent,
+            *self.statement_items(node.body),
+            self.emitter.dedent,
+            *closing,
+        )
 
     def visit_let(self, node):
         """Emits value at AST node type Let"""
 
-        rhs = self.generate(node.expression)
         var_name = node.name_token.text
+
+        if self.types is not None:
+            return (f"{var_name} = ", node.expression, ";")
+
         c_type = self.get_c_type(node.expression)
 
         if var_name not in self.vars_declared:
             self.vars_declared[var_name] = c_type
-            return f"{c_type} {var_name} = {rhs};"
+            return (f"{c_type} {var_name} = ", node.expression, ";")
 
         else:
-            return f"{var_name} = {rhs};"
+            return (f"{var_name} = ", node.expression, ";")
 
     def visit_input(self, node):
         """Emits value at node type Input"""
 
         var_name = node.input_token.text
 
+        if self.types is not None:
+            scan_format = SCAN_FORMATS[self.types[var_name]]
+            return (f'scanf("{scan_format}", &{var_name});',)
+
         if var_name not in self.vars_declared:
             self.vars_declared[var_name] = "float"
-            return f'float {var_name};\n  scanf("%f", &{var_name});'
+            return (f'float {var_name};\n  scanf("%f", &{var_name});',)
 
         else:
 
@@ -92,53 +309,35 @@ class CodeGenerator:
 
             match curr_type:
                 case "int":
-                    return f'scanf("%d", &{var_name})'
+                    return (f'scanf("%d", &{var_name});',)
 
                 case "float":
-                    return f'scanf("%f", &{var_name})'
+                    return (f'scanf("%f", &{var_name});',)
 
                 case _:
-                    return f'scanf("%f", &{var_name})'
+                    return (f'scanf("%f", &{var_name});',)
 
     def visit_label(self, node):
         """Emits value at AST node type Label"""
 
         value = node.value.text
-        return f"{value}:"
+        return (f"{value}:",)
 
     def visit_goto(self, node):
         """Emits value at AST node type Goto"""
 
         value = node.value.text
-        return f"goto {value};"
+        return (f"goto {value};",)
 
     def visit_if(self, node):
         """Emits value at AST node type If"""
 
-        cond = self.generate(node.condition)
-
-        full_code = "if (" + cond + ") {\n"
-
-        for b in node.body:
-            b_segment = self.generate(b)
-            full_code += "    " + b_segment + "\n"
-
-        full_code += "  }"
-        return full_code
+        return ("if (", node.condition, ") {\n", *self.block_items(node))
 
     def visit_while(self, node):
         """Emits value at AST node type While"""
 
-        cond = self.generate(node.condition)
-
-        full_code = "while (" + cond + ") {\n"
-
-        for b in node.body:
-            b_segment = self.generate(b)
-            full_code += "    " + b_segment + "\n"
-
-        full_code += "  }"
-        return full_code
+        return ("while (", node.condition, ") {\n", *self.block_items(node))
 
     def get_c_type(self, node):
         """Helper to infer C type of node"""
@@ -165,3 +364,13 @@ class CodeGenerator:
 
     def generic_visit(self, node):
         raise Exception(f"No visit__{node.__class__.__name__.lower()} method")
+
+
+def starts_with_string(node):
+    """Return true if the C emitted for expression node begins with a string
+    literal, found by following left operands down to the first leaf"""
+
+    while isinstance(node, Bin_Op):
+        node = node.left
+
+    return isinstance(node, String)
@@ -0,0 +1,462 @@
+"""Dead code elimination run between optimization and code generation:
+removes statements no execution reaches, LETs whose value is never read,
+labels no GOTO jumps to and blocks left with nothing to do"""
+
+from .ast import Bin_Op, Float, Goto, If, Input, Label, Let, Print, Var, While
+from .optimize import Optimizer, assigned_by_condition, constant
+from .string_token import Token
+from .token_type import TokenType
+
+# What each removed statement is counted as, in report order
+COUNTS = (
+    "unreachable",
+    "dead stores",
+    "unused labels",
+    "constant false blocks",
+    "empty blocks",
+)
+
+
+def variables(node):
+    """Return the names of the variables read by expression node"""
+
+    names = set()
+    stack = [node]
+
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Bin_Op):
+            stack += (node.left, node.right)
+        elif isinstance(node, Var):
+            names.add(node.value)
+
+    return names
+
+
+class Graph:
+    """A program flattened to one entry per statement, in source order. IF
+    and WHILE are an entry for the condition, followed by the body; a
+    WHILE body ends with an entry jumping back to it, and an exit entry ends
+    the program. Entries that are not statements hold None"""
+
+    def __init__(self):
+        self.nodes = []
+        self.successors = []
+        # Innermost enclosing block entry of each entry, or -1
+        self.parents = []
+        # Entry of each IF and WHILE to the one just past its body
+        self.ends = {}
+        # Entry of each block condition to its constant truth value
+        self.truth = {}
+        self.labels = {}
+        self.gotos = []
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, node, parent):
+        """Appends an entry falling through to the next one, returning it"""
+
+        index = len(self.nodes)
+        self.nodes.append(node)
+        self.successors.append([index + 1])
+        self.parents.append(parent)
+        return index
+
+
+class DeadCodeEliminator:
+    """Removes dead code from a Program, walking it with explicit stacks so
+    deep nesting does not recurse. The input tree is not modified.
+
+    Reachability follows GOTOs and skips the body of a block whose condition
+    folds to false, and past a WHILE whose condition folds to true. A LET is
+    kept only if some path reads the value before it is overwritten, where
+    reads by removed statements do not count. Expressions have no side
+    effects, division by zero being undefined in C, so only PRINT, INPUT, a
+    reachable x = e condition, which assigns in C, and a WHILE that may not
+    end are kept for their own sake.
+
+    Without types the generator declares a variable at its first LET or
+    INPUT, so that statement stays while the variable is used at all, with
+    a dead Bin_Op value replaced by 0.0. With a {variable: C type} map from
+    type_infer, types is pruned to the variables still used. counts holds
+    how many statements were removed for each reason in COUNTS"""
+
+    def __init__(self, types=None):
+        self.typed = types is not None
+        self.types = types
+        self.folder = Optimizer(propagate=False, types=types)
+        self.counts = dict.fromkeys(COUNTS, 0)
+        self.unused_variables = 0
+        self.before = self.after = 0
+
+    def program(self, node):
+        """Return the Program without its dead code"""
+
+        graph = self.flatten(node.statements)
+        self.reachable = self.reach(graph)
+        self.effects(graph)
+
+        forced = set()
+        dropped = set()
+
+        while True:
+            live_in = self.solve(graph, forced, dropped)
+            kept, placeholders = self.decide(graph, live_in, forced)
+            new_dropped = {index for index in graph.ends if index not in kept}
+            referenced = self.referenced(kept, placeholders)
+            new_forced = forced
+            if not self.typed:
+                new_forced = forced | {
+                    self.declaring[name]
+                    for name in referenced
+                    if name in self.declaring
+                }
+
+            if new_dropped == dropped and new_forced == forced:
+                break
+            dropped, forced = new_dropped, new_forced
+
+        self.report(graph, kept, referenced)
+        if self.typed:
+            self.types = {
+                name: c_type
+                for name, c_type in self.types.items()
+                if name in referenced
+            }
+
+        statements = self.rebuild(node.statements, graph, kept, placeholders)
+        return node.__class__(statements).copy_span(node)
+
+    def flatten(self, statements):
+        """Return the Graph of a statement list"""
+
+        graph = Graph()
+        self.index = {}
+        stack = [(stm, -1) for stm in reversed(statements)]
+
+        while stack:
+            item, parent = stack.pop()
+
+            if callable(item):
+                item()
+                continue
+
+            index = self.index[item] = graph.add(item, parent)
+
+            if isinstance(item, (If, While)):
+                graph.truth[index] = self.truth(item.condition)
+                stack.append((self.block_end(graph, item, index), None))
+                stack.extend((stm, index) for stm in reversed(item.body))
+
+            elif isinstance(item, Label):
+                graph.labels[item.value.text] = index
+
+            elif isinstance(item, Goto):
+                graph.gotos.append(index)
+
+        exit = graph.add(None, -1)
+        graph.successors[exit] = []
+
+        for index in graph.gotos:
+            graph.successors[index] = [graph.labels[graph.nodes[index].value.text]]
+
+        return graph
+
+    def block_end(self, graph, node, index):
+        """Return the callable run after the body of block node, at index,
+        is flattened. It adds the jump back of a WHILE and the edges out"""
+
+        def finish():
+            if isinstance(node, While):
+                back = graph.add(None, index)
+                graph.successors[back] = [index]
+
+            after = graph.ends[index] = len(graph)
+            value = graph.truth[index]
+
+            if value is False:
+                graph.successors[index] = [after]
+            elif value is None:
+                graph.successors[index].append(after)
+
+        return finish
+
+    def truth(self, condition):
+        """Return the truth value a condition folds to, or None"""
+
+        if assigned_by_condition(condition):
+            return None
+
+        value = constant(self.folder.expression(condition, {}))
+        return None if value is None else bool(value)
+
+    def reach(self, graph):
+        """Return a bytearray flagging the entries execution can reach"""
+
+        reachable = bytearray(len(graph))
+        stack = [0]
+
+        while stack:
+            index = stack.pop()
+            if reachable[index]:
+                continue
+            reachable[index] = 1
+            stack.extend(graph.successors[index])
+
+        return reachable
+
+    def effects(self, graph):
+        """Gives each entry bit masks of the variables it reads and writes,
+        and finds the statement declaring each variable in the legacy C"""
+
+        bits = {}
+        self.names = []
+        self.uses = uses = [0] * len(graph)
+        self.defs = defs = [0] * len(graph)
+        self.declaring = {}
+
+        def mask(names):
+            total = 0
+            for name in names:
+                if name not in bits:
+                    bits[name] = 1 << len(self.names)
+                    self.names.append(name)
+                total |= bits[name]
+            return total
+
+        for index, node in enumerate(graph.nodes):
+            if isinstance(node, Let):
+                name = node.name_token.text
+                defs[index] = mask([name])
+                uses[index] = mask(variables(node.expression))
+                self.declaring.setdefault(name, index)
+
+            elif isinstance(node, Input):
+                name = node.input_token.text
+                defs[index] = mask([name])
+                self.declaring.setdefault(name, index)
+
+            elif isinstance(node, Print):
+                uses[index] = mask(variables(node.expression))
+
+            elif isinstance(node, (If, While)):
+                condition = node.condition
+                assigned = assigned_by_condition(condition)
+                if assigned:
+                    defs[index] = mask(assigned)
+                    condition = condition.right
+                uses[index] = mask(variables(condition))
+
+    def solve(self, graph, forced, dropped):
+        """Return the variables live on entry to each reachable entry. A LET
+        only reads its value if the variable is live after it or the LET is
+        forced, and the conditions of dropped blocks read nothing"""
+
+        reachable = self.reachable
+        successors = graph.successors
+        predecessors = [[] for _ in graph.nodes]
+        for index, targets in enumerate(successors):
+            for target in targets:
+                predecessors[target].append(index)
+
+        live_in = [0] * len(graph)
+        pending = [index for index in range(len(graph)) if reachable[index]]
+        queued = bytearray(reachable)
+
+        while pending:
+            index = pending.pop()
+            queued[index] = 0
+
+            out = 0
+            for target in successors[index]:
+                out |= live_in[target]
+
+            new = self.transfer(graph, index, out, forced, dropped)
+            if new == live_in[index]:
+                continue
+
+            live_in[index] = new
+            for source in predecessors[index]:
+                if reachable[source] and not queued[source]:
+                    queued[source] = 1
+                    pending.append(source)
+
+        return live_in
+
+    def transfer(self, graph, index, out, forced, dropped):
+        """Return the variables live before entry index given those live
+        after it"""
+
+        node = graph.nodes[index]
+        written = self.defs[index]
+
+        if isinstance(node, Let) and not out & written:
+            if index not in forced:
+                return out
+            if not isinstance(node.expression, Var):
+                return out & ~written
+
+        elif index in dropped:
+            return out
+
+        return out & ~written | self.uses[index]
+
+    def live_out(self, graph, live_in, index):
+        """Return the variables live after entry index"""
+
+        out = 0
+        for target in graph.successors[index]:
+            out |= live_in[target]
+        return out
+
+    def decide(self, graph, live_in, forced):
+        """Return the set of entries to keep and the set of forced LETs
+        whose value is replaced by 0.0"""
+
+        reachable = self.reachable
+        kept = set()
+        placeholders = set()
+
+        targets = {
+            graph.nodes[index].value.text for index in graph.gotos if reachable[index]
+        }
+
+        for index, node in enumerate(graph.nodes):
+            if isinstance(node, Let):
+                live = reachable[index] and (
+                    self.live_out(graph, live_in, index) & self.defs[index]
+                )
+                if live:
+                    kept.add(index)
+                elif index in forced:
+                    kept.add(index)
+                    if isinstance(node.expression, Bin_Op):
+                        placeholders.add(index)
+
+            elif isinstance(node, (Input, Print, Goto)):
+                if reachable[index] or index in forced:
+                    kept.add(index)
+
+            elif isinstance(node, Label):
+                if node.value.text in targets:
+                    kept.add(index)
+
+        # Blocks are kept for their own sake or for a statement kept in their
+        # body. Inner entries come later, so walking backwards sees every
+        # statement of a body before its block
+        has_kept = set()
+
+        for index in range(len(graph) - 1, -1, -1):
+            node = graph.nodes[index]
+
+            if isinstance(node, (If, While)) and (
+                index in has_kept or self.needed(graph, node, index)
+            ):
+                kept.add(index)
+
+            if index in kept and graph.parents[index] >= 0:
+                has_kept.add(graph.parents[index])
+
+        return kept, placeholders
+
+    def needed(self, graph, node, index):
+        """Return true if block node at index must stay even with an empty
+        body: its condition assigns, or it is a WHILE that may loop"""
+
+        if not self.reachable[index]:
+            return False
+        if isinstance(node, While):
+            return graph.truth[index] is not False
+        return bool(self.defs[index])
+
+    def referenced(self, kept, placeholders):
+        """Return the names of the variables kept statements read or write"""
+
+        total = 0
+        for index in kept:
+            total |= self.defs[index]
+            if index not in placeholders:
+                total |= self.uses[index]
+
+        return {name for bit, name in enumerate(self.names) if total >> bit & 1}
+
+    def report(self, graph, kept, referenced):
+        """Counts the removed statements and variables"""
+
+        for index, node in enumerate(graph.nodes):
+            if node is None:
+                continue
+
+            self.before += 1
+            if index in kept:
+                self.after += 1
+            elif isinstance(node, Label):
+                self.counts["unused labels"] += 1
+            elif not self.reachable[index]:
+                self.counts["unreachable"] += 1
+            elif isinstance(node, Let):
+                self.counts["dead stores"] += 1
+            elif graph.truth[index] is False:
+                self.counts["constant false blocks"] += 1
+            else:
+                self.counts["empty blocks"] += 1
+
+        self.unused_variables = len(self.names) - len(referenced)
+
+    def rebuild(self, statements, graph, kept, placeholders):
+        """Return the kept statements of a statement list, rebuilding blocks
+        whose body lost statements"""
+
+        index = self.index
+        root = []
+        # Each frame is (block node, its remaining statements, kept body)
+        frames = [(None, iter(statements), root)]
+
+        while frames:
+            block, remaining, out = frames[-1]
+            stm = next(remaining, None)
+
+            if stm is None:
+                frames.pop()
+                if block is not None:
+                    frames[-1][2].append(self.rebuilt(block, out))
+                continue
+
+            position = index[stm]
+            if position not in kept:
+                continue
+
+            if isinstance(stm, (If, While)):
+                frames.append((stm, iter(stm.body), []))
+            elif position in placeholders:
+                value = Float(Token("0.0", TokenType.FLOAT))
+                out.append(Let(stm.name_token, value).copy_span(stm))
+            else:
+                out.append(stm)
+
+        return root
+
+    def rebuilt(self, node, body):
+        """Return block node with body, reusing node when nothing changed"""
+
+        if len(body) == len(node.body) and all(
+            new is old for new, old in zip(body, node.body)
+        ):
+            return node
+        return node.__class__(node.condition, body).copy_span(node)
+
+    def summary(self):
+        """Return a line reporting what was removed"""
+
+        reasons = ", ".join(f"{self.counts[name]} {name}" for name in COUNTS)
+        return (
+            f"Dead code: removed {self.before - self.after} of {self.before}"
+            f" statements ({reasons}) and {self.unused_variables} unused variables"
+        )
+
+
+def eliminate(program, types=None):
+    """Return a copy of program without its dead code"""
+
+    return DeadCodeEliminator(types).program(program)
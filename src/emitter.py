@@ -0,0 +1,36 @@
+"""Class defines a buffered output sink for generated code"""
+
+
+class Emitter:
+    """Appends code fragments to a shared buffer, or writes them straight to a
+    text stream, and tracks the indentation depth of the block being written.
+    Every fragment is written once, so output size grows linearly"""
+
+    def __init__(self, stream=None, indents=("    ",)):
+        self.stream = stream
+        self.parts = []
+        self.write = self.parts.append if stream is None else stream.write
+        self.indents = indents
+        self.depth = 0
+
+    def indent(self):
+        """Enters a nested block"""
+
+        self.depth += 1
+
+    def dedent(self):
+        """Leaves a nested block"""
+
+        self.depth -= 1
+
+    def write_indent(self):
+        """Writes the prefix for a line at the current depth. Depths past the
+        end of indents reuse the last entry"""
+
+        indents = self.indents
+        self.write(indents[min(self.depth, len(indents) - 1)])
+
+    def getvalue(self):
+        """Return everything written to the buffer"""
+
+        return "".join(self.parts)
@@ -0,0 +1,388 @@
+"""Incremental reparsing of top level statements for live editing sessions"""
+
+import bisect
+import collections
+
+from .ast import Goto, If, Input, Label, Let, Program, While
+from .parse import Parser
+from .string_token import KEYWORDS
+from .table_lex import MASTER_PATTERN, TableLexer
+from .token_type import TokenType
+
+OPENERS = {TokenType.IF, TokenType.WHILE}
+CLOSERS = {TokenType.ENDIF, TokenType.ENDWHILE}
+
+
+def boundaries(text, depth=0):
+    """Return the offsets just past every newline of text at block depth 0,
+    and the block depth at the end of text. Text starts at a line start
+    with the given depth. Nothing is allocated per token, and unlexable
+    input resynchronizes at the next newline so the parser reports it"""
+
+    ends = []
+    pos = 0
+    size = len(text)
+
+    while pos < size:
+        match = MASTER_PATTERN.match(text, pos)
+
+        if match is None:
+            newline = text.find("\n", pos)
+            pos = size if newline < 0 else newline
+            continue
+
+        pos = match.end()
+        group = match.lastgroup
+
+        if group == "ident":
+            kind = KEYWORDS.get(match["ident"])
+            if kind in OPENERS:
+                depth += 1
+            elif kind in CLOSERS and depth:
+                depth -= 1
+
+        elif group == "op" and depth == 0 and match["op"] == "\n":
+            ends.append(pos)
+
+    return ends, depth
+
+
+def defined_names(statements):
+    """Return the variables assigned and labels declared and gotoed anywhere
+    in statements, nested blocks included"""
+
+    defines, labels, gotos = set(), [], set()
+    stack = list(statements)
+
+    while stack:
+        node = stack.pop()
+
+        if isinstance(node, Let):
+            defines.add(node.name_token.text)
+        elif isinstance(node, Input):
+            defines.add(node.input_token.text)
+        elif isinstance(node, Label):
+            labels.append(node.value.text)
+        elif isinstance(node, Goto):
+            gotos.add(node.value.text)
+        elif isinstance(node, (If, While)):
+            stack.extend(node.body)
+
+    return defines, labels, gotos
+
+
+class ScopedNames:
+    """Set-like stand-in for Parser.symbols and Parser.labels_declared while
+    parsing one chunk: names added in the chunk, plus names known from
+    earlier chunks through lookup. Earlier names consulted are recorded"""
+
+    def __init__(self, lookup):
+        self.local = set()
+        self.imported = set()
+        self.lookup = lookup
+
+    def __contains__(self, name):
+        if name in self.local:
+            return True
+
+        if name in self.imported:
+            return True
+
+        if self.lookup(name):
+            self.imported.add(name)
+            return True
+
+        return False
+
+    def add(self, name):
+        self.local.add(name)
+
+    def __iter__(self):
+        return iter(self.local)
+
+
+class Chunk:
+    """A run of top level statements ending at a newline outside any block"""
+
+    __slots__ = ("text", "statements", "defines", "labels", "gotos", "imports")
+
+    def __init__(self, text):
+        self.text = text
+        self.statements = None
+        self.defines = set()
+        self.labels = []
+        self.gotos = set()
+        self.imports = set()
+
+
+class IncrementalParser:
+    """Keeps a program split into chunks of top level statements. An edit
+    re-lexes and reparses only the chunks it touches, reusing the AST of
+    every other chunk, and carries variable and label state across chunks.
+    Node spans are offsets into the node's chunk, so reused nodes stay valid"""
+
+    def __init__(self, source):
+        self.chunks = []
+        self.starts = []
+        self.label_counts = collections.Counter()
+        self.goto_counts = collections.Counter()
+
+        ends, _ = boundaries(source)
+        if not ends or ends[-1] != len(source):
+            ends.append(len(source))
+
+        defined, declared = set(), set()
+        start = 0
+
+        for end in ends:
+            chunk = Chunk(source[start:end])
+            self.parse_chunk(chunk, defined.__contains__, declared.__contains__)
+            defined |= chunk.defines
+            declared.update(chunk.labels)
+            self.chunks.append(chunk)
+            self.starts.append(start)
+            start = end
+
+        self.check_labels()
+
+    @property
+    def source(self):
+        """Return the current source text"""
+
+        return "".join(chunk.text for chunk in self.chunks)
+
+    @property
+    def symbols(self):
+        """Return every variable assigned in the program"""
+
+        return set().union(*(chunk.defines for chunk in self.chunks))
+
+    @property
+    def labels_declared(self):
+        """Return every label declared in the program"""
+
+        return {label for label, count in self.label_counts.items() if count > 0}
+
+    def program(self):
+        """Return the Program for the current source, raising the error a full
+        parse would if the source does not compile"""
+
+        if self.reparse_failed():
+            self.validate()
+        else:
+            self.check_labels()
+
+        statements = []
+        for chunk in self.chunks:
+            statements += chunk.statements
+        return Program(statements)
+
+    def edit(self, start, end, text):
+        """Replaces source[start:end] with text and returns the new Program.
+        Parse errors are raised after the edit is applied; the failing chunks
+        are reparsed by the next edit"""
+
+        total = self.starts[-1] + len(self.chunks[-1].text)
+        if not 0 <= start <= end <= total:
+            self.abort("Edit out of range")
+
+        first = max(bisect.bisect_right(self.starts, start) - 1, 0)
+        last = max(bisect.bisect_right(self.starts, end - 1) - 1, first)
+
+        region_start = self.starts[first]
+        region = "".join(chunk.text for chunk in self.chunks[first : last + 1])
+        region = region[: start - region_start] + text + region[end - region_start :]
+
+        texts, following = self.rechunk(region, last + 1)
+        old_chunks = self.chunks[first:following]
+        new_chunks = [Chunk(chunk_text) for chunk_text in texts]
+
+        for chunk in old_chunks:
+            self.label_counts.subtract(chunk.labels)
+            self.goto_counts.subtract(chunk.gotos)
+
+        self.chunks[first:following] = new_chunks
+
+        starts = [region_start]
+        for chunk_text in texts[:-1]:
+            starts.append(starts[-1] + len(chunk_text))
+
+        delta = len(text) - (end - start)
+        self.starts[first:following] = starts
+        for i in range(first + len(new_chunks), len(self.starts)):
+            self.starts[i] += delta
+
+        for offset, chunk in enumerate(new_chunks):
+            self.parse_at(first + offset)
+
+        repaired = self.reparse_failed()
+
+        old_defines = set().union(*(chunk.defines for chunk in old_chunks))
+        new_defines = set().union(*(chunk.defines for chunk in new_chunks))
+        old_labels = sorted(label for c in old_chunks for label in c.labels)
+        new_labels = sorted(label for c in new_chunks for label in c.labels)
+
+        # Later chunks only depend on which names the edited chunks define.
+        # program() checks the labels either way
+        if repaired or new_defines != old_defines or new_labels != old_labels:
+            self.validate()
+
+        return self.program()
+
+    def rechunk(self, text, following):
+        """Splits edited text into chunks, absorbing the old chunks from index
+        following on until a chunk boundary lines up again. Return the chunk
+        texts and the index of the first old chunk not absorbed"""
+
+        texts = []
+        tail = []
+        depth = 0
+        piece = text
+
+        while True:
+            ends, depth = boundaries(piece, depth)
+            start = 0
+
+            for end in ends:
+                tail.append(piece[start:end])
+                texts.append("".join(tail))
+                tail = []
+                start = end
+
+            if start < len(piece):
+                tail.append(piece[start:])
+
+            if not tail or following >= len(self.chunks):
+                break
+
+            piece = self.chunks[following].text
+            following += 1
+
+        if tail or not texts:
+            texts.append("".join(tail))
+
+        return texts, following
+
+    def parse_at(self, index):
+        """Parses the chunk at index against the chunks before it"""
+
+        self.parse_chunk(
+            self.chunks[index],
+            lambda name: self.defined_before(index, name),
+            lambda name: self.declared_before(index, name),
+        )
+
+    def reparse_failed(self):
+        """Retries chunks whose last parse failed. Return true if there were any"""
+
+        repaired = False
+
+        for index, chunk in enumerate(self.chunks):
+            if chunk.statements is None:
+                self.parse_at(index)
+                repaired = True
+
+        return repaired
+
+    def parse_chunk(self, chunk, defined, declared):
+        """Parses one chunk against the variables and labels of the chunks
+        before it, given as membership tests"""
+
+        self.label_counts.subtract(chunk.labels)
+        self.goto_counts.subtract(chunk.gotos)
+        chunk.statements = None
+        chunk.defines, chunk.labels, chunk.gotos = set(), [], set()
+
+        lexer = TableLexer(chunk.text)
+        local = lexer.location
+        lexer.location = lambda offset: self.locate(chunk, local(offset))
+
+        parser = Parser(lexer)
+        parser.symbols = ScopedNames(defined)
+        parser.labels_declared = ScopedNames(declared)
+
+        statements = []
+
+        while parser.check_token(TokenType.NEWLINE):
+            parser.next_token()
+
+        while not parser.check_token(TokenType.EOF):
+            node = parser.statement()
+            if node is not None:
+                statements.append(node)
+
+        chunk.defines, chunk.labels, chunk.gotos = defined_names(statements)
+        chunk.imports = parser.symbols.imported
+        chunk.statements = statements
+        self.label_counts.update(chunk.labels)
+        self.goto_counts.update(chunk.gotos)
+
+    def locate(self, chunk, location):
+        """Return a (line, column) location within chunk as one in the whole
+        source. Only errors need it, so earlier chunks are counted then"""
+
+        line, column = location
+        for earlier in self.chunks:
+            if earlier is chunk:
+                break
+            line += earlier.text.count("\n")
+        return line, column
+
+    def defined_before(self, index, name):
+        """Return true if a chunk before index assigns name"""
+
+        chunks = self.chunks
+        for i in range(index):
+            if name in chunks[i].defines:
+                return True
+        return False
+
+    def declared_before(self, index, name):
+        """Return true if a chunk before index declares label name"""
+
+        if not self.label_counts[name]:
+            return False
+
+        chunks = self.chunks
+        for i in range(index):
+            if name in chunks[i].labels:
+                return True
+        return False
+
+    def validate(self):
+        """Rechecks every chunk's dependencies on earlier chunks after an
+        edit changed which variables or labels the program defines. Chunks
+        whose earlier variables disappeared are reparsed"""
+
+        defined, declared = set(), set()
+
+        for chunk in self.chunks:
+            if chunk.statements is None or not chunk.imports <= defined:
+                self.parse_chunk(chunk, defined.__contains__, declared.__contains__)
+
+            for label in chunk.labels:
+                if label in declared:
+                    raise Exception("Error: Label already exists: " + label)
+                declared.add(label)
+
+            defined |= chunk.defines
+
+        self.check_labels()
+
+    def check_labels(self):
+        """Every label must be declared once and every GOTO must target one.
+        A failed edit can leave a duplicate behind, so this is checked over
+        the whole program rather than just the edited chunks"""
+
+        for label, count in self.label_counts.items():
+            if count > 1:
+                self.abort("Label already exists: " + label)
+
+        for label, count in self.goto_counts.items():
+            if count > 0 and self.label_counts[label] <= 0:
+                self.abort("GOTO label undeclared: " + label)
+
+    def abort(self, message):
+        """Handle errors"""
+
+        raise Exception("Error: " + message)
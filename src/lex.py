@@ -2,7 +2,10 @@
 
 import sys
 
+from .source_map import LineTable, describe
 from .string_token import Token
+from .table_lex import TableLexer
+from .token_buffer import BufferLexer
 from .token_type import TokenType
 
 
@@ -16,6 +19,10 @@ class Lexer:
         )  # Source code. Newline to simplify lexing/ parsing the last token
         self.cur_char = ""
         self.cur_pos = -1
+        # Offset of the last token returned, and the line index, built the
+        # first time a location is asked for
+        self.token_start = 0
+        self.lines = None
         self.next_char()
 
     def next_char(self):
@@ -34,10 +41,17 @@ class Lexer:
             return "\0"
         return self.source[self.cur_pos + 1]
 
+    def location(self, offset):
+        """Return the (line, column) of a source offset"""
+
+        if self.lines is None:
+            self.lines = LineTable(self.source)
+        return self.lines.location(offset)
+
     def abort(self, message):
         """Invalid token found, print error message and exit."""
 
-        raise Exception("Error: " + message)
+        raise Exception("Error: " + message + describe(self.location(self.token_start)))
 
     def skip_whitespace(self):
         """Skip whitespace except newlines, which we will use to indicate the end of a statement"""
@@ -58,6 +72,8 @@ class Lexer:
 
         self.skip_whitespace()
         self.skip_comment()
+        # EOF is placed at the end of the source, before the appended newline
+        self.token_start = min(self.cur_pos, len(self.source) - 1)
         token = None
 
         if self.cur_char == "+":
@@ -81,32 +97,36 @@ class Lexer:
         elif self.cur_char == "=":
             char_next = "="
             if self.peek() == char_next:
+                last_char = self.cur_char
                 self.next_char()
-                token = Token(self.cur_char + char_next, TokenType.EQEQ)
+                token = Token(last_char + char_next, TokenType.EQEQ)
             else:
                 token = Token(self.cur_char, TokenType.EQ)
 
         elif self.cur_char == "<":
             char_next = "="
             if self.peek() == char_next:
+                last_char = self.cur_char
                 self.next_char()
-                token = Token(self.cur_char + char_next, TokenType.LTEQ)
+                token = Token(last_char + char_next, TokenType.LTEQ)
             else:
                 token = Token(self.cur_char, TokenType.LT)
 
         elif self.cur_char == ">":
             char_next = "="
             if self.peek() == char_next:
+                last_char = self.cur_char
                 self.next_char()
-                token = Token(self.cur_char + char_next, TokenType.GTEQ)
+                token = Token(last_char + char_next, TokenType.GTEQ)
             else:
                 token = Token(self.cur_char, TokenType.GT)
 
         elif self.cur_char == "!":
             char_next = "="
             if self.peek() == char_next:
+                last_char = self.cur_char
                 self.next_char()
-                token = Token(self.cur_char + char_next, TokenType.NOTEQ)
+                token = Token(last_char + char_next, TokenType.NOTEQ)
             else:
                 self.abort("Expected !=, got !" + self.peek())
 
@@ -165,3 +185,16 @@ class Lexer:
 
         self.next_char()
         return token
+
+
+# Lexer engines selectable by name; both produce the same Token stream
+ENGINES = {"char": Lexer, "table": TableLexer, "buffer": BufferLexer}
+
+
+def create_lexer(source, engine="char"):
+    """Builds a lexer over source using the named engine"""
+
+    if engine not in ENGINES:
+        raise Exception("Error: Unknown lexer engine: " + engine)
+
+    return ENGINES[engine](source)
@@ -0,0 +1,657 @@
+"""Loop optimization run between optimization and code generation: hoists
+computations that do not change inside a WHILE into temporaries set before
+it, and turns multiplications of a loop counter into additions"""
+
+import collections
+
+from .ast import Bin_Op, Float, If, Input, Label, Let, Num, Print, String, Var
+from .ast import While
+from .code_gen import starts_with_string
+from .optimize import INT_MAX, INT_MIN, assigned_by_condition, constant, literal
+from .string_token import Token
+from .token_type import TokenType
+from .type_infer import DOUBLE, INT, LONG_LONG, STRING, literal_type
+
+ARITHMETIC = {TokenType.PLUS, TokenType.MINUS, TokenType.ASTERISK, TokenType.SLASH}
+
+# C types from narrowest to widest; FLOAT only occurs under legacy typing
+FLOAT = "float"
+WIDTHS = (INT, LONG_LONG, FLOAT, DOUBLE)
+
+# Types a temporary can be declared with, without and with inferred types.
+# Under legacy typing a LET of one of these literals declares it
+LEGACY_TEMPS = {INT: "0", FLOAT: "0.0"}
+TYPED_TEMPS = (INT, LONG_LONG, DOUBLE)
+
+# Temporaries start with an underscore, which source identifiers cannot
+HOISTED_PREFIX = "_inv"
+DERIVED_PREFIX = "_ind"
+
+
+class Summary:
+    """What a WHILE body does: how often each variable is assigned in it,
+    whether it declares a label, and its induction variables, each mapped to
+    the (LET, step) adding an int constant to it once per iteration"""
+
+    __slots__ = ("assigned", "labelled", "inductions")
+
+    def __init__(self, node, assigned, labelled):
+        self.assigned = assigned
+        self.labelled = labelled
+        self.inductions = {}
+
+        for stm in node.body:
+            step = increment(stm)
+            if step is not None and assigned[stm.name_token.text] == 1:
+                self.inductions[stm.name_token.text] = (stm, step)
+
+
+def increment(stm):
+    """Return c if stm is LET i = i + c or LET i = i - c, with c an int
+    literal, negated for a subtraction, or None"""
+
+    if not isinstance(stm, Let) or not isinstance(stm.expression, Bin_Op):
+        return None
+
+    name = stm.name_token.text
+    value = stm.expression
+    kind = value.op.kind
+
+    if kind == TokenType.PLUS and isinstance(value.right, Var):
+        counter, step = value.right, value.left
+    elif kind in (TokenType.PLUS, TokenType.MINUS):
+        counter, step = value.left, value.right
+    else:
+        return None
+
+    if not isinstance(counter, Var) or counter.value != name:
+        return None
+
+    step = constant(step) if isinstance(step, Num) else None
+    if step is None:
+        return None
+    return -step if kind == TokenType.MINUS else step
+
+
+class Loop:
+    """A WHILE being optimized: its summary, the statements of its preheader,
+    run just before it, and the temporaries it holds"""
+
+    __slots__ = (
+        "summary",
+        "hoist_from",
+        "preheader",
+        "temps",
+        "derived",
+        "updates",
+        "increments",
+    )
+
+    def __init__(self, summary, hoist_from):
+        self.summary = summary
+        # Shallowest loop index expressions inside may be hoisted out of
+        self.hoist_from = hoist_from
+        self.preheader = []
+        # Structural key of each hoisted expression to its temporary
+        self.temps = {}
+        # (induction variable, factor key) to its derived variable
+        self.derived = {}
+        # Induction variable to the LETs keeping its derived variables
+        # in step, inserted after its increment
+        self.updates = collections.defaultdict(list)
+        # Induction variable to its increment as emitted
+        self.increments = {}
+
+
+class Value:
+    """A rewritten expression with what the parent needs to know about it:
+    the innermost loop index assigning a variable it reads, its C type, a
+    structural key and the loop index it could be hoisted to, or None"""
+
+    __slots__ = ("node", "depth", "c_type", "key", "level", "has_var")
+
+    def __init__(self, node, depth, c_type, key, level, has_var):
+        self.node = node
+        self.depth = depth
+        self.c_type = c_type
+        self.key = key
+        self.level = level
+        self.has_var = has_var
+
+
+class LoopOptimizer:
+    """Hoists loop-invariant expressions and reduces induction variable
+    multiplications in every WHILE, walking the program with explicit stacks
+    so deep nesting does not recurse. The input tree is not modified;
+    unchanged subtrees are shared with it.
+
+    An expression is invariant in a loop if the loop assigns none of the
+    variables it reads. It is hoisted into a temporary set in the preheader
+    of the outermost loop it is invariant in, unless a label inside lets a
+    GOTO enter that loop past its preheader. The preheader runs even if the
+    loop body does not, so an int division is only hoisted by a literal
+    other than 0 and -1, which can neither trap nor overflow.
+
+    A loop variable i is an induction variable when the loop body assigns it
+    only in a top level LET i = i + c. Then i * k, for an int k the loop does
+    not change, is read from a variable set to i * k in the preheader and
+    increased by c * k after each increment.
+
+    Without types, temporaries are declared by a LET of 0 or 0.0, so only
+    int and float expressions are hoisted, and the value of a LET that
+    declares a variable and the left operands of a PRINT, which the
+    generator converts, stay in place. With a {variable: C type} map from
+    type_infer, types gains the temporaries. counts holds how many
+    expressions were hoisted and multiplications reduced"""
+
+    def __init__(self, types=None):
+        self.typed = types is not None
+        self.types = types
+        # C type of every variable, temporaries included
+        self.c_types = dict(types or {})
+        self.counts = {"hoisted": 0, "reduced": 0, "loops": 0}
+        # Innermost loop index assigning each temporary
+        self.temp_depths = {}
+        self.next_temp = 0
+
+    def program(self, node):
+        """Return the Program with its loops optimized"""
+
+        self.summarize(node.statements)
+        statements = self.rebuild(node.statements)
+        if self.typed:
+            self.types = self.c_types
+        return node.__class__(statements).copy_span(node)
+
+    def summarize(self, statements):
+        """Summarizes every WHILE and, for legacy typing, finds the LET
+        declaring each variable and the type it is declared with"""
+
+        self.summaries = {}
+        self.declaring = set()
+        declared = {}
+
+        stack = [(stm, False) for stm in reversed(statements)]
+        totals = [[collections.Counter(), False]]
+
+        while stack:
+            node, done = stack.pop()
+
+            if isinstance(node, (If, While)) and not done:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.body))
+                totals.append(
+                    [collections.Counter(assigned_by_condition(node.condition)), False]
+                )
+                continue
+
+            if isinstance(node, (If, While)):
+                assigned, labelled = totals.pop()
+                if isinstance(node, While):
+                    self.summaries[node] = Summary(node, assigned, labelled)
+                totals[-1][0].update(assigned)
+                totals[-1][1] = totals[-1][1] or labelled
+
+            elif isinstance(node, Let):
+                name = node.name_token.text
+                totals[-1][0][name] += 1
+                if name not in declared:
+                    declared[name] = declared_type(node.expression, declared)
+                    self.declaring.add(node)
+
+            elif isinstance(node, Input):
+                name = node.input_token.text
+                totals[-1][0][name] += 1
+                declared.setdefault(name, FLOAT)
+
+            elif isinstance(node, Label):
+                totals[-1][1] = True
+
+        if not self.typed:
+            self.c_types = declared
+
+    def rebuild(self, statements):
+        """Return the optimized statement list"""
+
+        self.loops = []
+        root = []
+        # Each frame is (block node, its remaining statements, rebuilt body,
+        # its condition as rewritten)
+        frames = [(None, iter(statements), root, None)]
+
+        while frames:
+            block, remaining, out, condition = frames[-1]
+            stm = next(remaining, None)
+
+            if stm is None:
+                frames.pop()
+                if block is not None:
+                    frames[-1][2].extend(self.finish(block, condition, out))
+                continue
+
+            if isinstance(stm, While):
+                summary = self.summaries[stm]
+                if summary.labelled:
+                    hoist_from = len(self.loops) + 1
+                else:
+                    hoist_from = self.loops[-1].hoist_from if self.loops else 0
+                self.loops.append(Loop(summary, hoist_from))
+                frames.append((stm, iter(stm.body), [], self.condition(stm.condition)))
+
+            elif isinstance(stm, If):
+                frames.append((stm, iter(stm.body), [], self.condition(stm.condition)))
+
+            else:
+                out.append(self.simple_statement(stm))
+
+        return root
+
+    def finish(self, node, condition, body):
+        """Return the statements replacing block node once its body is
+        rebuilt: a WHILE is preceded by its preheader"""
+
+        if isinstance(node, If):
+            return [rebuilt(node, condition, body)]
+
+        loop = self.loops.pop()
+
+        if loop.updates:
+            body = [
+                stm
+                for item in body
+                for stm in [item, *self.updates_after(loop, item)]
+            ]
+
+        if loop.preheader:
+            self.counts["loops"] += 1
+
+        return [*loop.preheader, rebuilt(node, condition, body)]
+
+    def updates_after(self, loop, stm):
+        """Return the LETs to run after stm, if it increments an induction
+        variable that has derived variables"""
+
+        if not isinstance(stm, Let):
+            return ()
+
+        name = stm.name_token.text
+        if loop.increments.get(name) is not stm:
+            return ()
+        return loop.updates.get(name, ())
+
+    def condition(self, node):
+        """Return the rewritten block condition. x = e only rewrites e"""
+
+        if not self.loops:
+            return node
+
+        if assigned_by_condition(node):
+            right = self.expression(node.right)
+            if right is node.right:
+                return node
+            return Bin_Op(node.left, node.op, right).copy_span(node)
+
+        return self.expression(node)
+
+    def simple_statement(self, node):
+        """Return the rewritten statement"""
+
+        if not self.loops:
+            return node
+
+        if isinstance(node, Let):
+            pinned = not self.typed and node in self.declaring
+            expression = self.expression(node.expression, pinned=pinned)
+            result = node
+            if expression is not node.expression:
+                result = Let(node.name_token, expression).copy_span(node)
+
+            loop = self.loops[-1]
+            name = node.name_token.text
+            induction = loop.summary.inductions.get(name)
+            if induction is not None and induction[0] is node:
+                loop.increments[name] = result
+            return result
+
+        if isinstance(node, Print):
+            spine = set()
+            if not self.typed:
+                if starts_with_string(node.expression):
+                    return node
+                # The generator casts the leftmost operand to float, which
+                # changes the type of every operation on the left spine
+                item = node.expression
+                while isinstance(item, Bin_Op):
+                    spine.add(item)
+                    item = item.left
+
+            expression = self.expression(node.expression, spine=spine)
+            if expression is node.expression:
+                return node
+            return Print(expression).copy_span(node)
+
+        return node
+
+    def expression(self, node, pinned=False, spine=()):
+        """Return the rewritten expression, reducing and hoisting bottom up
+        with an explicit stack. pinned keeps the root in place, and spine
+        holds nodes whose type the context changes"""
+
+        results = []
+        stack = [(node, False)]
+
+        while stack:
+            item, done = stack.pop()
+
+            if isinstance(item, Bin_Op):
+                if not done:
+                    stack += ((item, True), (item.right, False), (item.left, False))
+                    continue
+
+                right = results.pop()
+                left = results.pop()
+                fixed = item in spine or (pinned and item is node)
+                results.append(self.bin_op(item, left, right, fixed))
+
+            else:
+                results.append(self.leaf(item))
+
+        value = results[0]
+        if self.hoistable(value, len(self.loops)):
+            return self.hoist(value)
+        return value.node
+
+    def hoistable(self, value, limit):
+        """Return true if value is a computation that can be hoisted to a
+        loop index below limit"""
+
+        if value.level is None or value.level >= len(self.loops):
+            return False
+        if not isinstance(value.node, Bin_Op):
+            return False
+        if value.key in self.loops[value.level].temps:
+            # Already held by a temporary, so reading that is free
+            return True
+        return value.has_var and value.level < limit
+
+    def leaf(self, node):
+        """Return the Value of a leaf expression"""
+
+        if isinstance(node, Var):
+            name = node.value
+            depth = self.depth(name)
+            return Value(
+                node, depth, self.c_types.get(name), ("Var", name), self.level(depth), True
+            )
+
+        if isinstance(node, Num):
+            text = node.value.lstrip("-")
+            c_type = literal_type(text) if text.isdigit() else None
+            return Value(node, -1, c_type, ("Num", node.value), self.level(-1), False)
+
+        if isinstance(node, Float):
+            return Value(node, -1, DOUBLE, ("Float", node.value), self.level(-1), False)
+
+        return Value(node, -1, STRING, None, None, False)
+
+    def bin_op(self, node, left, right, fixed):
+        """Return the Value of Bin_Op node with rewritten operands. fixed
+        nodes are never hoisted or reduced"""
+
+        kind = node.op.kind
+        depth = max(left.depth, right.depth)
+        c_type = widest(left.c_type, right.c_type)
+
+        if not fixed and kind == TokenType.ASTERISK:
+            reduced = self.reduce(node, left, right)
+            if reduced is not None:
+                return reduced
+
+        level = None
+        if (
+            kind in ARITHMETIC
+            and not fixed
+            and left.level is not None
+            and right.level is not None
+            and self.storable(c_type)
+            and self.safe(node, right, c_type)
+        ):
+            level = self.level(depth)
+
+        # Operands more invariant than the node go further out on their own
+        limit = len(self.loops) if level is None else level
+        if self.hoistable(left, limit):
+            left = self.leaf(self.hoist(left))
+        if self.hoistable(right, limit):
+            right = self.leaf(self.hoist(right))
+
+        result = node
+        if left.node is not node.left or right.node is not node.right:
+            result = Bin_Op(left.node, node.op, right.node).copy_span(node)
+
+        if kind not in ARITHMETIC:
+            c_type = INT
+
+        key = None
+        if left.key is not None and right.key is not None:
+            key = (kind, left.key, right.key)
+        else:
+            level = None
+
+        return Value(result, depth, c_type, key, level, left.has_var or right.has_var)
+
+    def reduce(self, node, left, right):
+        """Return the Value of the derived variable replacing i * k, where i
+        is an induction variable and k an int the loop does not change, or
+        None"""
+
+        for counter, factor in ((left, right), (right, left)):
+            if not isinstance(counter.node, Var):
+                continue
+
+            index = counter.depth
+            if index < 0 or factor.depth >= index or factor.key is None:
+                continue
+
+            loop = self.loops[index]
+            induction = loop.summary.inductions.get(counter.node.value)
+            if induction is None or loop.hoist_from > index:
+                continue
+
+            name = counter.node.value
+            c_type = self.c_types.get(name)
+            if c_type not in (INT, LONG_LONG) or factor.c_type not in (INT, c_type):
+                continue
+            if not isinstance(factor.node, (Num, Var)):
+                continue
+
+            derived = self.derive(loop, index, node, counter, factor, induction[1])
+            if derived is None:
+                continue
+
+            self.counts["reduced"] += 1
+            return Value(
+                Var(Token(derived, TokenType.IDENT)).copy_span(node),
+                index,
+                c_type,
+                ("Var", derived),
+                self.level(index),
+                True,
+            )
+
+        return None
+
+    def derive(self, loop, index, node, counter, factor, step):
+        """Return the variable holding counter * factor in loop, at index,
+        creating it and the LETs keeping it in step, or None if the step
+        does not fit"""
+
+        name = counter.node.value
+        key = (name, factor.key)
+        if key in loop.derived:
+            return loop.derived[key]
+
+        size = abs(step)
+        if isinstance(factor.node, Num):
+            value = constant(factor.node)
+            if value is None or not INT_MIN <= value * size <= INT_MAX:
+                return None
+            amount = literal(value * size)
+        elif size == 1:
+            amount = factor.node
+        else:
+            amount = Bin_Op(factor.node, times(), literal(size))
+            amount = self.hoist(
+                Value(amount, factor.depth, factor.c_type, ("step", key), index, True)
+            )
+
+        derived = self.temporary(DERIVED_PREFIX, self.c_types[name], loop, index)
+
+        product = Bin_Op(counter.node, times(), factor.node).copy_span(node)
+        loop.preheader.append(assign(derived, product, node))
+
+        op = Token("+", TokenType.PLUS) if step >= 0 else Token("-", TokenType.MINUS)
+        increment = loop.summary.inductions[name][0]
+        loop.updates[name].append(
+            assign(
+                derived,
+                Bin_Op(Var(Token(derived, TokenType.IDENT)), op, amount),
+                increment,
+            )
+        )
+
+        loop.derived[key] = derived
+        return derived
+
+    def hoist(self, value):
+        """Return a Var reading the temporary that holds value, set in the
+        preheader of the loop at value.level"""
+
+        loop = self.loops[value.level]
+        name = loop.temps.get(value.key)
+
+        if name is None:
+            name = self.temporary(
+                HOISTED_PREFIX, value.c_type, loop, value.level - 1
+            )
+            loop.preheader.append(assign(name, value.node, value.node))
+            loop.temps[value.key] = name
+            self.counts["hoisted"] += 1
+
+        return Var(Token(name, TokenType.IDENT)).copy_span(value.node)
+
+    def temporary(self, prefix, c_type, loop, depth):
+        """Return a new temporary of c_type for the preheader of loop,
+        assigned in the loops down to index depth. Under legacy typing a LET
+        in the preheader declares it"""
+
+        name = f"{prefix}{self.next_temp}"
+        self.next_temp += 1
+        self.c_types[name] = c_type
+        self.temp_depths[name] = depth
+
+        if not self.typed:
+            zero = LEGACY_TEMPS[c_type]
+            value = Num(Token(zero, TokenType.INTEGER)) if c_type == INT else Float(
+                Token(zero, TokenType.FLOAT)
+            )
+            loop.preheader.append(Let(Token(name, TokenType.IDENT), value))
+
+        return name
+
+    def depth(self, name):
+        """Return the innermost loop index assigning variable name, or -1"""
+
+        if name in self.temp_depths:
+            return self.temp_depths[name]
+
+        for index in range(len(self.loops) - 1, -1, -1):
+            if self.loops[index].summary.assigned[name]:
+                return index
+        return -1
+
+    def level(self, depth):
+        """Return the loop index an expression whose variables are assigned
+        at most in the loop at depth may be hoisted to"""
+
+        if not self.loops:
+            return None
+        return max(depth + 1, self.loops[-1].hoist_from)
+
+    def storable(self, c_type):
+        """Return true if a temporary can be declared with c_type"""
+
+        if self.typed:
+            return c_type in TYPED_TEMPS
+        return c_type in LEGACY_TEMPS
+
+    def safe(self, node, divisor, c_type):
+        """Return true if evaluating node before the loop cannot trap"""
+
+        if node.op.kind != TokenType.SLASH or c_type not in (INT, LONG_LONG):
+            return True
+        return isinstance(divisor.node, Num) and constant(divisor.node) not in (
+            None,
+            0,
+            -1,
+        )
+
+    def summary(self):
+        """Return a line reporting what was optimized"""
+
+        return (
+            f"Loops: hoisted {self.counts['hoisted']} invariant expressions and"
+            f" reduced {self.counts['reduced']} multiplications in"
+            f" {self.counts['loops']} loops"
+        )
+
+
+def declared_type(node, declared):
+    """The C type CodeGenerator declares for a LET with value node"""
+
+    if isinstance(node, String):
+        return STRING
+    if isinstance(node, Num):
+        return INT
+    if isinstance(node, Var):
+        return declared.get(node.value)
+    return FLOAT
+
+
+def widest(first, second):
+    """Return the C type of an operation on the two types, or None"""
+
+    if first not in WIDTHS or second not in WIDTHS:
+        return None
+    return max(first, second, key=WIDTHS.index)
+
+
+def times():
+    """Return a multiplication operator token"""
+
+    return Token("*", TokenType.ASTERISK)
+
+
+def assign(name, expression, origin):
+    """Return LET name = expression with the span of origin"""
+
+    return Let(Token(name, TokenType.IDENT), expression).copy_span(origin)
+
+
+def rebuilt(node, condition, body):
+    """Return block node with condition and body, reusing node when nothing
+    changed"""
+
+    if (
+        condition is node.condition
+        and len(body) == len(node.body)
+        and all(new is old for new, old in zip(body, node.body))
+    ):
+        return node
+    return node.__class__(condition, body).copy_span(node)
+
+
+def optimize_loops(program, types=None):
+    """Return a copy of program with its loops optimized"""
+
+    return LoopOptimizer(types).program(program)
@@ -1,10 +1,24 @@
 """This module is the starting point of my compiler"""
 
+import argparse
+import os
 import sys
-import json
+import time
+from src.bytecode import compile_program
 from src.code_gen import CodeGenerator
-from src.lex import Lexer
+from src.dead_code import DeadCodeEliminator
+from src.lex import ENGINES, create_lexer
+from src.loops import LoopOptimizer
+from src.multifile import FAILED, compile_paths, summary
+from src.native import OPT_LEVELS, NativeBuilder
+from src.optimize import Optimizer
 from src.parse import Parser
+from src.pipeline import compile_stream
+from src.serialize import dumps_binary, write_json
+from src.token_buffer import BufferLexer, TokenBuffer
+from src.trace import PrintTracer, ProfileTracer
+from src.type_infer import infer_types
+from src.vm import VM
 
 
 def main():
@@ -12,28 +26,259 @@ def main():
 
     print("My compiler")
 
-    if len(sys.argv) != 2:
-        sys.exit("Error: Compiler needs source file as argument.")
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "sources",
+        nargs="+",
+        help="source file to compile, or files and directories with --out-dir",
+    )
+    arg_parser.add_argument(
+        "--out-dir",
+        help="compile every input in parallel, writing <name>.c and its AST here",
+    )
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=0,
+        help="worker processes for --out-dir, one per core by default",
+    )
+    arg_parser.add_argument(
+        "--glob",
+        default="*.txt",
+        help="file name pattern of the sources searched for in directories",
+    )
+    arg_parser.add_argument(
+        "--force",
+        action="store_true",
+        help="recompile inputs whose outputs in --out-dir are up to date",
+    )
+    arg_parser.add_argument(
+        "--lexer",
+        choices=sorted(ENGINES),
+        default="char",
+        help="lexer engine to tokenize the source with",
+    )
+    arg_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="read, parse and emit one statement at a time in bounded memory",
+    )
+    arg_parser.add_argument(
+        "--ast-format",
+        choices=["json", "binary"],
+        default="json",
+        help="write the AST as ast.json, or as ast.bin in the binary AST format",
+    )
+    arg_parser.add_argument(
+        "--source-map",
+        action="store_true",
+        help="write out.c.map, mapping C lines to source lines, and node spans"
+        " into ast.json",
+    )
+    arg_parser.add_argument(
+        "-O",
+        "--optimize",
+        action="store_true",
+        help="fold constants and propagate LET constants before emitting C",
+    )
+    arg_parser.add_argument(
+        "--loops",
+        action="store_true",
+        help="hoist invariant computations out of WHILE loops and turn counter"
+        " multiplications into additions, and print what was changed",
+    )
+    arg_parser.add_argument(
+        "--dce",
+        action="store_true",
+        help="remove unreachable code, dead stores and unused labels before"
+        " emitting C, and print what was removed",
+    )
+    arg_parser.add_argument(
+        "--infer-types",
+        action="store_true",
+        help="give variables inferred int, long long or double types",
+    )
+    arg_parser.add_argument(
+        "--build",
+        action="store_true",
+        help="build out.c with the local cc, reusing cached executables",
+    )
+    arg_parser.add_argument(
+        "--run",
+        action="store_true",
+        help="build out.c and run it, printing its output and timings",
+    )
+    arg_parser.add_argument(
+        "--vm",
+        action="store_true",
+        help="run the program in-process on the bytecode VM, without cc",
+    )
+    arg_parser.add_argument(
+        "--cc-opt",
+        choices=OPT_LEVELS,
+        default="2",
+        help="cc optimization level for --build and --run",
+    )
+    arg_parser.add_argument(
+        "--trace",
+        choices=["print", "profile"],
+        help="print parser productions, or profile them and print JSON stats",
+    )
+    args = arg_parser.parse_args()
 
-    with open(sys.argv[1], "r", encoding="utf-8") as input_file:
-        source = input_file.read()
+    if (
+        args.out_dir is not None
+        or len(args.sources) > 1
+        or os.path.isdir(args.sources[0])
+    ):
+        compile_many(arg_parser, args)
+        return
 
-    lexer = Lexer(source)
-    parser = Parser(lexer)
-    code_generator = CodeGenerator()
+    args.source_file = args.sources[0]
+
+    if args.stream and args.infer_types:
+        arg_parser.error("--infer-types needs the whole program and cannot --stream")
+
+    if args.stream and args.ast_format == "binary":
+        arg_parser.error("--ast-format binary needs the whole tree and cannot --stream")
+
+    if args.stream and args.vm:
+        arg_parser.error("--vm needs the whole program and cannot --stream")
+
+    if args.stream and args.loops:
+        arg_parser.error("--loops needs the whole program and cannot --stream")
+
+    if args.stream and args.dce:
+        arg_parser.error("--dce needs the whole program and cannot --stream")
+
+    if args.stream and args.source_map:
+        arg_parser.error("--source-map needs the whole program and cannot --stream")
+
+    if args.stream:
+        with open(args.source_file, "r", encoding="utf-8") as input_file, open(
+            "out.c", "w"
+        ) as c_file, open("ast.json", "w") as ast_file:
+            compile_stream(input_file, c_file, ast_file, args.optimize)
+
+        print("Parsing completed.")
+        build_and_run(args)
+        return
+
+    if args.lexer == "buffer":
+        # Lexed straight from the memory-mapped file
+        lexer = BufferLexer(TokenBuffer.from_path(args.source_file))
+    else:
+        with open(args.source_file, "r", encoding="utf-8") as input_file:
+            lexer = create_lexer(input_file.read(), args.lexer)
+
+    tracer = None
+    if args.trace == "print":
+        tracer = PrintTracer()
+    elif args.trace == "profile":
+        tracer = ProfileTracer()
+
+    parser = Parser(lexer, tracer)
 
     # parser.program()
     tree = parser.program()
-    json_output = tree.to_dict()
-    c_output = code_generator.generate(tree)
+    types = infer_types(tree) if args.infer_types else None
+    code = compile_program(tree, types) if args.vm else None
+    emitted = Optimizer(types=types).program(tree) if args.optimize else tree
+
+    if args.loops:
+        loop_optimizer = LoopOptimizer(types)
+        emitted = loop_optimizer.program(emitted)
+        types = loop_optimizer.types
+        print(loop_optimizer.summary())
+
+    if args.dce:
+        eliminator = DeadCodeEliminator(types)
+        emitted = eliminator.program(emitted)
+        types = eliminator.types
+        print(eliminator.summary())
+
+    if args.source_map:
+        c_output, source_map = CodeGenerator(types).generate_mapped(
+            emitted, lexer.location
+        )
+        with open("out.c.map", "w") as map_file:
+            map_file.write(source_map.to_json())
+    else:
+        c_output = CodeGenerator(types).generate(emitted)
 
-    with open("ast.json", "w") as output_file:
-        json.dump(json_output, output_file, indent=4)
+    if args.ast_format == "binary":
+        with open("ast.bin", "wb") as output_file:
+            output_file.write(dumps_binary(tree))
+    else:
+        with open("ast.json", "w") as output_file:
+            write_json(tree, output_file, indent=4, spans=args.source_map)
 
     with open("out.c", "w") as file:
         file.write(c_output)
 
+    if args.trace == "profile":
+        print(tracer.to_json(indent=4))
+
     print("Parsing completed.")
+    build_and_run(args)
+
+    if code is not None:
+        start = time.perf_counter()
+        VM().run(code)
+        print(f"Ran in {time.perf_counter() - start:.6f}s")
+
+
+def compile_many(arg_parser, args):
+    """Compiles every input into --out-dir in parallel and prints a summary,
+    exiting with status 1 if any input failed"""
+
+    if args.out_dir is None:
+        arg_parser.error("several inputs or a directory need --out-dir")
+
+    for flag in ["stream", "build", "run", "vm", "trace", "source_map"]:
+        if getattr(args, flag):
+            arg_parser.error(
+                f"--{flag.replace('_', '-')} compiles a single file and cannot --out-dir"
+            )
+
+    results, seconds, workers = compile_paths(
+        args.sources,
+        args.out_dir,
+        args.glob,
+        workers=args.jobs or None,
+        engine=args.lexer,
+        ast_format=args.ast_format,
+        force=args.force,
+        optimize=args.optimize,
+        infer_types=args.infer_types,
+        eliminate_dead_code=args.dce,
+        optimize_loops=args.loops,
+    )
+    print(summary(results, seconds, workers))
+
+    if any(result["status"] == FAILED for result in results):
+        sys.exit(1)
+
+
+def build_and_run(args):
+    """Builds out.c, and runs it, when asked to"""
+
+    if not (args.build or args.run):
+        return
+
+    with open("out.c", "r") as c_file:
+        c_code = c_file.read()
+
+    builder = NativeBuilder()
+    path, cached, build_seconds = builder.build(c_code, args.cc_opt)
+    print(f"Built {path}" + (" (cached)" if cached else f" in {build_seconds:.3f}s"))
+
+    if args.run:
+        result = builder.run(path, input_text=None, timeout=None)
+        print(result["stdout"], end="")
+        print(f"Exit code {result['exit_code']} in {result['run_seconds']:.3f}s")
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""Compile metrics: phase latency histograms, source size and AST node
+count distributions and error counts, rendered in the Prometheus text
+exposition format. Values are kept per process"""
+
+import bisect
+import math
+import resource
+import threading
+
+# Bucket upper bounds in seconds, characters and nodes
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+LATENCY_BUCKETS += (0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = tuple(4**power for power in range(3, 12))
+NODE_BUCKETS = tuple(4**power for power in range(1, 11))
+
+
+def format_value(value):
+    """Return the exposition text of a sample value"""
+
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def escape(value):
+    """Return a label value escaped for the exposition format"""
+
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def labels(pairs):
+    """Return the {name="value",...} text of (name, value) pairs"""
+
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    """Distribution of observed values over fixed buckets, kept separately
+    for each value of an optional label"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets, label=None):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.label = label
+        self.lock = threading.Lock()
+        # Label value -> [count per bucket and one past the last, sum]
+        self.series = {}
+
+    def observe(self, value, label_value=None):
+        """Adds value to the distribution for label_value"""
+
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                counts = [0] * (len(self.buckets) + 1)
+                series = self.series[label_value] = [counts, 0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        """Yields (suffix, label pairs, value) for every sample"""
+
+        with self.lock:
+            series = [
+                (key, list(counts), total)
+                for key, (counts, total) in self.series.items()
+            ]
+
+        for key, counts, total in sorted(series, key=lambda item: str(item[0])):
+            pairs = [] if self.label is None else [(self.label, key)]
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                bucket = pairs + [("le", format_value(float(bound)))]
+                yield "_bucket", bucket, cumulative
+
+            yield "_sum", pairs, total
+            yield "_count", pairs, cumulative
+
+
+class Counter:
+    """Count of events, kept separately for each value of an optional label"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, label_value=None, amount=1):
+        """Adds amount to the count for label_value"""
+
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def samples(self):
+        """Yields (suffix, label pairs, value) for every sample"""
+
+        with self.lock:
+            values = sorted(self.values.items(), key=lambda item: str(item[0]))
+
+        for key, value in values:
+            yield "", [] if self.label is None else [(self.label, key)], value
+
+
+class Registry:
+    """Metrics rendered together. Collectors are called at render time and
+    return (name, kind, help, value) tuples, for values that live elsewhere,
+    like cache statistics"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def add(self, metric):
+        """Registers metric and returns it"""
+
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self, collector):
+        """Registers a collector called at every render"""
+
+        self.collectors.append(collector)
+
+    def render(self):
+        """Return every metric in the Prometheus text format"""
+
+        lines = []
+
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, pairs, value in metric.samples():
+                lines.append(
+                    f"{metric.name}{suffix}{labels(pairs)} {format_value(value)}"
+                )
+
+        for collector in self.collectors:
+            for name, kind, help_text, value in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def count_nodes(node):
+    """Return the number of nodes in the AST under node"""
+
+    count = 0
+    stack = [node]
+
+    while stack:
+        node = stack.pop()
+        count += 1
+
+        for _, child in node.fields()[1]:
+            if isinstance(child, list):
+                stack.extend(child)
+            else:
+                stack.append(child)
+
+    return count
+
+
+def stats_samples(prefix, stats, counters, help_text):
+    """Return collector tuples for a stats dict, as prefix_name series.
+    Names in counters are cumulative counts, the rest gauges"""
+
+    samples = []
+    for name, value in stats.items():
+        if not isinstance(value, (int, float)):
+            continue
+        if name in counters:
+            samples.append((f"{prefix}_{name}_total", "counter", help_text, value))
+        else:
+            samples.append((f"{prefix}_{name}", "gauge", help_text, value))
+    return samples
+
+
+def memory_samples():
+    """Return collector tuples for the process's peak resident memory"""
+
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return [
+        (
+            "pytoc_process_max_resident_bytes",
+            "gauge",
+            "Peak resident memory of the process",
+            peak,
+        )
+    ]
+
+
+class CompileMetrics:
+    """Metrics of compiles and the requests that ran them"""
+
+    def __init__(self, registry=None):
+        self.registry = registry = registry if registry is not None else Registry()
+        self.phase_seconds = registry.add(
+            Histogram(
+                "pytoc_phase_seconds",
+                "Seconds each compile phase took",
+                LATENCY_BUCKETS,
+                "phase",
+            )
+        )
+        self.request_seconds = registry.add(
+            Histogram(
+                "pytoc_request_seconds",
+                "Seconds each request took, cache hits included",
+                LATENCY_BUCKETS,
+                "endpoint",
+            )
+        )
+        self.source_chars = registry.add(
+            Histogram(
+                "pytoc_source_chars",
+                "Characters of each source compiled",
+                SIZE_BUCKETS,
+            )
+        )
+        self.ast_nodes = registry.add(
+            Histogram(
+                "pytoc_ast_nodes",
+                "Nodes in the AST of each source compiled",
+                NODE_BUCKETS,
+            )
+        )
+        self.errors = registry.add(
+            Counter(
+                "pytoc_compile_errors_total",
+                "Compiles that failed, by the phase they failed in",
+                "phase",
+            )
+        )
+
+    def record(self, source, timings, program=None, failed=None):
+        """Records one compile: the seconds of each phase it finished, the
+        size of its source and the nodes of its parsed program, or the
+        phase it failed in"""
+
+        for phase, seconds in timings.items():
+            self.phase_seconds.observe(seconds, phase)
+
+        self.source_chars.observe(len(source))
+
+        if program is not None:
+            self.ast_nodes.observe(count_nodes(program))
+        if failed is not None:
+            self.errors.inc(failed)
+
+    def render(self):
+        """Return every metric in the Prometheus text format"""
+
+        return self.registry.render()
@@ -0,0 +1,204 @@
+"""Compiles many source files and directories into an output directory in
+parallel, skipping inputs whose outputs are up to date"""
+
+import fnmatch
+import json
+import os
+import time
+
+from .batch import BatchCompiler, write_atomic
+from .cache import compiler_version
+
+# Record of what produced each output, kept in the output directory
+MANIFEST_NAME = ".pytoc-manifest.json"
+
+AST_SUFFIXES = {"json": ".json", "binary": ".ast.bin"}
+
+COMPILED = "compiled"
+UP_TO_DATE = "up to date"
+FAILED = "failed"
+
+
+def find_sources(paths, pattern="*.txt"):
+    """Return (source path, output stem) pairs for files and directories.
+    Directories are searched recursively for files matching pattern and
+    their outputs mirror the directory layout; a file's stem is its name"""
+
+    sources = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            for root, directories, names in os.walk(path):
+                directories.sort()
+                for name in sorted(fnmatch.filter(names, pattern)):
+                    source = os.path.join(root, name)
+                    stem = os.path.splitext(os.path.relpath(source, path))[0]
+                    sources.append((source, stem))
+
+        elif os.path.isfile(path):
+            sources.append((path, os.path.splitext(os.path.basename(path))[0]))
+
+        else:
+            raise Exception("Error: No such file or directory: " + path)
+
+    return sources
+
+
+class MultiFileCompiler:
+    """Writes <stem>.c and the <stem> AST file into out_dir for each input,
+    compiling on a BatchCompiler. The manifest records each source's size,
+    modification time, the options used and the compiler version, so an
+    unchanged input compiled with the same options by the same compiler is
+    skipped unless force is set. version defaults to a digest of the
+    compiler's source, as for CompileCache"""
+
+    def __init__(
+        self,
+        out_dir,
+        workers=None,
+        engine="char",
+        ast_format="json",
+        force=False,
+        version=None,
+        **options,
+    ):
+        self.out_dir = out_dir
+        self.ast_format = ast_format
+        self.force = force
+        self.batch = BatchCompiler(workers, engine, **options)
+        self.stamp = ",".join(
+            [name for name, on in sorted(options.items()) if on] + [ast_format]
+        )
+        self.version = version if version is not None else compiler_version()
+
+    def abort(self, message):
+        """Handle errors"""
+
+        raise Exception("Error: " + message)
+
+    def load_manifest(self):
+        """Return the manifest, or an empty one if it is missing or unreadable"""
+
+        try:
+            with open(os.path.join(self.out_dir, MANIFEST_NAME)) as manifest_file:
+                return json.load(manifest_file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest):
+        """Writes the manifest"""
+
+        path = os.path.join(self.out_dir, MANIFEST_NAME)
+        write_atomic(path, json.dumps(manifest, indent=1, sort_keys=True).encode())
+
+    def compile(self, paths, pattern="*.txt"):
+        """Compiles every source under paths, returning one dict per source
+        with its path, outputs, status, seconds and any error"""
+
+        results = []
+        jobs = []
+        seen = {}
+        manifest = self.load_manifest()
+        suffix = AST_SUFFIXES[self.ast_format]
+
+        for source, stem in find_sources(paths, pattern):
+            if stem in seen:
+                self.abort(f"{source} and {seen[stem]} both write {stem}.c")
+            seen[stem] = source
+
+            c_path = os.path.join(self.out_dir, stem + ".c")
+            ast_path = os.path.join(self.out_dir, stem + suffix)
+            stat = os.stat(source)
+            record = {
+                "source": os.path.abspath(source),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "options": self.stamp,
+                "compiler": self.version,
+            }
+            result = {"source": source, "c_file": c_path, "ast_file": ast_path}
+            results.append(result)
+
+            if (
+                not self.force
+                and manifest.get(stem) == record
+                and os.path.exists(c_path)
+                and os.path.exists(ast_path)
+            ):
+                result.update(status=UP_TO_DATE, seconds=0.0, error=None)
+                continue
+
+            os.makedirs(os.path.dirname(c_path) or ".", exist_ok=True)
+            manifest.pop(stem, None)
+            jobs.append((stem, record, result))
+
+        outcomes = self.batch.compile_files(
+            [
+                (result["source"], result["c_file"], result["ast_file"])
+                for *_, result in jobs
+            ],
+            self.ast_format,
+        )
+
+        for (stem, record, result), (error, seconds) in zip(jobs, outcomes):
+            result.update(
+                status=FAILED if error else COMPILED, seconds=seconds, error=error
+            )
+            if error is None:
+                manifest[stem] = record
+                continue
+
+            # Outputs of an earlier successful compile are stale now
+            for path in (result["c_file"], result["ast_file"]):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        if jobs:
+            os.makedirs(self.out_dir, exist_ok=True)
+            self.save_manifest(manifest)
+
+        return results
+
+    def shutdown(self):
+        """Stops the worker processes"""
+
+        self.batch.shutdown()
+
+
+def summary(results, seconds, workers):
+    """Return a report of each input's outcome and timing, and the totals"""
+
+    lines = []
+
+    for result in results:
+        if result["status"] == FAILED:
+            lines.append(f"FAILED   {result['source']}: {result['error']}")
+        elif result["status"] == COMPILED:
+            lines.append(f"{result['seconds']:7.3f}s {result['source']}")
+        else:
+            lines.append(f"   --    {result['source']} (up to date)")
+
+    counts = {status: 0 for status in (COMPILED, UP_TO_DATE, FAILED)}
+    for result in results:
+        counts[result["status"]] += 1
+
+    lines.append(
+        f"{counts[COMPILED]} compiled, {counts[UP_TO_DATE]} up to date,"
+        f" {counts[FAILED]} failed in {seconds:.3f}s with {workers} workers"
+    )
+    return "\n".join(lines)
+
+
+def compile_paths(paths, out_dir, pattern="*.txt", **settings):
+    """Compiles paths into out_dir, returning (results, seconds, workers).
+    settings are MultiFileCompiler keyword arguments"""
+
+    compiler = MultiFileCompiler(out_dir, **settings)
+    start = time.perf_counter()
+
+    try:
+        results = compiler.compile(paths, pattern)
+    finally:
+        compiler.shutdown()
+
+    return results, time.perf_counter() - start, compiler.batch.workers
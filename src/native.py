@@ -0,0 +1,234 @@
+"""Builds generated C with the local C compiler and runs the executables,
+caching them by a hash of the C code and compiler flags"""
+
+import collections
+import hashlib
+import math
+import os
+import resource
+import shutil
+import stat
+import subprocess
+import tempfile
+import threading
+import time
+
+OPT_LEVELS = ("0", "1", "2", "3", "s")
+
+# Bytes of program output kept; a program writing more is stopped
+MAX_OUTPUT = 1 << 20
+
+# Seconds cc may take to report its version or build one program
+VERSION_TIMEOUT = 10
+BUILD_TIMEOUT = 60
+
+
+def limit_resources(cpu_seconds, max_output):
+    """Return a preexec_fn capping the child's CPU time and output file size,
+    so a runaway program is killed by the kernel"""
+
+    def apply():
+        if cpu_seconds is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+        resource.setrlimit(resource.RLIMIT_FSIZE, (max_output, max_output))
+
+    return apply
+
+
+class NativeBuilder:
+    """Compiles C with cc into a directory of executables named by the hash
+    of the C code, the flags and the compiler's version, so an unchanged
+    program is never rebuilt. Builds land under a temporary name and are
+    renamed into place, so concurrent builders and readers never see a
+    partial file. The least recently used executables beyond max_entries
+    are removed. The directory defaults to one per user and must be owned
+    by the current user and writable by no one else, since its executables
+    are run as they are found"""
+
+    def __init__(
+        self, cache_dir=None, cc=None, max_entries=1000, build_timeout=BUILD_TIMEOUT
+    ):
+        self.cache_dir = cache_dir or os.path.join(
+            tempfile.gettempdir(), "pytoc-bin-" + str(os.geteuid())
+        )
+        self.cc = cc or os.environ.get("CC", "cc")
+        self.max_entries = max_entries
+        self.build_timeout = build_timeout
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.version = None
+
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        self.check_private()
+
+    def abort(self, message):
+        """Handle errors"""
+
+        raise Exception("Error: " + message)
+
+    def check_private(self):
+        """Refuse a cache directory another user could plant executables in"""
+
+        info = os.lstat(self.cache_dir)
+        if not stat.S_ISDIR(info.st_mode):
+            self.abort("Cache directory is not a directory: " + self.cache_dir)
+        if info.st_uid != os.geteuid():
+            self.abort("Cache directory is owned by another user: " + self.cache_dir)
+        if info.st_mode & 0o022:
+            self.abort("Cache directory is writable by others: " + self.cache_dir)
+
+    def compiler_version(self):
+        """Return the first line of cc --version, read once"""
+
+        if self.version is None:
+            if shutil.which(self.cc) is None:
+                self.abort("C compiler not found: " + self.cc)
+
+            try:
+                result = subprocess.run(
+                    [self.cc, "--version"],
+                    capture_output=True,
+                    text=True,
+                    timeout=VERSION_TIMEOUT,
+                )
+            except subprocess.TimeoutExpired:
+                self.abort("C compiler timed out: " + self.cc)
+            self.version = (result.stdout.splitlines() or [""])[0]
+
+        return self.version
+
+    def flags(self, opt_level):
+        """Return the cc flags for an optimization level"""
+
+        if opt_level not in OPT_LEVELS:
+            self.abort("Unknown optimization level: " + str(opt_level))
+
+        return ["-O" + opt_level, "-w"]
+
+    def key(self, c_code, flags):
+        """Return the cache key for c_code built with flags"""
+
+        digest = hashlib.sha256()
+        digest.update(self.compiler_version().encode() + b"\0")
+        digest.update(" ".join(flags).encode() + b"\0")
+        digest.update(c_code.encode())
+        return digest.hexdigest()
+
+    def build(self, c_code, opt_level="2"):
+        """Return (executable path, whether it was cached, build seconds)"""
+
+        flags = self.flags(opt_level)
+        path = os.path.join(self.cache_dir, self.key(c_code, flags))
+
+        if os.path.exists(path):
+            # Recency for eviction is the file's modification time
+            os.utime(path)
+            with self.lock:
+                self.counts["hits"] += 1
+            return path, True, 0.0
+
+        start = time.perf_counter()
+        fd, source_path = tempfile.mkstemp(suffix=".c", dir=self.cache_dir)
+        output_path = source_path[:-2] + ".out"
+
+        try:
+            with os.fdopen(fd, "w") as source_file:
+                source_file.write(c_code)
+
+            try:
+                result = subprocess.run(
+                    [self.cc, *flags, "-o", output_path, source_path],
+                    capture_output=True,
+                    text=True,
+                    timeout=self.build_timeout,
+                )
+            except subprocess.TimeoutExpired:
+                self.abort("C compiler timed out")
+            if result.returncode != 0:
+                self.abort("C compiler failed: " + result.stderr.strip())
+
+            os.replace(output_path, path)
+        finally:
+            for leftover in (source_path, output_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+        with self.lock:
+            self.counts["builds"] += 1
+
+        self.evict()
+        return path, False, time.perf_counter() - start
+
+    def evict(self):
+        """Removes the least recently used executables beyond max_entries"""
+
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if len(entry.name) == 64:
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    continue
+
+        entries.sort()
+        for _, path in entries[: max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def run(self, path, input_text="", timeout=5.0, max_output=MAX_OUTPUT):
+        """Runs an executable, returning a dict with its stdout, exit code
+        and run seconds. input_text is fed to stdin; None inherits it.
+        Output past max_output bytes and runs past timeout seconds, if given,
+        are cut off"""
+
+        cpu_seconds = None if timeout is None else math.ceil(timeout) + 1
+
+        if input_text is None:
+            stdin = None
+        elif input_text:
+            stdin = subprocess.PIPE
+        else:
+            stdin = subprocess.DEVNULL
+
+        with tempfile.TemporaryFile() as output:
+            start = time.perf_counter()
+            process = subprocess.Popen(
+                [path],
+                stdin=stdin,
+                stdout=output,
+                stderr=subprocess.DEVNULL,
+                preexec_fn=limit_resources(cpu_seconds, max_output),
+            )
+
+            timed_out = False
+            try:
+                if input_text:
+                    process.communicate(input_text.encode(), timeout=timeout)
+                else:
+                    process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+                timed_out = True
+
+            seconds = time.perf_counter() - start
+            # The file size limit stops the program once it reaches max_output
+            truncated = os.fstat(output.fileno()).st_size >= max_output
+            output.seek(0)
+            stdout = output.read(max_output)
+
+        return {
+            "stdout": stdout.decode("utf-8", "replace"),
+            "exit_code": process.returncode,
+            "timed_out": timed_out,
+            "truncated": truncated,
+            "run_seconds": seconds,
+        }
+
+    def stats(self):
+        """Return build and cache hit counts"""
+
+        with self.lock:
+            return {"builds": self.counts["builds"], "hits": self.counts["hits"]}
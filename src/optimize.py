@@ -0,0 +1,528 @@
+"""AST optimization pass run between parsing and code generation: constant
+folding, algebraic identities and propagation of constant LET values"""
+
+import math
+import struct
+
+from .ast import Bin_Op, Float, Goto, If, Input, Label, Let, Num, Print, String
+from .ast import Var, While
+from .string_token import Token
+from .token_type import TokenType
+
+# Folded int results must fit a C int; the most negative one is left alone
+# because -2147483648 is not an int literal in C
+INT_MAX = (1 << 31) - 1
+INT_MIN = -INT_MAX
+
+# Largest finite C float
+FLT_MAX = struct.unpack("f", b"\xff\xff\x7f\x7f")[0]
+
+COMPARISONS = {
+    TokenType.EQEQ: lambda a, b: a == b,
+    TokenType.NOTEQ: lambda a, b: a != b,
+    TokenType.LT: lambda a, b: a < b,
+    TokenType.LTEQ: lambda a, b: a <= b,
+    TokenType.GT: lambda a, b: a > b,
+    TokenType.GTEQ: lambda a, b: a >= b,
+}
+
+# C types of integer variables, under type_infer's and the legacy typing
+INTEGER_TYPES = ("int", "long long")
+
+# Operator that adding or subtracting a negation turns into
+NEGATED = {
+    TokenType.PLUS: Token("-", TokenType.MINUS),
+    TokenType.MINUS: Token("+", TokenType.PLUS),
+}
+
+
+class Single(float):
+    """A constant of C type float, as opposed to a double"""
+
+
+def single(value):
+    """Return value converted to a C float, or None if it overflows"""
+
+    if not abs(value) <= FLT_MAX:
+        return None
+    return Single(struct.unpack("f", struct.pack("f", value))[0])
+
+
+def constant(node):
+    """Return the value of an int or float literal as C reads it, or None"""
+
+    if isinstance(node, Num):
+        text = node.value.lstrip("-")
+        try:
+            # A leading zero makes an octal literal in C
+            value = int(text, 8) if len(text) > 1 and text[0] == "0" else int(text)
+        except ValueError:
+            return None
+        if node.value[0] == "-":
+            value = -value
+        return value if INT_MIN <= value <= INT_MAX else None
+
+    if isinstance(node, Float):
+        return float(node.value)
+
+    return None
+
+
+def literal(value):
+    """Return a Num or Float node for value, or None if C cannot hold it"""
+
+    if isinstance(value, int):
+        if not INT_MIN <= value <= INT_MAX:
+            return None
+        return Num(Token(str(value), TokenType.INTEGER))
+
+    if not math.isfinite(value):
+        return None
+
+    text = repr(float(value))
+    if "." not in text and "e" not in text:
+        text += ".0"
+    return Float(Token(text, TokenType.FLOAT))
+
+
+def evaluate(kind, left, right):
+    """Return the literal node for left op right under C's usual arithmetic
+    conversions, or None if the result is not a safe constant"""
+
+    if kind in COMPARISONS:
+        return literal(int(COMPARISONS[kind](left, right)))
+
+    # A float operand makes the operation single precision unless the other
+    # operand is a double
+    if isinstance(left, Single) or isinstance(right, Single):
+        if type(left) is not float and type(right) is not float:
+            left, right = single(left), single(right)
+            if left is None or right is None:
+                return None
+
+            result = arithmetic(kind, float(left), float(right))
+            result = None if result is None else single(result)
+            return None if result is None else literal(result)
+
+    result = arithmetic(kind, left, right)
+    return None if result is None else literal(result)
+
+
+def arithmetic(kind, left, right):
+    """Return left op right, computed in double precision unless both are
+    ints, or None for division by zero"""
+
+    if isinstance(left, float) or isinstance(right, float):
+        left, right = float(left), float(right)
+
+    if kind == TokenType.PLUS:
+        return left + right
+
+    if kind == TokenType.MINUS:
+        return left - right
+
+    if kind == TokenType.ASTERISK:
+        return left * right
+
+    if kind == TokenType.SLASH and right:
+        if isinstance(left, float):
+            return left / right
+
+        # C int division truncates toward zero
+        quotient = abs(left) // abs(right)
+        return quotient if (left < 0) == (right < 0) else -quotient
+
+    return None
+
+
+def is_int(node, value):
+    """Return true if node is the int literal value"""
+
+    return isinstance(node, Num) and constant(node) == value
+
+
+def is_negation(node):
+    """Return true if node is the 0 - x the parser builds for unary minus"""
+
+    return (
+        isinstance(node, Bin_Op)
+        and node.op.kind == TokenType.MINUS
+        and is_int(node.left, 0)
+    )
+
+
+def is_integer(node, types):
+    """Return true if node is an int literal or a variable types, a map of
+    variable to C type, gives an integer type. Only floating values can be
+    -0, which adding 0 turns into 0"""
+
+    if isinstance(node, Num):
+        return True
+    return isinstance(node, Var) and types.get(node.value) in INTEGER_TYPES
+
+
+def simplify(node, left, right, root=False, cast=False, types=None):
+    """Return the simplified Bin_Op node with already optimized children.
+    Identities only drop int literals, which never change the C type of the
+    other operand. At the root of a LET they are skipped, since the
+    generator declares a Bin_Op value float. Those that add or subtract 0,
+    or a negation, only apply to integer operands, per is_integer over
+    types, as they would turn a floating -0 into 0 or back.
+
+    cast marks nodes on the left spine of a PRINT expression, whose leftmost
+    operand the generator casts to float. Those fold in single precision,
+    and only while the result stays a float, so the cast still applies"""
+
+    kind = node.op.kind
+    left_value, right_value = constant(left), constant(right)
+    types = types or {}
+
+    if cast and left_value is not None:
+        left_value = single(left_value)
+        if type(right_value) is float:
+            right_value = None
+
+    if left_value is not None and right_value is not None:
+        folded = evaluate(kind, left_value, right_value)
+        if folded is not None:
+            return folded.copy_span(node)
+
+    if not root and not isinstance(left, String) and not isinstance(right, String):
+        # Dropping the left operand would move the cast onto the right one
+        keep_left = not cast
+
+        if kind == TokenType.PLUS:
+            if is_int(right, 0) and is_integer(left, types):
+                return left
+            if keep_left and is_int(left, 0) and is_integer(right, types):
+                return right
+
+        elif kind == TokenType.MINUS:
+            if is_int(right, 0) and is_integer(left, types):
+                return left
+            if (
+                keep_left
+                and is_int(left, 0)
+                and is_negation(right)
+                and is_integer(right.right, types)
+            ):
+                return right.right
+
+        elif kind == TokenType.ASTERISK:
+            if is_int(right, 1):
+                return left
+            if keep_left and is_int(left, 1):
+                return right
+
+        elif kind == TokenType.SLASH:
+            if is_int(right, 1):
+                return left
+
+    # x - (0 - y) is x + y and x + (0 - y) is x - y for integers. The result
+    # is still a Bin_Op led by x, so this holds at the root and under a cast
+    if (
+        kind in NEGATED
+        and is_negation(right)
+        and is_integer(left, types)
+        and is_integer(right.right, types)
+    ):
+        return Bin_Op(left, NEGATED[kind], right.right).copy_span(node)
+
+    if left is node.left and right is node.right:
+        return node
+
+    return Bin_Op(left, node.op, right).copy_span(node)
+
+
+def summarize(statement):
+    """Return {While node: (names assigned in its body, whether the body
+    declares a label)} for every WHILE in statement, in one walk"""
+
+    summaries = {}
+    # Each entry is (node, children done); assigned and labelled sets of
+    # finished blocks are folded into their parent's on the way up
+    stack = [(statement, False)]
+    totals = [[set(), False]]
+
+    while stack:
+        node, done = stack.pop()
+
+        if isinstance(node, (If, While)) and not done:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.body))
+            totals.append([set(assigned_by_condition(node.condition)), False])
+            continue
+
+        if isinstance(node, (If, While)):
+            assigned, labelled = totals.pop()
+            if isinstance(node, While):
+                summaries[node] = (assigned, labelled)
+            totals[-1][0] |= assigned
+            totals[-1][1] = totals[-1][1] or labelled
+
+        elif isinstance(node, Let):
+            totals[-1][0].add(node.name_token.text)
+        elif isinstance(node, Input):
+            totals[-1][0].add(node.input_token.text)
+        elif isinstance(node, Label):
+            totals[-1][1] = True
+
+    return summaries
+
+
+def assigned_by_condition(condition):
+    """Return the variable a condition like x = 1 assigns, which "=" does in
+    the generated C"""
+
+    if (
+        isinstance(condition, Bin_Op)
+        and condition.op.kind == TokenType.EQ
+        and isinstance(condition.left, Var)
+    ):
+        return [condition.left.value]
+    return []
+
+
+def intersect(first, second):
+    """Return the constants two control flow paths agree on"""
+
+    return {name: value for name, value in first.items() if second.get(name) == value}
+
+
+class Block:
+    """A statement list being optimized, with the constants known at the
+    current statement"""
+
+    __slots__ = ("statements", "index", "out", "env", "finish")
+
+    def __init__(self, statements, env, finish=None):
+        self.statements = statements
+        self.index = 0
+        self.out = []
+        self.env = env
+        self.finish = finish
+
+
+class Optimizer:
+    """Folds constant expressions and propagates int constants assigned by
+    LET into later uses. Blocks are walked with an explicit stack, so deep
+    nesting does not recurse. The input tree is not modified; unchanged
+    subtrees are shared with it.
+
+    Without types the tree is optimized for CodeGenerator's legacy typing.
+    With a {variable: C type} map from type_infer, expressions follow plain
+    C typing and fold without the legacy float conversions"""
+
+    def __init__(self, propagate=True, types=None):
+        self.propagate = propagate
+        self.typed = types is not None
+        self.vars_declared = dict(types or {})
+        self.env = {}
+
+    def program(self, node):
+        """Return the optimized Program"""
+
+        return node.__class__(list(self.statements(node.statements)))
+
+    def statements(self, statements):
+        """Yields each optimized top level statement as soon as it is done"""
+
+        for stm in statements:
+            outer = Block([stm], self.env)
+            blocks = [outer]
+            summaries = summarize(stm)
+
+            while blocks:
+                block = blocks[-1]
+
+                if block.index == len(block.statements):
+                    blocks.pop()
+                    if block.finish is not None:
+                        block.finish(block)
+                    continue
+
+                node = block.statements[block.index]
+                block.index += 1
+
+                if isinstance(node, If):
+                    blocks.append(self.enter_if(node, block))
+                elif isinstance(node, While):
+                    blocks.append(self.enter_while(node, block, summaries[node]))
+                else:
+                    block.out.append(self.simple_statement(node, block))
+
+            self.env = outer.env
+            yield from outer.out
+
+    def enter_if(self, node, block):
+        """Return the Block for an IF body; the constants after the IF are
+        those both the taken and skipped paths agree on"""
+
+        condition = self.condition(node.condition, block)
+
+        def finish(body):
+            block.out.append(self.rebuild(node, condition, body.out))
+            block.env = intersect(block.env, body.env)
+
+        return Block(node.body, dict(block.env), finish)
+
+    def enter_while(self, node, block, summary):
+        """Return the Block for a WHILE body. Variables the loop assigns are
+        unknown at its head; a label inside can be reached with any values,
+        so then nothing is known"""
+
+        assigned, labelled = summary
+
+        if labelled:
+            block.env = {}
+        else:
+            block.env = {
+                name: value for name, value in block.env.items() if name not in assigned
+            }
+
+        condition = self.condition(node.condition, block)
+
+        def finish(body):
+            block.out.append(self.rebuild(node, condition, body.out))
+
+        return Block(node.body, dict(block.env), finish)
+
+    def rebuild(self, node, condition, body):
+        """Return node with the optimized condition and body, reusing node
+        when neither changed"""
+
+        if condition is node.condition and all(
+            new is old for new, old in zip(body, node.body)
+        ):
+            return node
+        return node.__class__(condition, body).copy_span(node)
+
+    def condition(self, node, block):
+        """Optimizes a block condition. x = e assigns x in the generated C,
+        so x is not replaced and stops being a known constant"""
+
+        names = assigned_by_condition(node)
+        if not names:
+            return self.expression(node, block.env)
+
+        block.env = {name: v for name, v in block.env.items() if name not in names}
+        right = self.expression(node.right, block.env)
+        if right is node.right:
+            return node
+        return Bin_Op(node.left, node.op, right).copy_span(node)
+
+    def simple_statement(self, node, block):
+        """Return the optimized statement, updating the known constants"""
+
+        if isinstance(node, Let):
+            return self.let(node, block)
+
+        if isinstance(node, Print):
+            expression = self.expression(
+                node.expression, block.env, cast=not self.typed
+            )
+            if expression is node.expression:
+                return node
+            return Print(expression).copy_span(node)
+
+        if isinstance(node, Input):
+            name = node.input_token.text
+            self.vars_declared.setdefault(name, "float")
+            block.env = {n: v for n, v in block.env.items() if n != name}
+
+        elif isinstance(node, (Label, Goto)):
+            # Control can arrive at a label from anywhere
+            block.env = {}
+
+        return node
+
+    def let(self, node, block):
+        """Optimizes a LET. Under legacy typing a Bin_Op value makes the
+        generator declare the variable float, so a value folding to an int
+        becomes a float literal"""
+
+        name = node.name_token.text
+        expression = self.expression(node.expression, block.env, not self.typed)
+
+        if (
+            not self.typed
+            and isinstance(node.expression, Bin_Op)
+            and isinstance(expression, Num)
+        ):
+            expression = literal(float(constant(expression))).copy_span(expression)
+
+        self.vars_declared.setdefault(name, self.get_c_type(expression))
+
+        env = {n: v for n, v in block.env.items() if n != name}
+        value = constant(expression)
+
+        if self.propagate and self.vars_declared[name] == "int" and value is not None:
+            # Assigning to an int variable truncates like a C conversion
+            value = int(value) if math.isfinite(value) else None
+            if value is not None and INT_MIN <= value <= INT_MAX:
+                env[name] = value
+
+        block.env = env
+
+        if expression is node.expression:
+            return node
+        return Let(node.name_token, expression).copy_span(node)
+
+    def expression(self, node, env, root=False, cast=False):
+        """Return the optimized expression, replacing known variables and
+        folding bottom up with an explicit stack. root marks a LET value and
+        cast a PRINT one, see simplify"""
+
+        spine = set()
+        item = node
+        while cast and isinstance(item, Bin_Op):
+            spine.add(item)
+            item = item.left
+
+        results = []
+        stack = [(node, False)]
+
+        while stack:
+            item, done = stack.pop()
+
+            if isinstance(item, Bin_Op):
+                if done:
+                    right = results.pop()
+                    left = results.pop()
+                    results.append(
+                        simplify(
+                            item,
+                            left,
+                            right,
+                            root and item is node,
+                            item in spine,
+                            self.vars_declared,
+                        )
+                    )
+                else:
+                    stack += ((item, True), (item.right, False), (item.left, False))
+
+            elif isinstance(item, Var) and item.value in env:
+                results.append(literal(env[item.value]).copy_span(item))
+
+            else:
+                results.append(item)
+
+        return results[0]
+
+    def get_c_type(self, node):
+        """The C type CodeGenerator declares for a LET with value node"""
+
+        if isinstance(node, String):
+            return "char *"
+        if isinstance(node, Num):
+            return "int"
+        if isinstance(node, Var):
+            return self.vars_declared.get(node.value, "float")
+        return "float"
+
+
+def optimize(program, propagate=True):
+    """Return an optimized copy of program"""
+
+    return Optimizer(propagate).program(program)
@@ -1,25 +1,81 @@
 """Class representing a Parser object"""
 
+import collections
 import sys
 
-
 from .token_type import TokenType
 from .ast import *
+from .source_map import describe
 from .string_token import Token
+from .trace import instrument
+
+STRING = TokenType.STRING
+
+# Comparison operators. They bind loosest, and do not chain: a < b < c stops
+# after a < b
+COMPARISONS = frozenset(
+    [
+        TokenType.EQ,
+        TokenType.NOTEQ,
+        TokenType.GT,
+        TokenType.GTEQ,
+        TokenType.LT,
+        TokenType.LTEQ,
+    ]
+)
+COMPARISON_POWER = 10
+ARITHMETIC_POWER = 20
+
+# Binding power of each binary operator; higher binds tighter and equal
+# powers group to the left. New operators only need an entry here
+BINDING_POWERS = {
+    **dict.fromkeys(COMPARISONS, COMPARISON_POWER),
+    TokenType.PLUS: ARITHMETIC_POWER,
+    TokenType.MINUS: ARITHMETIC_POWER,
+    TokenType.ASTERISK: 30,
+    TokenType.SLASH: 30,
+}
+
+# Prefix operators, applied to the primary right after them
+PREFIXES = frozenset([TokenType.PLUS, TokenType.MINUS])
+
+# Node class of each primary token
+PRIMARIES = {
+    TokenType.INTEGER: Num,
+    TokenType.FLOAT: Float,
+    TokenType.STRING: String,
+    TokenType.IDENT: Var,
+}
+
+# Block statements: opening keyword -> (header end, closing keyword, node class)
+BLOCKS = {
+    TokenType.IF: (TokenType.THEN, TokenType.ENDIF, If),
+    TokenType.WHILE: (TokenType.REPEAT, TokenType.ENDWHILE, While),
+}
 
 
 class Parser:
     """Parser object controls the lexer and request a new token as needed"""
 
-    def __init__(self, lexer):
+    def __init__(self, lexer, tracer=None):
         self.lexer = lexer
+        self.tracer = tracer
+
+        if tracer is not None:
+            instrument(self, tracer)
 
         self.symbols = set()
         self.labels_declared = set()
-        self.labels_gotoed = set()
+        # Label -> offset of the first GOTO to it
+        self.labels_gotoed = {}
 
         self.curr_token = None
         self.peek_token = None
+        # Source offsets of the current and next tokens
+        self.curr_start = self.peek_start = 0
+        # (token, start) pairs read past peek_token by peek() from lexers
+        # that cannot look ahead
+        self.queued = collections.deque()
         self.next_token()
         self.next_token()
 
@@ -39,6 +95,23 @@ class Parser:
         else:
             return False
 
+    def peek(self, distance=1):
+        """Return the token distance places after the current one. Lexers with
+        their own lookahead, like BufferLexer, are read in place"""
+
+        if distance == 1:
+            return self.peek_token
+
+        lookahead = getattr(self.lexer, "lookahead", None)
+        if lookahead is not None:
+            return lookahead(distance - 2)
+
+        lexer = self.lexer
+        while len(self.queued) < distance - 1:
+            token = lexer.get_token()
+            self.queued.append((token, lexer.token_start))
+        return self.queued[distance - 2][0]
+
     def match(self, kind):
         """Try to match current token. If not, error. Advances the current token"""
 
@@ -51,13 +124,34 @@ class Parser:
         """Advances the current token"""
 
         self.curr_token = self.peek_token
-        self.peek_token = self.lexer.get_token()
+        self.curr_start = self.peek_start
+
+        if self.queued:
+            self.peek_token, self.peek_start = self.queued.popleft()
+        else:
+            lexer = self.lexer
+            self.peek_token = lexer.get_token()
+            self.peek_start = lexer.token_start
+
+    def curr_end(self):
+        """Return the offset just past the current token. Token text is the
+        source text, less the quotes of a string"""
+
+        token = self.curr_token
+        if token.kind is STRING:
+            return self.curr_start + len(token.text) + 2
+        return self.curr_start + len(token.text)
+
+    def span(self, node, start, end):
+        """Gives node the source span from offset start to end, and returns it"""
+
+        node.start = start
+        node.end = end
+        return node
 
     def nl(self):
         """Requires at least one newline"""
 
-        print("NEWLINE")
-
         self.match(TokenType.NEWLINE)
         while self.check_token(TokenType.NEWLINE):
             self.next_token()
@@ -66,175 +160,161 @@ class Parser:
         """primary ::= integer : ident"""
 
         assert self.curr_token is not None
-        print("PRIMARY (" + self.curr_token.text + ")")
 
         token = self.curr_token
+        node_class = PRIMARIES.get(token.kind)
 
-        if self.check_token(TokenType.INTEGER):
-            self.next_token()
-            return Num(token)
-        elif self.check_token(TokenType.FLOAT):
-            self.next_token()
-            return Float(token)
-        elif self.check_token(TokenType.STRING):
-            self.next_token()
-            return String(token)
-        elif self.check_token(TokenType.IDENT):
+        if node_class is None:
+            self.abort("Unexpected token at " + token.text)
 
-            if self.curr_token.text not in self.symbols:
-                self.abort(
-                    "Referencing variable before assignment: " + self.curr_token.text
-                )
+        if node_class is Var and token.text not in self.symbols:
+            self.abort("Referencing variable before assignment: " + token.text)
 
-            self.next_token()
-            return Var(token)
-        else:
-            self.abort("Unexpected token at " + self.curr_token.text)
+        node = node_class(token)
+
+        node.start = self.curr_start
+        node.end = self.curr_end()
+        self.next_token()
+        return node
 
     # Args : void
     # Returns : void
     def unary(self):
         """unary ::= ["+" | "-"] primary"""
 
-        print("UNARY")
-
-        if self.check_token(TokenType.PLUS) or self.check_token(TokenType.MINUS):
+        if self.curr_token.kind in PREFIXES:
             op = self.curr_token
+            start = self.curr_start
             self.next_token()
             primary_node = self.primary()
 
             zero_node = Num(Token("0", TokenType.INTEGER))
-            return Bin_Op(zero_node, op, primary_node)
+            return self.span(
+                Bin_Op(zero_node, op, primary_node), start, primary_node.end
+            )
 
         return self.primary()
 
-    # Args : void
-    # Returns : void
-    def term(self):
-        """term ::= unary {( "/" | "*") unary}"""
+    def binary(self, floor):
+        """Parses unary operands joined by binary operators whose binding
+        power is at least floor, by precedence climbing over BINDING_POWERS.
+        Operators waiting for their right operand are kept on a stack, so
+        each operand takes one pass of the loop whatever its precedence"""
 
-        print("TERM")
+        powers = BINDING_POWERS
+        primary = self.primary
+        unary = self.unary
+        # (left operand, operator, floor to restore) of each waiting operator
+        waiting = []
+        left = unary() if self.curr_token.kind in PREFIXES else primary()
 
-        left = self.unary()
-        op = self.curr_token
-        while self.check_token(TokenType.SLASH) or self.check_token(TokenType.ASTERISK):
-            self.next_token()
-            right = self.unary()
-            left = Bin_Op(left, op, right)
+        while True:
+            op = self.curr_token
+            power = powers.get(op.kind)
 
-        return left
+            if power is None or power < floor:
+                if not waiting:
+                    return left
+
+                outer, op, floor = waiting.pop()
+                left = self.span(Bin_Op(outer, op, left), outer.start, left.end)
+                if op.kind in COMPARISONS:
+                    floor = COMPARISON_POWER + 1
+                continue
+
+            self.next_token()
+            waiting.append((left, op, floor))
+            floor = power + 1
+            left = unary() if self.curr_token.kind in PREFIXES else primary()
 
     # Args : void
     # Returns : void
     def expression(self):
-        """expression ::= term {("+" | "-") term}"""
-
-        print("EXPRESSION")
+        """expression ::= term {("+" | "-") term}
+        term ::= unary {("/" | "*") unary}"""
 
-        left = self.term()
-        op = self.curr_token
-        while self.check_token(TokenType.PLUS) or self.check_token(TokenType.MINUS):
-            self.next_token()
-            right = self.term()
-            left = Bin_Op(left, op, right)
-
-        return left
+        return self.binary(ARITHMETIC_POWER)
 
     def is_comparison_operator(self):
         """Return true if the current token is a comparison operator"""
 
-        return (
-            self.check_token(TokenType.EQ)
-            or self.check_token(TokenType.NOTEQ)
-            or self.check_token(TokenType.GT)
-            or self.check_token(TokenType.GTEQ)
-            or self.check_token(TokenType.LT)
-            or self.check_token(TokenType.LTEQ)
-        )
+        return self.curr_token is not None and self.curr_token.kind in COMPARISONS
 
     def comparison(self):
         """comparison ::= expression ((== | != | > | >= | < | <=) expression)"""
 
-        print("COMPARISON")
-
-        left = self.expression()
-        op = self.curr_token
-        if self.is_comparison_operator():
-            self.next_token()
-            right = self.expression()
-            left = Bin_Op(left, op, right)
+        node = self.binary(COMPARISON_POWER)
 
-        else:
+        if node.__class__ is not Bin_Op or node.op.kind not in COMPARISONS:
             if self.curr_token is not None:
                 self.abort("Expected comparison operator at " + self.curr_token.text)
 
-        return left
+        return node
 
     def statement(self):
-        """Check the first tocken to see what kind of statement this is"""
+        """Parses one statement, including any IF/WHILE blocks nested in it.
+        Open blocks are kept on an explicit stack instead of the call stack,
+        so nesting depth is not limited by the recursion limit"""
 
-        assert self.curr_token is not None
+        blocks = []
 
-        if self.check_token(TokenType.PRINT):
-            print("STATEMENT-PRINT")
-            self.next_token()
+        while True:
+            assert self.curr_token is not None
 
-            if self.check_token(TokenType.STRING):
-                # simple string
-                token = self.curr_token
-                self.next_token()
-                return Print(String(token))
-            else:
-                # Expect an expression
+            if blocks and self.check_token(blocks[-1][0]):
+                end_kind, node_class, condition, body, start = blocks.pop()
+                end = self.curr_end()
+                self.match(end_kind)
+                node = self.span(node_class(condition, body), start, end)
 
-                exp_node = self.expression()
+            elif self.curr_token.kind in BLOCKS:
+                header_end, end_kind, node_class = BLOCKS[self.curr_token.kind]
+                start = self.curr_start
                 self.next_token()
-                return Print(exp_node)
-
-        elif self.check_token(TokenType.IF):
-            print("IF-STATEMENT")
-            self.next_token()
-
-            condition = self.comparison()
-
-            self.match(TokenType.THEN)
-            self.nl()
-
-            body = []
 
-            while not self.check_token(TokenType.ENDIF):
-                stm_token = self.statement()
+                condition = self.comparison()
 
-                if stm_token is not None:
-                    body.append(stm_token)
+                self.match(header_end)
+                self.nl()
 
-            self.match(TokenType.ENDIF)
+                blocks.append((end_kind, node_class, condition, [], start))
+                continue
 
-            return If(condition, body)
+            else:
+                node = self.simple_statement()
 
-        elif self.check_token(TokenType.WHILE):
-            print("STATEMENT-WHILE")
-            self.next_token()
+            if not blocks:
+                return node
 
-            condition = self.comparison()
+            if node is not None:
+                blocks[-1][3].append(node)
 
-            self.match(TokenType.REPEAT)
-            self.nl()
+    def simple_statement(self):
+        """Check the first tocken to see what kind of statement this is"""
 
-            body = []
+        assert self.curr_token is not None
 
-            while not self.check_token(TokenType.ENDWHILE):
-                stm_token = self.statement()
+        start = self.curr_start
 
-                if stm_token is not None:
-                    body.append(stm_token)
+        if self.check_token(TokenType.PRINT):
+            self.next_token()
 
-            self.match(TokenType.ENDWHILE)
+            if self.check_token(TokenType.STRING):
+                # simple string
+                token = self.curr_token
+                string_start = self.curr_start
+                end = self.curr_end()
+                self.next_token()
+                string_node = self.span(String(token), string_start, end)
+                return self.span(Print(string_node), start, end)
+            else:
+                # Expect an expression
 
-            return While(condition, body)
+                exp_node = self.expression()
+                self.next_token()
+                return self.span(Print(exp_node), start, exp_node.end)
 
         elif self.check_token(TokenType.LABEL):
-            print("STATEMENT-LABEL")
             self.next_token()
 
             if self.curr_token.text in self.labels_declared:
@@ -242,23 +322,22 @@ class Parser:
             self.labels_declared.add(self.curr_token.text)
 
             token = self.curr_token
+            end = self.curr_end()
             self.match(TokenType.IDENT)
 
-            return Label(token)
+            return self.span(Label(token), start, end)
 
         elif self.check_token(TokenType.GOTO):
-            print("STATEMENT-GOTO")
             self.next_token()
-            self.labels_gotoed.add(self.curr_token.text)
+            self.labels_gotoed.setdefault(self.curr_token.text, start)
 
             token = self.curr_token
+            end = self.curr_end()
             self.match(TokenType.IDENT)
 
-            return Goto(token)
+            return self.span(Goto(token), start, end)
 
         elif self.check_token(TokenType.LET):
-            print("STATEMENT-LET")
-
             self.next_token()
             if self.curr_token.text not in self.symbols:
                 self.symbols.add(self.curr_token.text)
@@ -266,23 +345,21 @@ class Parser:
             name_token = self.curr_token
             self.match(TokenType.IDENT)
             self.match(TokenType.EQ)
-            print(self.curr_token.kind)
-            print(self.curr_token.text)
             expression = self.expression()
 
-            return Let(name_token, expression)
+            return self.span(Let(name_token, expression), start, expression.end)
 
         elif self.check_token(TokenType.INPUT):
-            print("STATEMET-INPUT")
             self.next_token()
 
             if self.curr_token.text not in self.symbols:
                 self.symbols.add(self.curr_token.text)
 
             token = self.curr_token
+            end = self.curr_end()
             self.match(TokenType.IDENT)
 
-            return Input(token)
+            return self.span(Input(token), start, end)
 
         # else:
         #     if self.curr_token is not None:
@@ -299,9 +376,11 @@ class Parser:
     def program(self):
         """Parses all the statements in the program"""
 
-        print("PROGRAM")
+        return Program(list(self.statements()))
 
-        statements = []
+    def statements(self):
+        """Yields top level statements one at a time as they are parsed, so
+        callers can process a program without holding all of it"""
 
         # Handle newlines at the start of the input
         while self.check_token(TokenType.NEWLINE):
@@ -311,15 +390,23 @@ class Parser:
             statement_node = self.statement()
 
             if statement_node is not None:
-                statements.append(statement_node)
+                yield statement_node
 
-        for label in self.labels_gotoed:
+        for label, start in self.labels_gotoed.items():
             if label not in self.labels_declared:
-                self.abort("GOTO label undeclared: " + label)
+                self.abort("GOTO label undeclared: " + label, start)
+
+    def location(self, offset):
+        """Return the (line, column) of a source offset, or None if the lexer
+        cannot tell"""
+
+        location = getattr(self.lexer, "location", None)
+        return None if location is None else location(offset)
 
-        return Program(statements)
+    def abort(self, message, offset=None):
+        """Handle errors, at offset or the current token"""
 
-    def abort(self, message):
-        """Handle errors"""
+        if offset is None:
+            offset = self.curr_start
 
-        raise Exception("Error: " + message)
+        raise Exception("Error: " + message + describe(self.location(offset)))
@@ -0,0 +1,155 @@
+"""Compile pipelines wiring the lexer, parser and code generator together"""
+
+from .bytecode import compile_program
+from .code_gen import CodeGenerator
+from .dead_code import DeadCodeEliminator
+from .lex import create_lexer
+from .loops import LoopOptimizer
+from .optimize import Optimizer
+from .parse import Parser
+from .serialize import to_json, write_json
+from .table_lex import StreamLexer
+from .type_infer import infer_types as infer_program_types
+
+# Indentation json.dump(..., indent=4) gives items of Program.statements
+STATEMENT_INDENT = "\n" + " " * 8
+
+
+def compile_source(
+    source,
+    engine="char",
+    tracer=None,
+    optimize=False,
+    infer_types=False,
+    eliminate_dead_code=False,
+    optimize_loops=False,
+):
+    """Compiles a source string, returning the C code and the AST as JSON text.
+    With optimize the C is generated from the optimized tree, with
+    infer_types each variable gets its inferred int, long long or double
+    type, with eliminate_dead_code dead statements are not emitted, and with
+    optimize_loops invariant computations are hoisted out of WHILE loops and
+    counter multiplications turned into additions. The JSON is always the
+    tree as parsed"""
+
+    program, c_code = compile_tree(
+        source,
+        engine,
+        tracer,
+        optimize,
+        infer_types,
+        eliminate_dead_code,
+        optimize_loops,
+    )
+    return c_code, to_json(program)
+
+
+def compile_tree(
+    source,
+    engine="char",
+    tracer=None,
+    optimize=False,
+    infer_types=False,
+    eliminate_dead_code=False,
+    optimize_loops=False,
+):
+    """Compiles a source string like compile_source, returning the parsed
+    Program and the C code"""
+
+    program = Parser(create_lexer(source, engine), tracer).program()
+    tree, types = transform(
+        program, optimize, infer_types, eliminate_dead_code, optimize_loops
+    )
+    return program, CodeGenerator(types).generate(tree)
+
+
+def compile_mapped(
+    source,
+    engine="char",
+    optimize=False,
+    infer_types=False,
+    eliminate_dead_code=False,
+    optimize_loops=False,
+):
+    """Compiles a source string like compile_tree, returning the parsed
+    Program, whose nodes carry their source spans, the C code and a
+    SourceMap from C lines to source lines"""
+
+    lexer = create_lexer(source, engine)
+    program = Parser(lexer).program()
+    tree, types = transform(
+        program, optimize, infer_types, eliminate_dead_code, optimize_loops
+    )
+    c_code, source_map = CodeGenerator(types).generate_mapped(tree, lexer.location)
+    return program, c_code, source_map
+
+
+def transform(
+    program,
+    optimize=False,
+    infer_types=False,
+    eliminate_dead_code=False,
+    optimize_loops=False,
+):
+    """Return the tree to generate C from and the variable types to generate
+    it with, or None for the legacy typing"""
+
+    types = infer_program_types(program) if infer_types else None
+    tree = Optimizer(types=types).program(program) if optimize else program
+
+    if optimize_loops:
+        loop_optimizer = LoopOptimizer(types)
+        tree = loop_optimizer.program(tree)
+        types = loop_optimizer.types
+
+    if eliminate_dead_code:
+        eliminator = DeadCodeEliminator(types)
+        tree = eliminator.program(tree)
+        types = eliminator.types
+
+    return tree, types
+
+
+def compile_bytecode(source, engine="char", infer_types=False):
+    """Compiles a source string to bytecode for the VM, with the variable
+    types of the C compile_source generates for the same options"""
+
+    program = Parser(create_lexer(source, engine)).program()
+    types = infer_program_types(program) if infer_types else None
+    return compile_program(program, types)
+
+
+def compile_stream(source_file, c_file, ast_file=None, optimize=False):
+    """Compiles source_file statement by statement, writing C to c_file and,
+    optionally, the AST JSON to ast_file as each statement is parsed.
+    Peak memory follows the largest statement rather than the program size.
+    The JSON is laid out exactly like json.dump(tree.to_dict(), indent=4)"""
+
+    parser = Parser(StreamLexer(source_file))
+    statements = parser.statements()
+
+    if ast_file is not None:
+        statements = write_statements_json(statements, ast_file)
+
+    if optimize:
+        statements = Optimizer().statements(statements)
+
+    CodeGenerator().write_program(statements, c_file)
+
+
+def write_statements_json(statements, ast_file):
+    """Passes statements through while writing each one's JSON to ast_file"""
+
+    ast_file.write('{\n    "type": "Program",\n    "statements": [')
+    separator = STATEMENT_INDENT
+
+    for stm in statements:
+        ast_file.write(separator)
+        write_json(stm, ast_file, indent=4, level=2)
+        separator = "," + STATEMENT_INDENT
+        yield stm
+
+    if separator != STATEMENT_INDENT:
+        ast_file.write("\n    ")
+
+    ast_file.write("]\n}")
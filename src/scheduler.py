@@ -0,0 +1,475 @@
+"""Admission control and deadlines for the server's compiles: a limit on
+source size, a bounded number of compiles running and waiting, and time
+budgets per phase that stop lexing, parsing, JSON serialization or code
+generation mid-run. Compiles can also be cancelled from another thread"""
+
+import contextlib
+import threading
+import time
+
+from .ast import Bin_Op, Float, Goto, If, Input, Label, Let, Num, Print, Program
+from .ast import String, Var, While
+from .bytecode import compile_program
+from .code_gen import CodeGenerator
+from .lex import create_lexer
+from .parse import Parser
+from .pipeline import transform
+from .serialize import iter_json
+from .token_type import TokenType
+from .type_infer import infer_types as infer_program_types
+
+# Why a compile was refused or stopped
+TOO_LARGE = "too_large"
+QUEUE_FULL = "queue_full"
+QUEUE_TIMEOUT = "queue_timeout"
+DEADLINE = "deadline"
+CANCELLED = "cancelled"
+
+REASONS = (TOO_LARGE, QUEUE_FULL, QUEUE_TIMEOUT, DEADLINE, CANCELLED)
+
+PHASES = ("lex", "parse", "serialize", "codegen")
+
+# Deadlines are checked once per this many tokens or generator visits
+CHECK_INTERVAL = 256
+
+# Nodes whose CodeGenerator visitors are wrapped with deadline checks
+NODES = (Num, Float, String, Var, Bin_Op, Print, Program, Let, Input, Label)
+NODES += (Goto, If, While)
+
+
+class Rejected(Exception):
+    """A compile refused before it ran, or stopped by a deadline or a
+    cancel. reason is one of TOO_LARGE, QUEUE_FULL, QUEUE_TIMEOUT, DEADLINE
+    and CANCELLED, and phase names the phase that was stopped"""
+
+    def __init__(self, reason, message, phase=None):
+        super().__init__("Error: " + message)
+        self.reason = reason
+        self.phase = phase
+
+
+class Deadline:
+    """Time budgets for the phases of one compile, {phase: seconds} with
+    None for no budget, all within an overall limit counted from creation.
+    Setting the threading.Event cancelled stops the compile at its next
+    check"""
+
+    def __init__(self, budgets, total=None, clock=time.monotonic, cancelled=None):
+        self.budgets = budgets
+        self.clock = clock
+        self.cancelled = cancelled
+        self.limit = None if total is None else clock() + total
+        self.phase = None
+        self.expires = self.limit
+        # Seconds taken by each finished phase, and when the current began
+        self.timings = {}
+        self.started = None
+
+    def remaining(self):
+        """Return the seconds left before the overall limit, or None"""
+
+        if self.limit is None:
+            return None
+        return max(0.0, self.limit - self.clock())
+
+    def start(self, phase):
+        """Finishes the current phase and starts the budget of phase,
+        checking that time is left"""
+
+        now = self.finish()
+        self.phase = phase
+        self.started = now
+        self.expires = self.limit
+
+        budget = self.budgets.get(phase)
+        if budget is not None:
+            expires = now + budget
+            if self.limit is None or expires < self.limit:
+                self.expires = expires
+
+        self.check()
+
+    def finish(self):
+        """Records the time taken by the current phase, and returns the
+        time now"""
+
+        now = self.clock()
+        if self.started is not None:
+            self.timings[self.phase] = now - self.started
+            self.started = None
+        return now
+
+    def check(self):
+        """Raises Rejected if the current phase is out of time or the compile
+        was cancelled"""
+
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise Rejected(CANCELLED, "Compile cancelled", self.phase)
+        if self.expires is not None and self.clock() > self.expires:
+            raise Rejected(
+                DEADLINE, f"Compile deadline exceeded during {self.phase}", self.phase
+            )
+
+    def ticker(self):
+        """Return a callable checking the deadline every CHECK_INTERVAL calls,
+        so hot loops pay for a clock read only now and then"""
+
+        check = self.check
+        count = [CHECK_INTERVAL]
+
+        def tick():
+            count[0] -= 1
+            if not count[0]:
+                count[0] = CHECK_INTERVAL
+                check()
+
+        return tick
+
+
+class ReplayLexer:
+    """Hands the parser tokens lexed ahead of time, with their offsets, and
+    raises the lexer's error where the parser would have reached it. EOF
+    repeats past the end. Every token returned ticks the deadline"""
+
+    def __init__(self, tokens, starts, error, location, tick):
+        self.tokens = tokens
+        self.starts = starts
+        self.error = error
+        self.location = location
+        self.tick = tick
+        self.index = 0
+        # Offset of the last token returned
+        self.token_start = 0
+
+    def get_token(self):
+        """Return the next token"""
+
+        self.tick()
+        index = self.index
+
+        if index == len(self.tokens):
+            raise self.error
+
+        if index < len(self.tokens) - 1 or self.error is not None:
+            self.index = index + 1
+        self.token_start = self.starts[index]
+        return self.tokens[index]
+
+
+def lex(source, engine, deadline):
+    """Return a ReplayLexer over every token of source, lexed under the
+    deadline. The buffer engine scans the whole source when it is built, so
+    with it only the tokens it hands out are checked"""
+
+    deadline.start("lex")
+    lexer = create_lexer(source, engine)
+    tick = deadline.ticker()
+    tokens = []
+    starts = []
+    error = None
+
+    try:
+        while True:
+            token = lexer.get_token()
+            tokens.append(token)
+            starts.append(lexer.token_start)
+            if token.kind == TokenType.EOF:
+                break
+            tick()
+    except Rejected:
+        raise
+    except Exception as e:
+        error = e
+
+    deadline.check()
+    return ReplayLexer(tokens, starts, error, lexer.location, tick)
+
+
+def checked(visitor, tick):
+    """Wraps a CodeGenerator visitor with a deadline tick"""
+
+    def wrapper(node):
+        tick()
+        return visitor(node)
+
+    return wrapper
+
+
+def parse_checked(source, deadline, engine="char", tracer=None):
+    """Return the Program parsed from source, lexed and parsed under their
+    budgets in deadline"""
+
+    lexer = lex(source, engine, deadline)
+
+    deadline.start("parse")
+    lexer.tick = deadline.ticker()
+    program = Parser(lexer, tracer).program()
+    deadline.check()
+    return program
+
+
+def compile_checked(
+    source, deadline, engine="char", tracer=None, on_ast=None, **options
+):
+    """Compiles source like pipeline.compile_source, returning the parsed
+    Program, the C code and the AST as JSON text, with each phase run under
+    its budget in deadline. The optional passes run with code generation
+    and are only checked before and after. The AST is serialized before
+    code generation, and passed to on_ast as soon as it is, if given"""
+
+    program = parse_checked(source, deadline, engine, tracer)
+
+    deadline.start("serialize")
+    chunks = []
+    for chunk in iter_json(program):
+        chunks.append(chunk)
+        deadline.check()
+    ast_json = "".join(chunks)
+
+    if on_ast is not None:
+        on_ast(ast_json)
+
+    deadline.start("codegen")
+    tree, types = transform(program, **options)
+    deadline.check()
+
+    generator = CodeGenerator(types)
+    tick = deadline.ticker()
+    for node in NODES:
+        visitor = getattr(generator, f"visit_{node.__name__.lower()}")
+        generator.visitors[node] = checked(visitor, tick)
+    c_code = generator.generate(tree)
+    deadline.check()
+    deadline.finish()
+
+    return program, c_code, ast_json
+
+
+def bytecode_checked(source, deadline, engine="char", infer_types=False):
+    """Compiles source like pipeline.compile_bytecode, returning the parsed
+    Program and the bytecode, lexed and parsed under their budgets in
+    deadline. Type inference and bytecode generation count as codegen and
+    are only checked before and after"""
+
+    program = parse_checked(source, deadline, engine)
+
+    deadline.start("codegen")
+    types = infer_program_types(program) if infer_types else None
+    code = compile_program(program, types)
+    deadline.check()
+    deadline.finish()
+
+    return program, code
+
+
+def mapped_checked(source, deadline, engine="char", **options):
+    """Compiles source like pipeline.compile_mapped, returning the parsed
+    Program, the C code and its SourceMap, lexed and parsed under their
+    budgets in deadline. The optional passes and code generation count as
+    codegen and are only checked before and after"""
+
+    lexer = lex(source, engine, deadline)
+
+    deadline.start("parse")
+    lexer.tick = deadline.ticker()
+    program = Parser(lexer).program()
+    deadline.check()
+
+    deadline.start("codegen")
+    tree, types = transform(program, **options)
+    c_code, source_map = CodeGenerator(types).generate_mapped(tree, lexer.location)
+    deadline.check()
+    deadline.finish()
+
+    return program, c_code, source_map
+
+
+class Scheduler:
+    """Admits compiles: sources over max_chars are refused, at most
+    concurrency compiles run at once and at most queue_limit wait for a
+    slot, each for at most queue_timeout seconds. Refusals raise Rejected
+    at once, so a saturated server answers quickly instead of queueing
+    without bound. Admitted compiles run in the calling thread under a
+    Deadline with the phase budgets, and an overall limit of timeout
+    seconds counted from arrival, so time spent waiting counts. Finished
+    and failed compiles are reported to metrics, a CompileMetrics, if
+    given"""
+
+    def __init__(
+        self,
+        concurrency,
+        queue_limit=0,
+        queue_timeout=1.0,
+        max_chars=None,
+        budgets=None,
+        timeout=None,
+        clock=time.monotonic,
+        metrics=None,
+    ):
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.max_chars = max_chars
+        self.budgets = dict(budgets or {})
+        self.timeout = timeout
+        self.clock = clock
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.running = 0
+        self.counts = dict.fromkeys(
+            ["admitted", "completed", *REASONS],
+            0,
+        )
+
+    def check_size(self, source):
+        """Raises Rejected if source is over the size limit"""
+
+        if self.max_chars is not None and len(source) > self.max_chars:
+            self.count(TOO_LARGE)
+            raise Rejected(
+                TOO_LARGE,
+                f"Source is {len(source)} characters, over the limit of"
+                f" {self.max_chars}",
+            )
+
+    def count(self, name):
+        """Adds one to counts[name]"""
+
+        with self.lock:
+            self.counts[name] += 1
+
+    @contextlib.contextmanager
+    def slot(self, deadline):
+        """Holds a compile slot for the with block, waiting in the queue if
+        there is room and time, or raises Rejected"""
+
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                full = self.waiting >= self.queue_limit
+                if full:
+                    self.counts[QUEUE_FULL] += 1
+                else:
+                    self.waiting += 1
+
+            if full:
+                raise Rejected(QUEUE_FULL, "Too many compiles waiting")
+
+            wait = self.queue_timeout
+            remaining = deadline.remaining()
+            if remaining is not None and (wait is None or remaining < wait):
+                wait = remaining
+
+            try:
+                acquired = self.slots.acquire(timeout=wait)
+            finally:
+                with self.lock:
+                    self.waiting -= 1
+
+            if not acquired:
+                self.count(QUEUE_TIMEOUT)
+                raise Rejected(QUEUE_TIMEOUT, "Timed out waiting for a compile slot")
+
+        with self.lock:
+            self.running += 1
+            self.counts["admitted"] += 1
+
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.running -= 1
+            self.slots.release()
+
+    def compile(
+        self,
+        source,
+        engine="char",
+        tracer=None,
+        timeout=None,
+        cancelled=None,
+        on_ast=None,
+        **options,
+    ):
+        """Compiles source like compile_source once admitted, returning the C
+        code and the AST JSON. timeout lowers the overall limit for this
+        compile, setting the threading.Event cancelled stops it, and on_ast
+        gets the AST JSON as soon as it is ready, before code generation"""
+
+        def work(deadline):
+            program, c_code, ast_json = compile_checked(
+                source, deadline, engine, tracer, on_ast, **options
+            )
+            return program, (c_code, ast_json)
+
+        return self.run(source, work, timeout, cancelled)
+
+    def compile_mapped(
+        self, source, engine="char", timeout=None, cancelled=None, **options
+    ):
+        """Compiles source like pipeline.compile_mapped once admitted,
+        returning the parsed Program, the C code and its SourceMap. timeout
+        and cancelled are as for compile"""
+
+        def work(deadline):
+            program, c_code, source_map = mapped_checked(
+                source, deadline, engine, **options
+            )
+            return program, (program, c_code, source_map)
+
+        return self.run(source, work, timeout, cancelled)
+
+    def compile_bytecode(
+        self, source, engine="char", infer_types=False, timeout=None, cancelled=None
+    ):
+        """Compiles source like pipeline.compile_bytecode once admitted,
+        returning the bytecode. timeout and cancelled are as for compile"""
+
+        def work(deadline):
+            return bytecode_checked(source, deadline, engine, infer_types)
+
+        return self.run(source, work, timeout, cancelled)
+
+    def run(self, source, work, timeout=None, cancelled=None):
+        """Admits source and returns the result of work(deadline), which
+        compiles it under the Deadline and returns the parsed Program and
+        its result"""
+
+        self.check_size(source)
+
+        if timeout is None or (self.timeout is not None and self.timeout < timeout):
+            timeout = self.timeout
+        deadline = Deadline(self.budgets, timeout, self.clock, cancelled)
+
+        metrics = self.metrics
+
+        with self.slot(deadline):
+            try:
+                program, result = work(deadline)
+            except Exception as e:
+                cancelled = isinstance(e, Rejected) and e.reason == CANCELLED
+                if isinstance(e, Rejected):
+                    self.count(e.reason)
+                if metrics is not None:
+                    # A cancel is the client moving on, not a failure
+                    failed = None if cancelled else deadline.phase
+                    metrics.record(source, deadline.timings, failed=failed)
+                raise
+
+        self.count("completed")
+        if metrics is not None:
+            metrics.record(source, deadline.timings, program)
+        return result
+
+    def stats(self):
+        """Return the slot, queue and outcome counts"""
+
+        with self.lock:
+            return {
+                "concurrency": self.concurrency,
+                "running": self.running,
+                "queue_limit": self.queue_limit,
+                "waiting": self.waiting,
+                **self.counts,
+            }
@@ -0,0 +1,478 @@
+"""Functions serializing ASTs to JSON text and to a compact binary format"""
+
+import array
+import json
+import re
+import struct
+import sys
+from json.decoder import scanstring
+from json.encoder import encode_basestring_ascii
+
+from .ast import Bin_Op, Float, Goto, If, Input, Label, Let, Num, Print, Program
+from .ast import String, Var, While
+from .string_token import Token
+from .table_lex import OPERATORS
+from .token_type import TokenType
+
+# Text pieces gathered before each chunk is handed out
+CHUNK_PARTS = 4096
+
+# JSON whitespace, numbers and literal names, for decode()
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?")
+NAMES = {"true": True, "false": False, "null": None}
+
+
+def dumps(obj, indent=None):
+    """Return obj as JSON text, laid out exactly like json.dumps(obj, indent=indent).
+    Trees too deep for the json module fall back to encode()"""
+
+    try:
+        return json.dumps(obj, indent=indent)
+    except RecursionError:
+        return encode(obj, indent)
+
+
+def encode(obj, indent=None):
+    """Return obj as JSON text in the json module's layout. Nested dicts and
+    lists are expanded with an explicit stack, so trees deeper than the
+    recursion limit still serialize"""
+
+    parts = []
+    # (value, level) entries; level None marks literal text
+    stack = [(obj, 0)]
+
+    while stack:
+        value, level = stack.pop()
+
+        if level is None:
+            parts.append(value)
+
+        elif isinstance(value, str):
+            parts.append(encode_basestring_ascii(value))
+
+        elif isinstance(value, dict):
+            if not value:
+                parts.append("{}")
+                continue
+
+            opening, separator, closing = layout(indent, level)
+            items = [("}", None), (closing, None)]
+
+            for i, (key, item) in enumerate(reversed(value.items())):
+                if i:
+                    items.append((separator, None))
+                items.append((item, level + 1))
+                items.append((encode_basestring_ascii(key) + ": ", None))
+
+            items.append(("{" + opening, None))
+            stack.extend(items)
+
+        elif isinstance(value, list):
+            if not value:
+                parts.append("[]")
+                continue
+
+            opening, separator, closing = layout(indent, level)
+            items = [("]", None), (closing, None)]
+
+            for i, item in enumerate(reversed(value)):
+                if i:
+                    items.append((separator, None))
+                items.append((item, level + 1))
+
+            items.append(("[" + opening, None))
+            stack.extend(items)
+
+        else:
+            parts.append(json.dumps(value))
+
+    return "".join(parts)
+
+
+def loads(text):
+    """Return the value of JSON text, like json.loads. Trees too deep for
+    the json module fall back to decode()"""
+
+    try:
+        return json.loads(text)
+    except RecursionError:
+        return decode(text)
+
+
+def decode(text):
+    """Return the value of JSON text, reading nested objects and arrays with
+    an explicit stack, so trees deeper than the recursion limit decode"""
+
+    # Open containers, innermost last, and the keys awaiting their values
+    stack = []
+    keys = []
+    pos = 0
+
+    while True:
+        pos = WHITESPACE.match(text, pos).end()
+        char = text[pos : pos + 1]
+
+        if char in ("{", "["):
+            pos = WHITESPACE.match(text, pos + 1).end()
+            if text[pos : pos + 1] == ("}" if char == "{" else "]"):
+                value = {} if char == "{" else []
+                pos += 1
+            else:
+                stack.append({} if char == "{" else [])
+                if char == "{":
+                    pos = decode_key(text, pos, keys)
+                continue
+
+        elif char == '"':
+            value, pos = scanstring(text, pos + 1)
+
+        else:
+            match = NUMBER.match(text, pos)
+            if match:
+                number = match.group()
+                value = float(number) if match[1] or match[2] else int(number)
+                pos = match.end()
+            else:
+                for name, value in NAMES.items():
+                    if text.startswith(name, pos):
+                        pos += len(name)
+                        break
+                else:
+                    raise Exception(f"Error: Invalid JSON at offset {pos}")
+
+        # Add the value to its container, closing every container it ends
+        while True:
+            if not stack:
+                if WHITESPACE.match(text, pos).end() != len(text):
+                    raise Exception(f"Error: Extra data in JSON at offset {pos}")
+                return value
+
+            container = stack[-1]
+            if isinstance(container, list):
+                container.append(value)
+            else:
+                container[keys.pop()] = value
+
+            pos = WHITESPACE.match(text, pos).end()
+            char = text[pos : pos + 1]
+
+            if char == ",":
+                pos += 1
+                if isinstance(container, dict):
+                    pos = decode_key(text, WHITESPACE.match(text, pos).end(), keys)
+                break
+
+            if char != ("]" if isinstance(container, list) else "}"):
+                raise Exception(f"Error: Invalid JSON at offset {pos}")
+
+            value = stack.pop()
+            pos += 1
+
+
+def decode_key(text, pos, keys):
+    """Reads the key of an object member at pos onto keys, returning the
+    offset after its colon"""
+
+    if text[pos : pos + 1] != '"':
+        raise Exception(f"Error: Invalid JSON at offset {pos}")
+
+    key, pos = scanstring(text, pos + 1)
+    pos = WHITESPACE.match(text, pos).end()
+
+    if text[pos : pos + 1] != ":":
+        raise Exception(f"Error: Invalid JSON at offset {pos}")
+
+    keys.append(key)
+    return pos + 1
+
+
+def layout(indent, level):
+    """Return the text after an opening bracket, between items and before
+    the closing bracket of a container at level"""
+
+    if indent is None:
+        return "", ", ", ""
+
+    inner = "\n" + " " * (indent * (level + 1))
+    return inner, "," + inner, "\n" + " " * (indent * level)
+
+
+def iter_json(node, indent=None, level=0, spans=False):
+    """Yields the JSON text of AST node in chunks, identical to
+    dumps(node.to_dict(), indent) for a node at level. Text is produced
+    straight from each node's fields, with no nested dict tree built.
+    With spans, nodes the parser built also get their start and end offsets"""
+
+    # layouts[level] is layout(indent, level)
+    layouts = []
+    keys = {}
+    parts = []
+    append = parts.append
+    # Entries are literal text or (node, level) pairs
+    stack = [(node, level)]
+
+    while stack:
+        item = stack.pop()
+
+        if item.__class__ is str:
+            append(item)
+            continue
+
+        node, level = item
+        scalars, children = node.fields()
+
+        if spans and getattr(node, "start", None) is not None:
+            scalars["start"] = node.start
+            scalars["end"] = node.end
+
+        while len(layouts) < level + 2:
+            layouts.append(layout(indent, len(layouts)))
+        opening, separator, closing = layouts[level]
+
+        head = "{" + opening
+        between = ""
+        for key, value in scalars.items():
+            name = keys.get(key)
+            if name is None:
+                name = keys[key] = encode_basestring_ascii(key) + ": "
+            head += between + name + encode_scalar(value)
+            between = separator
+
+        if not children:
+            append(head + closing + "}")
+            continue
+
+        append(head)
+        stack.append(closing + "}")
+
+        for key, child in reversed(children):
+            name = keys.get(key)
+            if name is None:
+                name = keys[key] = encode_basestring_ascii(key) + ": "
+            name = separator + name
+
+            if not isinstance(child, list):
+                stack.append((child, level + 1))
+                stack.append(name)
+                continue
+
+            if not child:
+                stack.append(name + "[]")
+                continue
+
+            item_opening, item_separator, item_closing = layouts[level + 1]
+            stack.append(item_closing + "]")
+            for i in range(len(child) - 1, 0, -1):
+                stack.append((child[i], level + 2))
+                stack.append(item_separator)
+            stack.append((child[0], level + 2))
+            stack.append(name + "[" + item_opening)
+
+        if len(parts) >= CHUNK_PARTS:
+            yield "".join(parts)
+            parts.clear()
+
+    if parts:
+        yield "".join(parts)
+
+
+def encode_scalar(value):
+    """Return the JSON text of a node's scalar entry"""
+
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    return json.dumps(value)
+
+
+def to_json(node, indent=None, spans=False):
+    """Return the JSON text of AST node"""
+
+    return "".join(iter_json(node, indent, spans=spans))
+
+
+def write_json(node, output, indent=None, level=0, spans=False):
+    """Writes the JSON text of AST node to a text file as it is produced"""
+
+    for chunk in iter_json(node, indent, level, spans):
+        output.write(chunk)
+
+
+# Binary AST format. After the header come a table of words and the UTF-8
+# bytes of every distinct string. The words hold the string count, each
+# string's byte length, the node count and then one record per node in
+# post-order: the node type's index in BINARY_NODES, the string index of each
+# scalar and the node index of each child, with a list child as its length
+# followed by the indices. The root is the last node. Words are unsigned and
+# as narrow as the largest one allows
+BINARY_MAGIC = b"PTAS"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sBBII")
+WORD_TYPES = {1: "B", 2: "H", 4: "I"}
+
+
+def token_builder(cls, kind):
+    """Return a builder for a node made from one token of kind"""
+
+    return lambda scalars, children: cls(Token(scalars[0], kind))
+
+
+# (type, scalar count, child shapes: "n" for a node and "l" for a list,
+# builder from the scalar strings and the children)
+BINARY_NODES = (
+    ("Program", 0, "l", lambda scalars, children: Program(children[0])),
+    (
+        "Let",
+        1,
+        "n",
+        lambda scalars, children: Let(Token(scalars[0], TokenType.IDENT), children[0]),
+    ),
+    ("Print", 0, "n", lambda scalars, children: Print(children[0])),
+    ("Input", 1, "", token_builder(Input, TokenType.IDENT)),
+    ("Label", 1, "", token_builder(Label, TokenType.IDENT)),
+    ("Goto", 1, "", token_builder(Goto, TokenType.IDENT)),
+    ("If", 0, "nl", lambda scalars, children: If(*children)),
+    ("While", 0, "nl", lambda scalars, children: While(*children)),
+    (
+        "Bin_Op",
+        1,
+        "nn",
+        lambda scalars, children: Bin_Op(
+            children[0], Token(scalars[0], OPERATORS[scalars[0]]), children[1]
+        ),
+    ),
+    ("Num", 1, "", token_builder(Num, TokenType.INTEGER)),
+    ("Float", 1, "", token_builder(Float, TokenType.FLOAT)),
+    ("String", 1, "", token_builder(String, TokenType.STRING)),
+    ("Var", 1, "", token_builder(Var, TokenType.IDENT)),
+)
+
+BINARY_CODES = {name: code for code, (name, *_) in enumerate(BINARY_NODES)}
+
+
+def dumps_binary(node):
+    """Return AST node in the binary format"""
+
+    strings = {}
+    records = []
+    # Indices of finished nodes not yet claimed by their parent
+    finished = []
+    node_count = 0
+    # Entries are (node, None) on the way down and (node, fields) once the
+    # children are pushed
+    stack = [(node, None)]
+
+    while stack:
+        node, fields = stack.pop()
+
+        if fields is None:
+            fields = node.fields()
+            stack.append((node, fields))
+            for _, child in reversed(fields[1]):
+                if isinstance(child, list):
+                    stack.extend((item, None) for item in reversed(child))
+                else:
+                    stack.append((child, None))
+            continue
+
+        scalars, children = fields
+        code = BINARY_CODES.get(scalars["type"])
+        if code is None:
+            raise Exception(f"Error: Cannot serialize {node}")
+
+        records.append(code)
+        for key, value in scalars.items():
+            if key != "type":
+                records.append(strings.setdefault(value, len(strings)))
+
+        count = sum(len(c) if isinstance(c, list) else 1 for _, c in children)
+        start = len(finished) - count
+        taken = finished[start:]
+        del finished[start:]
+
+        position = 0
+        for _, child in children:
+            if isinstance(child, list):
+                records.append(len(child))
+                records.extend(taken[position : position + len(child)])
+                position += len(child)
+            else:
+                records.append(taken[position])
+                position += 1
+
+        finished.append(node_count)
+        node_count += 1
+
+    encoded = [text.encode() for text in strings]
+    words = [len(encoded), *map(len, encoded), node_count, *records]
+
+    largest = max(words)
+    width = 1 if largest < 1 << 8 else 2 if largest < 1 << 16 else 4
+    table = array.array(WORD_TYPES[width], words)
+    if sys.byteorder == "big":
+        table.byteswap()
+
+    blob = b"".join(encoded)
+    header = BINARY_HEADER.pack(
+        BINARY_MAGIC, BINARY_VERSION, width, len(words), len(blob)
+    )
+    return header + table.tobytes() + blob
+
+
+def loads_binary(data):
+    """Return the AST node stored in binary format data"""
+
+    if len(data) < BINARY_HEADER.size:
+        raise Exception("Error: Truncated binary AST")
+
+    magic, version, width, word_count, blob_size = BINARY_HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION or width not in WORD_TYPES:
+        raise Exception("Error: Not a binary AST of version " + str(BINARY_VERSION))
+
+    start = BINARY_HEADER.size
+    end = start + word_count * width
+    if len(data) != end + blob_size:
+        raise Exception("Error: Truncated binary AST")
+
+    table = array.array(WORD_TYPES[width])
+    table.frombytes(data[start:end])
+    if sys.byteorder == "big":
+        table.byteswap()
+    words = table.tolist()
+
+    try:
+        strings = []
+        position = end
+        for length in words[1 : words[0] + 1]:
+            strings.append(data[position : position + length].decode())
+            position += length
+
+        cursor = words[0] + 2
+        nodes = []
+
+        for _ in range(words[words[0] + 1]):
+            _, scalar_count, shapes, build = BINARY_NODES[words[cursor]]
+            scalars = [
+                strings[i] for i in words[cursor + 1 : cursor + 1 + scalar_count]
+            ]
+            cursor += 1 + scalar_count
+
+            children = []
+            for shape in shapes:
+                if shape == "n":
+                    children.append(nodes[words[cursor]])
+                    cursor += 1
+                else:
+                    length = words[cursor]
+                    items = words[cursor + 1 : cursor + 1 + length]
+                    children.append([nodes[i] for i in items])
+                    cursor += 1 + length
+
+            nodes.append(build(scalars, children))
+
+        if cursor != len(words) or not nodes:
+            raise IndexError
+    except (IndexError, KeyError, UnicodeDecodeError):
+        raise Exception("Error: Corrupt binary AST")
+
+    return nodes[-1]
@@ -0,0 +1,217 @@
+"""Editor sessions over WebSockets: each session compiles only its latest
+edit, cancelling and coalescing stale ones, and pushes the AST and the C
+code as soon as each is ready. SessionApp is a plain ASGI application"""
+
+import asyncio
+import concurrent.futures
+import json
+import threading
+
+from .scheduler import CANCELLED, Rejected
+
+
+def encode(message):
+    """Return the JSON text of a message. An AST is already JSON text, so
+    it is spliced in rather than re-encoded"""
+
+    if "ast" not in message:
+        return json.dumps(message)
+
+    fields = {key: value for key, value in message.items() if key != "ast"}
+    return json.dumps(fields)[:-1] + ', "ast": ' + message["ast"] + "}"
+
+
+class Session:
+    """Compiles the edits of one editor on a worker pool, one at a time.
+    An edit arriving while another compiles cancels it, and replaces any
+    edit still waiting, so only the newest runs. Results go to an outbox
+    queue in the order they are produced, as messages:
+
+        {"type": "ast", "id": ..., "ast": ...}
+        {"type": "c", "id": ..., "c_code": ...}
+        {"type": "error", "id": ..., "error": ..., "reason": ...}
+
+    compile(source, cancelled, on_ast) runs in the pool and returns
+    (c_code, ast_json), raising Rejected with reason CANCELLED once
+    cancelled is set. It may pass the AST JSON to on_ast before code
+    generation; if it does not, the AST is sent with the C code"""
+
+    def __init__(self, compile, executor, outbox):
+        self.compile = compile
+        self.executor = executor
+        self.outbox = outbox
+        # (id, source) of the edit waiting for the running one to stop
+        self.pending = None
+        # Cancel event of the running compile, and the task running edits
+        self.cancelled = None
+        self.task = None
+        self.counts = {"compiled": 0, "cancelled": 0, "coalesced": 0}
+
+    def submit(self, request_id, source):
+        """Queues an edit, cancelling the running compile and dropping any
+        edit still waiting"""
+
+        if self.pending is not None:
+            self.counts["coalesced"] += 1
+        self.pending = (request_id, source)
+
+        if self.cancelled is not None:
+            self.cancelled.set()
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        """Compiles waiting edits until none is left"""
+
+        loop = asyncio.get_running_loop()
+
+        try:
+            while self.pending is not None:
+                request_id, source = self.pending
+                self.pending = None
+                self.cancelled = cancelled = threading.Event()
+                pushed = []
+
+                def on_ast(
+                    ast_json, request_id=request_id, cancelled=cancelled, pushed=pushed
+                ):
+                    # Called in the worker, so hand the message to the loop
+                    pushed.append(True)
+                    if not cancelled.is_set():
+                        message = {"type": "ast", "id": request_id, "ast": ast_json}
+                        loop.call_soon_threadsafe(self.outbox.put_nowait, message)
+
+                try:
+                    c_code, ast_json = await loop.run_in_executor(
+                        self.executor, self.compile, source, cancelled, on_ast
+                    )
+                except Rejected as e:
+                    if e.reason == CANCELLED:
+                        self.counts["cancelled"] += 1
+                        continue
+                    self.error(request_id, e, e.reason)
+                    continue
+                except Exception as e:
+                    self.error(request_id, e, None)
+                    continue
+
+                self.counts["compiled"] += 1
+                if self.pending is None:
+                    if not pushed:
+                        self.outbox.put_nowait(
+                            {"type": "ast", "id": request_id, "ast": ast_json}
+                        )
+                    self.outbox.put_nowait(
+                        {"type": "c", "id": request_id, "c_code": c_code}
+                    )
+        finally:
+            self.cancelled = None
+            self.task = None
+
+    def error(self, request_id, error, reason):
+        """Sends the error of an edit, unless a newer one is waiting"""
+
+        if self.pending is None:
+            self.outbox.put_nowait(
+                {
+                    "type": "error",
+                    "id": request_id,
+                    "error": str(error),
+                    "reason": reason,
+                }
+            )
+
+    def close(self):
+        """Drops the waiting edit and cancels the running one"""
+
+        self.pending = None
+        if self.cancelled is not None:
+            self.cancelled.set()
+
+
+class SessionApp:
+    """ASGI application giving every WebSocket connection to /session its
+    own Session. Clients send {"id": ..., "code": ...} for each edit.
+    compile is as for Session, and runs on a pool of worker threads"""
+
+    def __init__(self, compile, workers=None, path="/session"):
+        self.compile = compile
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "websocket" and scope["path"] == self.path:
+            await self.session(receive, send)
+        elif scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1008})
+        else:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 404,
+                    "headers": [(b"content-type", b"application/json")],
+                }
+            )
+            await send(
+                {"type": "http.response.body", "body": b'{"error": "Not found"}'}
+            )
+
+    async def lifespan(self, receive, send):
+        """Answers the server's startup and shutdown events"""
+
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def session(self, receive, send):
+        """Runs one editor session until the client disconnects"""
+
+        message = await receive()
+        if message["type"] != "websocket.connect":
+            return
+        await send({"type": "websocket.accept"})
+
+        outbox = asyncio.Queue()
+        session = Session(self.compile, self.executor, outbox)
+        writer = asyncio.get_running_loop().create_task(self.write(outbox, send))
+
+        try:
+            while True:
+                message = await receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message["type"] != "websocket.receive":
+                    continue
+
+                try:
+                    data = json.loads(message.get("text") or message.get("bytes"))
+                    request_id = data.get("id")
+                    source = data["code"]
+                except Exception:
+                    outbox.put_nowait({"type": "error", "error": "Invalid message"})
+                    continue
+
+                if not isinstance(source, str) or not source:
+                    outbox.put_nowait(
+                        {"type": "error", "id": request_id, "error": "No code provided"}
+                    )
+                    continue
+
+                session.submit(request_id, source)
+        finally:
+            session.close()
+            writer.cancel()
+
+    async def write(self, outbox, send):
+        """Sends queued messages to the client in order"""
+
+        while True:
+            message = await outbox.get()
+            await send({"type": "websocket.send", "text": encode(message)})
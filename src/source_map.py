@@ -0,0 +1,99 @@
+"""Source positions: an index of line starts turning offsets into lines and
+columns, and the map from lines of generated C back to source lines"""
+
+import array
+import bisect
+import json
+import re
+
+NEWLINE = re.compile(r"\n")
+NEWLINE_BYTES = re.compile(rb"\n")
+
+
+class LineTable:
+    """Offsets at which each line of a source starts, indexed once so the
+    line and column of any offset is a binary search. A source given in
+    pieces, as the stream lexer reads it, is indexed with extend"""
+
+    def __init__(self, source=None):
+        self.starts = array.array("q", [0])
+        self.size = 0
+
+        if source is not None:
+            self.extend(source)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def extend(self, text):
+        """Indexes text, a str, bytes or memory map, as the continuation of
+        the source indexed so far"""
+
+        pattern = NEWLINE if isinstance(text, str) else NEWLINE_BYTES
+        base = self.size
+        self.starts.extend(base + match.end() for match in pattern.finditer(text))
+        self.size += len(text)
+
+    def line(self, offset):
+        """Return the 1-based line holding offset"""
+
+        return bisect.bisect_right(self.starts, offset)
+
+    def location(self, offset):
+        """Return the 1-based (line, column) of offset"""
+
+        line = bisect.bisect_right(self.starts, offset)
+        return line, offset - self.starts[line - 1] + 1
+
+
+def describe(location):
+    """Return the text appended to an error message at location, a (line,
+    column) pair or None"""
+
+    if location is None:
+        return ""
+    return " (line {}, column {})".format(*location)
+
+
+class SourceMap:
+    """Maps lines of generated C to the source lines they came from. Entries
+    are the first C line of each run of lines from one source line, so a
+    lookup is a binary search; source line 0 marks C with no source line,
+    like the prologue and epilogue"""
+
+    def __init__(self):
+        self.c_lines = array.array("q")
+        self.source_lines = array.array("q")
+
+    def __len__(self):
+        return len(self.c_lines)
+
+    def add(self, c_line, source_line):
+        """Maps C lines from c_line on to source_line"""
+
+        if self.c_lines and self.c_lines[-1] == c_line:
+            self.source_lines[-1] = source_line
+        elif not self.source_lines or self.source_lines[-1] != source_line:
+            self.c_lines.append(c_line)
+            self.source_lines.append(source_line)
+
+    def source_line(self, c_line):
+        """Return the source line C line c_line came from, or None"""
+
+        index = bisect.bisect_right(self.c_lines, c_line) - 1
+        if index < 0 or not self.source_lines[index]:
+            return None
+        return self.source_lines[index]
+
+    def to_dict(self):
+        """Return the map as lists of C lines and their source lines"""
+
+        return {
+            "c_lines": self.c_lines.tolist(),
+            "source_lines": self.source_lines.tolist(),
+        }
+
+    def to_json(self):
+        """Return the map as JSON text"""
+
+        return json.dumps(self.to_dict())
@@ -2,10 +2,15 @@
 
 from .token_type import TokenType
 
+# Keyword text -> kind, built once so lookups are a single dict probe
+KEYWORDS = {kind.name: kind for kind in TokenType if 100 <= kind.value < 200}
+
 
 class Token:
     """Token contains the original text and the type of token"""
 
+    __slots__ = ("text", "kind")
+
     def __init__(self, token_text, token_kind):
         self.text = token_text
         self.kind = token_kind
@@ -14,8 +19,4 @@ class Token:
     def check_if_keyword(token_text):
         """Checks if text contains token"""
 
-        for kind in TokenType:
-            if kind.name == token_text and kind.value >= 100 and kind.value < 200:
-                return kind
-
-        return None
+        return KEYWORDS.get(token_text)
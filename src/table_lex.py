@@ -0,0 +1,215 @@
+"""Table driven lexer built on a single compiled master pattern"""
+
+import re
+
+from .source_map import LineTable, describe
+from .string_token import KEYWORDS, Token
+from .token_type import TokenType
+
+# Leading whitespace and an optional comment are folded into every match, so
+# one regex call skips trivia and classifies the token that follows it.
+MASTER_PATTERN = re.compile(
+    r"[ \t\r]*(?:#[^\n]*)?"
+    r"(?:(?P<ident>[^\W\d_][^\W_]*)"
+    r"|(?P<number>\d+(?:\.\d*)?)"
+    r'|"(?P<string>[^"\r\n\t\\%]*)"'
+    r"|(?P<op>[=<>!]=|[-+*/=<>\n\0]))"
+)
+
+TRIVIA_PATTERN = re.compile(r"[ \t\r]*(?:#[^\n]*)?")
+
+OPERATORS = {
+    "+": TokenType.PLUS,
+    "-": TokenType.MINUS,
+    "*": TokenType.ASTERISK,
+    "/": TokenType.SLASH,
+    "=": TokenType.EQ,
+    "==": TokenType.EQEQ,
+    "!=": TokenType.NOTEQ,
+    "<": TokenType.LT,
+    "<=": TokenType.LTEQ,
+    ">": TokenType.GT,
+    ">=": TokenType.GTEQ,
+    "\n": TokenType.NEWLINE,
+    "\0": TokenType.EOF,
+}
+
+IDENT = TokenType.IDENT
+STRING = TokenType.STRING
+INTEGER = TokenType.INTEGER
+FLOAT = TokenType.FLOAT
+
+# Tokens are never modified, so each lexer hands out one Token per distinct
+# operator, keyword, identifier or number text, starting from these
+FIXED_TOKENS = {text: Token(text, kind) for text, kind in OPERATORS.items()}
+FIXED_TOKENS.update((text, Token(text, kind)) for text, kind in KEYWORDS.items())
+
+
+class TableLexer:
+    """Lexer that classifies each token with one regex match and dict lookups
+    instead of walking the source a character at a time"""
+
+    def __init__(self, source):
+        self.lines = None
+        # Text -> Token of every token but strings seen so far
+        self.tokens = dict(FIXED_TOKENS)
+        self.reset(source + "\n")
+
+    def reset(self, source):
+        """Starts scanning source from its first character"""
+
+        self.source = source
+        self.last_match = None
+        self.next_match = MASTER_PATTERN.scanner(source).match
+        # Offset of the last token returned
+        self.token_start = 0
+
+    @property
+    def pos(self):
+        """Offset just past the last token returned"""
+
+        if self.last_match is None:
+            return 0
+        return self.last_match.end()
+
+    def location(self, offset):
+        """Return the (line, column) of a source offset"""
+
+        if self.lines is None:
+            self.lines = LineTable(self.source)
+        return self.lines.location(offset)
+
+    def abort(self, message):
+        """Invalid token found, print error message and exit."""
+
+        raise Exception("Error: " + message + describe(self.location(self.token_start)))
+
+    def get_token(self):
+        """Return the next token"""
+
+        match = self.next_match()
+
+        if match is None:
+            return self.unmatched()
+
+        self.last_match = match
+        group = match.lastgroup
+        text = match[group]
+
+        if group == "string":
+            # The token starts at its opening quote
+            self.token_start = match.start(group) - 1
+            return Token(text, STRING)
+
+        self.token_start = match.start(group)
+
+        token = self.tokens.get(text)
+        if token is not None:
+            return token
+
+        if group == "ident":
+            token = Token(text, IDENT)
+        elif "." not in text:
+            token = Token(text, INTEGER)
+        elif text[-1] == ".":
+            self.abort("Illegal character in integer")
+        else:
+            token = Token(text, FLOAT)
+
+        self.tokens[text] = token
+        return token
+
+    def unmatched(self):
+        """Returns EOF past the end of the source, otherwise reports the same
+        error the character lexer would for the offending character"""
+
+        pos = TRIVIA_PATTERN.match(self.source, self.pos).end()
+        self.token_start = pos
+
+        if pos >= len(self.source):
+            # At the end of the source, before the appended newline
+            self.token_start = len(self.source) - 1
+            return Token("\0", TokenType.EOF)
+
+        char = self.source[pos]
+
+        if char == "!":
+            self.abort("Expected !=, got !" + self.source[pos + 1 : pos + 2])
+
+        if char == '"':
+            self.abort("Illegal character in string")
+
+        self.abort("Unknown token: " + char)
+
+
+# Characters read from the source file per refill
+CHUNK_SIZE = 1 << 16
+
+
+class StreamLexer(TableLexer):
+    """TableLexer over a file object. No token spans a newline, so the file is
+    read in chunks and scanned one window of whole lines at a time"""
+
+    def __init__(self, source_file, chunk_size=CHUNK_SIZE):
+        self.source_file = source_file
+        self.chunk_size = chunk_size
+        self.carry = ""
+        self.exhausted = False
+        # Line starts of every window so far, 8 bytes a line, and where the
+        # current window starts in the file
+        self.lines = LineTable()
+        self.base = 0
+        self.tokens = dict(FIXED_TOKENS)
+        self.reset("")
+
+    @property
+    def token_start(self):
+        """Offset of the last token returned, in the whole file"""
+
+        return self.start
+
+    @token_start.setter
+    def token_start(self, offset):
+        # TableLexer sets offsets into the window
+        self.start = self.base + offset
+
+    def refill(self):
+        """Moves the next window of complete lines into the scanner. The final
+        window gets the same trailing newline TableLexer appends to a string"""
+
+        if self.exhausted:
+            return False
+
+        parts = [self.carry]
+
+        while True:
+            chunk = self.source_file.read(self.chunk_size)
+
+            if not chunk:
+                self.exhausted = True
+                self.carry = ""
+                parts.append("\n")
+                break
+
+            cut = chunk.rfind("\n") + 1
+
+            if cut:
+                parts.append(chunk[:cut])
+                self.carry = chunk[cut:]
+                break
+
+            parts.append(chunk)
+
+        window = "".join(parts)
+        self.lines.extend(window)
+        self.base += len(self.source)
+        self.reset(window)
+        return True
+
+    def unmatched(self):
+        """Refills at the end of a window, otherwise defers to TableLexer"""
+
+        if self.pos < len(self.source) or not self.refill():
+            return super().unmatched()
+
+        return self.get_token()
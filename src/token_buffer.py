@@ -0,0 +1,240 @@
+"""Token buffer lexing a whole source, or a memory-mapped file, into parallel
+arrays of token kinds and offsets"""
+
+import array
+import mmap
+import re
+import sys
+
+from .source_map import LineTable, describe
+from .string_token import KEYWORDS, Token
+from .table_lex import MASTER_PATTERN, OPERATORS, TRIVIA_PATTERN
+from .token_type import TokenType
+
+# The table lexer's pattern with comments that must run to the end of their
+# line: without the newline TableLexer appends, a comment ending the source
+# must not backtrack into tokens. The lookahead does what a possessive
+# [^\n]*+ would, which needs Python 3.11
+BUFFER_PATTERN = re.compile(
+    MASTER_PATTERN.pattern.replace(r"#[^\n]*", r"#[^\n]*(?![^\n])")
+)
+
+# The same patterns over bytes, where identifiers are ASCII only; sources with
+# other bytes are decoded and scanned with the text patterns
+MASTER_BYTES = re.compile(BUFFER_PATTERN.pattern.encode())
+TRIVIA_BYTES = re.compile(TRIVIA_PATTERN.pattern.encode())
+NON_ASCII = re.compile(rb"[\x80-\xff]")
+
+# Kind codes stored in the kinds array are TokenType values; ERROR marks a
+# token the table lexer would have stopped at
+KINDS = {kind.value: kind for kind in TokenType}
+ERROR = -100
+
+KEYWORD_CODES = {text: kind.value for text, kind in KEYWORDS.items()}
+KEYWORD_CODES.update({text.encode(): code for text, code in KEYWORD_CODES.items()})
+OPERATOR_CODES = {text: kind.value for text, kind in OPERATORS.items()}
+OPERATOR_CODES.update({text.encode(): code for text, code in OPERATOR_CODES.items()})
+
+# Keywords and operators always have the same text, so one token serves all
+SHARED_TOKENS = {kind.value: Token(text, kind) for text, kind in KEYWORDS.items()}
+SHARED_TOKENS.update(
+    {kind.value: Token(text, kind) for text, kind in OPERATORS.items()}
+)
+
+IDENT = TokenType.IDENT.value
+INTEGER = TokenType.INTEGER.value
+FLOAT = TokenType.FLOAT.value
+STRING = TokenType.STRING.value
+NEWLINE = TokenType.NEWLINE.value
+EOF = TokenType.EOF.value
+
+
+class TokenBuffer:
+    """Tokens of a source held as three parallel arrays: kind codes and the
+    start and end offsets of each token's text. Text is only sliced out when
+    a token is asked for, and identifiers are interned, so a token costs a
+    few bytes until the parser reaches it. The source may be a str, bytes or
+    a memory map; it yields the same tokens as TableLexer, which lexes it
+    with a newline appended"""
+
+    def __init__(self, source):
+        if not isinstance(source, str) and NON_ASCII.search(source):
+            source = bytes(source).decode("utf-8")
+
+        self.source = source
+        self.binary = not isinstance(source, str)
+        self.kinds = array.array("h")
+        self.starts = array.array("q")
+        self.ends = array.array("q")
+        self.error = None
+        self.lines = None
+        self.cache = {IDENT: {}, INTEGER: {}, FLOAT: {}, STRING: {}}
+
+        self.lex()
+
+    @classmethod
+    def from_path(cls, path):
+        """Return the buffer for a file, mapped into memory rather than read"""
+
+        with open(path, "rb") as source_file:
+            if not source_file.seek(0, 2):
+                return cls(b"")
+            return cls(mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def lex(self):
+        """Scans the whole source into the arrays"""
+
+        source = self.source
+        binary = self.binary
+        next_match = (MASTER_BYTES if binary else BUFFER_PATTERN).scanner(source).match
+        add_kind = self.kinds.append
+        add_start = self.starts.append
+        add_end = self.ends.append
+        dot = b"." if binary else "."
+        end = 0
+
+        while True:
+            match = next_match()
+            if match is None:
+                break
+
+            group = match.lastgroup
+            start, end = match.span(group)
+
+            if group == "ident":
+                code = KEYWORD_CODES.get(match[group], IDENT)
+            elif group == "op":
+                code = OPERATOR_CODES[match[group]]
+            elif group == "string":
+                # Offsets take in the quotes, as other lexers report them
+                code = STRING
+                start -= 1
+                end += 1
+            elif dot not in match[group]:
+                code = INTEGER
+            elif source[end - 1 : end] == dot:
+                return self.fail(start, "Illegal character in integer")
+            else:
+                code = FLOAT
+
+            add_kind(code)
+            add_start(start)
+            add_end(end)
+            end = match.end()
+
+        position = (TRIVIA_BYTES if binary else TRIVIA_PATTERN).match(source, end).end()
+        if position < len(source):
+            return self.fail(position, self.unmatched(position))
+
+        # The newline TableLexer appends, then EOF, at the offsets TableLexer
+        # gives them
+        length = len(source)
+        self.kinds.extend((NEWLINE, EOF))
+        self.starts.extend((length, length))
+        self.ends.extend((length + 1, length))
+
+    def unmatched(self, position):
+        """Return the error the table lexer reports for the character at
+        position"""
+
+        char = self.slice(position, position + 1)
+
+        if char == "!":
+            return "Expected !=, got !" + (
+                self.slice(position + 1, position + 2) or "\n"
+            )
+
+        if char == '"':
+            return "Illegal character in string"
+
+        return "Unknown token: " + char
+
+    def fail(self, position, message):
+        """Ends the tokens with an error token at position"""
+
+        self.kinds.append(ERROR)
+        self.starts.append(position)
+        self.ends.append(position)
+        self.error = message + describe(self.location(position))
+
+    def location(self, offset):
+        """Return the (line, column) of a source offset. The line index is
+        built the first time, over the source and the newline TableLexer
+        appends"""
+
+        if self.lines is None:
+            self.lines = LineTable(self.source)
+            self.lines.extend("\n")
+        return self.lines.location(offset)
+
+    def slice(self, start, end):
+        """Return the source text between two offsets"""
+
+        text = self.source[start:end]
+        return text.decode("ascii") if self.binary else text
+
+    def text(self, index):
+        """Return the text of token index"""
+
+        if self.kinds[index] == STRING:
+            return self.slice(self.starts[index] + 1, self.ends[index] - 1)
+        return self.slice(self.starts[index], self.ends[index])
+
+    def token(self, index):
+        """Return token index as a Token. Tokens with equal text are shared"""
+
+        code = self.kinds[index]
+
+        token = SHARED_TOKENS.get(code)
+        if token is not None:
+            return token
+
+        if code == ERROR:
+            raise Exception("Error: " + self.error)
+
+        # Keyed by the raw slice, so repeated text is not decoded again
+        raw = self.source[self.starts[index] : self.ends[index]]
+        cache = self.cache[code]
+        token = cache.get(raw)
+
+        if token is None:
+            text = raw.decode("ascii") if self.binary else raw
+            if code == STRING:
+                text = text[1:-1]
+            elif code == IDENT:
+                text = sys.intern(text)
+            token = cache[raw] = Token(text, KINDS[code])
+
+        return token
+
+
+class BufferLexer:
+    """Lexer interface over a TokenBuffer, with lookahead to any distance.
+    Built from a source string it lexes the string into a buffer first"""
+
+    def __init__(self, source):
+        self.buffer = source if isinstance(source, TokenBuffer) else TokenBuffer(source)
+        self.token = self.buffer.token
+        self.location = self.buffer.location
+        self.last = len(self.buffer) - 1
+        self.index = 0
+        # Offset of the last token returned
+        self.token_start = 0
+
+    def get_token(self):
+        """Return the next token. EOF repeats past the end"""
+
+        index = self.index
+        if index < self.last:
+            self.index = index + 1
+        self.token_start = self.buffer.starts[index]
+        return self.token(index)
+
+    def lookahead(self, distance=0):
+        """Return the token distance places after the next one, without
+        consuming anything"""
+
+        return self.token(min(self.index + distance, self.last))
@@ -6,6 +6,10 @@ import enum
 class TokenType(enum.Enum):
     """Our enum for all types of tokens."""
 
+    # Members are singletons compared by identity, so they hash by identity
+    # too. Enum's own __hash__ is a Python call on every dict or set lookup
+    __hash__ = object.__hash__
+
     EOF = -1
     NEWLINE = 0
     INTEGER = 1
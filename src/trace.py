@@ -0,0 +1,148 @@
+"""Pluggable tracing and profiling hooks for Parser productions"""
+
+import json
+import sys
+import time
+
+# Parser methods wrapped when a tracer is attached
+PRODUCTIONS = (
+    "program",
+    "statement",
+    "simple_statement",
+    "comparison",
+    "expression",
+    "unary",
+    "primary",
+    "nl",
+)
+
+
+class ParserTracer:
+    """Base tracer. Parser only wraps its productions when a tracer is
+    attached, so an untraced Parser runs the plain methods at no cost"""
+
+    def enter(self, production, token):
+        """Called before production runs with the current token"""
+
+    def exit(self, production):
+        """Called after production returns or raises"""
+
+    def consume(self):
+        """Called every time the parser advances a token"""
+
+
+class PrintTracer(ParserTracer):
+    """Writes each production and its current token, for debugging"""
+
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+
+    def enter(self, production, token):
+        text = "" if token is None else token.text
+        self.stream.write(production.upper() + " (" + repr(text) + ")\n")
+
+
+class ProfileTracer(ParserTracer):
+    """Records call counts, cumulative and self time, and tokens consumed for
+    every production. Time and tokens of a recursive production are only
+    counted at its outermost activation"""
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.stats = {}
+        self.frames = []
+        self.active = {}
+        self.tokens = 0
+
+    def enter(self, production, token):
+        self.active[production] = self.active.get(production, 0) + 1
+        self.frames.append([production, self.clock(), self.tokens, 0.0])
+
+    def exit(self, production):
+        _, start, tokens, child_time = self.frames.pop()
+        elapsed = self.clock() - start
+
+        if self.frames:
+            self.frames[-1][3] += elapsed
+
+        stats = self.stats.get(production)
+        if stats is None:
+            stats = self.stats[production] = [0, 0.0, 0.0, 0]
+
+        stats[0] += 1
+        stats[2] += elapsed - child_time
+
+        self.active[production] -= 1
+        if self.active[production] == 0:
+            stats[1] += elapsed
+            stats[3] += self.tokens - tokens
+
+    def consume(self):
+        self.tokens += 1
+
+    def merge(self, other):
+        """Adds the statistics recorded by other into this tracer"""
+
+        for production, (calls, cumulative, own, tokens) in other.stats.items():
+            stats = self.stats.setdefault(production, [0, 0.0, 0.0, 0])
+            stats[0] += calls
+            stats[1] += cumulative
+            stats[2] += own
+            stats[3] += tokens
+
+        self.tokens += other.tokens
+
+    def to_dict(self):
+        """Return a dictionary format of the recorded statistics"""
+
+        return {
+            "tokens": self.tokens,
+            "productions": {
+                production: {
+                    "calls": calls,
+                    "cumulative_time": cumulative,
+                    "self_time": own,
+                    "tokens": tokens,
+                }
+                for production, (calls, cumulative, own, tokens) in self.stats.items()
+            },
+        }
+
+    def to_json(self, **kwargs):
+        """Return the recorded statistics as a JSON string"""
+
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+def instrument(parser, tracer):
+    """Shadows parser's productions and next_token with traced wrappers on the
+    instance, leaving the Parser class itself untouched"""
+
+    for production in PRODUCTIONS:
+        setattr(parser, production, traced(parser, production, tracer))
+
+    next_token = parser.next_token
+    consume = tracer.consume
+
+    def traced_next_token():
+        consume()
+        next_token()
+
+    parser.next_token = traced_next_token
+
+
+def traced(parser, production, tracer):
+    """Wraps one bound production with tracer enter/exit calls"""
+
+    method = getattr(parser, production)
+    enter = tracer.enter
+    leave = tracer.exit
+
+    def wrapper(*args):
+        enter(production, parser.curr_token)
+        try:
+            return method(*args)
+        finally:
+            leave(production)
+
+    return wrapper
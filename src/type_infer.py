@@ -0,0 +1,205 @@
+"""Numeric type inference choosing one C type per variable, so integer
+arithmetic stays in integers"""
+
+import collections
+
+from .ast import Bin_Op, Float, If, Input, Let, Num, String, Var, While
+from .token_type import TokenType
+
+INT = "int"
+LONG_LONG = "long long"
+DOUBLE = "double"
+STRING = "char *"
+
+# Numeric types from narrowest to widest
+NUMERIC = (INT, LONG_LONG, DOUBLE)
+
+PRINT_FORMATS = {INT: "%d", LONG_LONG: "%lld", DOUBLE: "%.2f", STRING: "%s"}
+SCAN_FORMATS = {INT: "%d", LONG_LONG: "%lld", DOUBLE: "%lf"}
+ZEROS = {INT: "0", LONG_LONG: "0", DOUBLE: "0", STRING: '""'}
+
+COMPARISONS = {
+    TokenType.EQEQ,
+    TokenType.NOTEQ,
+    TokenType.LT,
+    TokenType.LTEQ,
+    TokenType.GT,
+    TokenType.GTEQ,
+}
+
+INT_MAX = (1 << 31) - 1
+LONG_LONG_MAX = (1 << 63) - 1
+
+
+def join(first, second):
+    """Return the narrowest type holding values of both types. None means no
+    type is known yet"""
+
+    if first is None or first == second:
+        return second
+
+    if second is None:
+        return first
+
+    if STRING in (first, second):
+        raise Exception("Error: Cannot mix strings and numbers")
+
+    return max(first, second, key=NUMERIC.index)
+
+
+def literal_type(text):
+    """Return the type of an integer literal as C reads it"""
+
+    value = int(text, 8) if len(text) > 1 and text[0] == "0" else int(text)
+
+    if value <= INT_MAX:
+        return INT
+    if value <= LONG_LONG_MAX:
+        return LONG_LONG
+    return DOUBLE
+
+
+def expression_type(node, types):
+    """Return the C type of expression node given the variable types, or None
+    while a variable it reads has no type yet. Comparisons are int"""
+
+    results = []
+    stack = [(node, False)]
+
+    while stack:
+        item, done = stack.pop()
+
+        if isinstance(item, Bin_Op):
+            if not done:
+                stack += ((item, True), (item.right, False), (item.left, False))
+                continue
+
+            right = results.pop()
+            left = results.pop()
+
+            if item.op.kind in COMPARISONS:
+                join(left, right)
+                results.append(INT)
+            else:
+                results.append(join(left, right))
+
+        elif isinstance(item, Num):
+            results.append(literal_type(item.value.lstrip("-")))
+        elif isinstance(item, Float):
+            results.append(DOUBLE)
+        elif isinstance(item, String):
+            results.append(STRING)
+        elif isinstance(item, Var):
+            results.append(types.get(item.value))
+        else:
+            raise Exception(f"Cannot determine type for {item}")
+
+    return results[0]
+
+
+def assignments(statements):
+    """Yields (name, expression) for every value stored into a variable, in
+    program order: LET, and the x = e conditions that assign in C. INPUT is
+    yielded with expression None"""
+
+    stack = list(reversed(statements))
+
+    while stack:
+        node = stack.pop()
+
+        if isinstance(node, Let):
+            yield node.name_token.text, node.expression
+
+        elif isinstance(node, Input):
+            yield node.input_token.text, None
+
+        elif isinstance(node, (If, While)):
+            condition = node.condition
+            if (
+                isinstance(condition, Bin_Op)
+                and condition.op.kind == TokenType.EQ
+                and isinstance(condition.left, Var)
+            ):
+                yield condition.left.value, condition.right
+            stack.extend(reversed(node.body))
+
+
+class TypeInference:
+    """Unifies the types of every value assigned to each variable, across all
+    LET, INPUT and block statements. A C variable has a single type, so a
+    variable's type is the join over every path, widened until nothing
+    changes"""
+
+    def __init__(self):
+        self.types = {}
+
+    def program(self, node):
+        """Return {variable: C type} for node, in order of first assignment"""
+
+        stores = []
+        readers = collections.defaultdict(list)
+        inputs = set()
+
+        for name, expression in assignments(node.statements):
+            if expression is None:
+                # Like the legacy generator, a variable first given by INPUT
+                # holds any number; INPUT into an int variable reads an int
+                self.types.setdefault(name, DOUBLE)
+                inputs.add(name)
+                continue
+
+            self.types.setdefault(name, None)
+
+            index = len(stores)
+            stores.append((name, expression))
+            for read in variables_read(expression):
+                readers[read].append(index)
+
+        # Types only widen, so each store is revisited a bounded number of times
+        pending = collections.deque(range(len(stores)))
+        queued = set(pending)
+
+        while pending:
+            index = pending.popleft()
+            queued.discard(index)
+            name, expression = stores[index]
+
+            widened = join(self.types[name], expression_type(expression, self.types))
+            if widened == self.types[name]:
+                continue
+
+            self.types[name] = widened
+            for reader in readers[name]:
+                if reader not in queued:
+                    queued.add(reader)
+                    pending.append(reader)
+
+        for name, c_type in self.types.items():
+            if c_type is None:
+                self.types[name] = DOUBLE
+            elif c_type == STRING and name in inputs:
+                raise Exception("Error: Cannot INPUT string variable " + name)
+
+        return self.types
+
+
+def variables_read(expression):
+    """Return the names of the variables expression reads"""
+
+    names = set()
+    stack = [expression]
+
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Bin_Op):
+            stack += (node.left, node.right)
+        elif isinstance(node, Var):
+            names.add(node.value)
+
+    return names
+
+
+def infer_types(program):
+    """Return {variable: C type} for program"""
+
+    return TypeInference().program(program)
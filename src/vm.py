@@ -0,0 +1,377 @@
+"""Stack VM running bytecode from src/bytecode.py in-process, with the
+arithmetic, conversions and printf formatting of the generated C on x86"""
+
+import io
+import math
+import re
+import struct
+import sys
+import time
+
+from .bytecode import (
+    ADD_F32,
+    ADD_F64,
+    ADD_I32,
+    ADD_I64,
+    CONST,
+    DIV_F32,
+    DIV_F64,
+    DIV_I32,
+    DIV_I64,
+    DUP,
+    EQ,
+    F32,
+    F64,
+    GE,
+    GT,
+    HALT,
+    I32,
+    I64,
+    INPUT,
+    JUMP,
+    JUMP_IF_FALSE,
+    LE,
+    LOAD,
+    LT,
+    MUL_F32,
+    MUL_F64,
+    MUL_I32,
+    MUL_I64,
+    NE,
+    PRINT_FLOAT,
+    PRINT_INT,
+    PRINT_STR,
+    STORE,
+    SUB_F32,
+    SUB_F64,
+    SUB_I32,
+    SUB_I64,
+    TO_F32,
+    TO_F64,
+    TO_I32,
+    TO_I64,
+)
+
+# How a run ended
+HALTED = "halted"
+TIMED_OUT = "timed_out"
+TRUNCATED = "truncated"
+
+INT_MIN = -(1 << 31)
+INT_MAX = (1 << 31) - 1
+LLONG_MIN = -(1 << 63)
+LLONG_MAX = (1 << 63) - 1
+
+# Backward jumps between deadline checks
+CHECK_INTERVAL = 4096
+
+FLOAT32 = struct.Struct("f")
+
+SCAN_PATTERNS = {
+    I32: re.compile(r"[+-]?\d+"),
+    I64: re.compile(r"[+-]?\d+"),
+    F32: re.compile(
+        r"[+-]?(?:(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?|inf(?:inity)?|nan)", re.I
+    ),
+}
+SCAN_PATTERNS[F64] = SCAN_PATTERNS[F32]
+
+WHITESPACE = re.compile(r"\s*")
+
+
+class Trap(Exception):
+    """An integer division by zero or overflow, which kills a native program
+    with SIGFPE"""
+
+
+def single(value):
+    """Return value rounded to single precision, overflowing to infinity"""
+
+    try:
+        return FLOAT32.unpack(FLOAT32.pack(value))[0]
+    except OverflowError:
+        return math.copysign(math.inf, value)
+
+
+def wrap(value, bits):
+    """Return integer value wrapped to a two's complement width"""
+
+    half = 1 << (bits - 1)
+    return ((value + half) & ((half << 1) - 1)) - half
+
+
+def truncate(value, bits):
+    """Return value converted to an integer like cvttsd2si: toward zero, with
+    NaN and out of range values giving the minimum integer"""
+
+    low = -(1 << (bits - 1))
+    if value != value or not low <= value < -low:
+        return low
+    return int(value)
+
+
+def to_int(value, bits):
+    """Return a number converted to a C integer of a width"""
+
+    if isinstance(value, float):
+        return truncate(value, bits)
+    return wrap(value, bits)
+
+
+def divide(left, right):
+    """Return the IEEE quotient of two doubles, including division by zero"""
+
+    if right:
+        return left / right
+    if left != left or not left:
+        # x86 produces the default NaN, which has the sign bit set
+        return -math.nan
+    return math.copysign(math.inf, left) * math.copysign(1.0, right)
+
+
+def format_float(value):
+    """Return value formatted like printf %.2f"""
+
+    if value != value:
+        return "-nan" if math.copysign(1.0, value) < 0 else "nan"
+    return f"{value:.2f}"
+
+
+class ScanfReader:
+    """Reads numbers from a text stream the way scanf does: leading
+    whitespace is skipped, the longest number prefix is consumed, and on a
+    mismatch nothing more is consumed and the variable keeps its value"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = ""
+        self.position = 0
+        self.eof = stream is None
+
+    def fill(self):
+        """Reads another line, returning False at end of input"""
+
+        line = "" if self.eof else self.stream.readline()
+        if not line:
+            self.eof = True
+            return False
+
+        self.buffer = self.buffer[self.position :] + line
+        self.position = 0
+        return True
+
+    def read(self, kind):
+        """Return the next number of kind, or None if there is none"""
+
+        pattern = SCAN_PATTERNS[kind]
+
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position == len(self.buffer):
+                if not self.fill():
+                    return None
+                continue
+
+            match = pattern.match(self.buffer, self.position)
+            # A number running to the end of the buffer may continue
+            if match and match.end() == len(self.buffer) and self.fill():
+                continue
+            if match is None:
+                return None
+
+            self.position = match.end()
+            text = match.group()
+            break
+
+        if kind == I32:
+            return wrap(max(LLONG_MIN, min(LLONG_MAX, int(text))), 32)
+        if kind == I64:
+            return max(LLONG_MIN, min(LLONG_MAX, int(text)))
+        if kind == F32:
+            return single(float(text))
+        return float(text)
+
+
+class VM:
+    """Executes Code. PRINT writes to stdout and INPUT reads from stdin, both
+    text streams defaulting to the process's own. Output beyond max_output
+    characters is cut off"""
+
+    def __init__(self, stdout=None, stdin=None, max_output=None):
+        self.stdout = stdout or sys.stdout
+        self.reader = ScanfReader(sys.stdin if stdin is None else stdin)
+        self.max_output = math.inf if max_output is None else max_output
+
+    def abort(self, message):
+        """Handle errors"""
+
+        raise Exception("Error: " + message)
+
+    def trap(self):
+        """Integer division trapped, as it does on x86"""
+
+        raise Trap("Error: Integer division by zero or overflow")
+
+    def run(self, code, timeout=None):
+        """Runs code until it halts, returning HALTED, TRUNCATED if the output
+        limit was reached, or TIMED_OUT if it ran past timeout seconds"""
+
+        instructions = code.instructions
+        slots = code.initial_slots()
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        write = self.stdout.write
+        written = 0
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        jumps = 0
+        pc = 0
+
+        while True:
+            op, arg = instructions[pc]
+            pc += 1
+
+            if op == LOAD:
+                push(slots[arg])
+            elif op == CONST:
+                push(arg)
+            elif op == STORE:
+                slots[arg] = pop()
+
+            elif op <= DIV_I32:
+                right = pop()
+                left = stack[-1]
+                if op == ADD_I32:
+                    value = left + right
+                elif op == SUB_I32:
+                    value = left - right
+                elif op == MUL_I32:
+                    value = left * right
+                else:
+                    if not right or (left == INT_MIN and right == -1):
+                        # Both trap on x86
+                        self.trap()
+                    value = abs(left) // abs(right)
+                    if (left < 0) != (right < 0):
+                        value = -value
+                if not INT_MIN <= value <= INT_MAX:
+                    value = wrap(value, 32)
+                stack[-1] = value
+
+            elif op <= DIV_I64:
+                right = pop()
+                left = stack[-1]
+                if op == ADD_I64:
+                    value = left + right
+                elif op == SUB_I64:
+                    value = left - right
+                elif op == MUL_I64:
+                    value = left * right
+                else:
+                    if not right or (left == LLONG_MIN and right == -1):
+                        self.trap()
+                    value = abs(left) // abs(right)
+                    if (left < 0) != (right < 0):
+                        value = -value
+                if not LLONG_MIN <= value <= LLONG_MAX:
+                    value = wrap(value, 64)
+                stack[-1] = value
+
+            elif op <= DIV_F32:
+                # Exact float operands rounded once from double give the
+                # correctly rounded float result
+                right = pop()
+                if op == ADD_F32:
+                    stack[-1] = single(stack[-1] + right)
+                elif op == SUB_F32:
+                    stack[-1] = single(stack[-1] - right)
+                elif op == MUL_F32:
+                    stack[-1] = single(stack[-1] * right)
+                else:
+                    stack[-1] = single(divide(stack[-1], right))
+
+            elif op <= DIV_F64:
+                right = pop()
+                if op == ADD_F64:
+                    stack[-1] += right
+                elif op == SUB_F64:
+                    stack[-1] -= right
+                elif op == MUL_F64:
+                    stack[-1] *= right
+                else:
+                    stack[-1] = divide(stack[-1], right)
+
+            elif op == JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+
+            elif op == JUMP:
+                if arg < pc:
+                    jumps += 1
+                    if (
+                        deadline is not None
+                        and jumps % CHECK_INTERVAL == 0
+                        and time.perf_counter() > deadline
+                    ):
+                        return TIMED_OUT
+                pc = arg
+
+            elif op <= GE:
+                right = pop()
+                left = stack[-1]
+                if op == EQ:
+                    stack[-1] = 1 if left == right else 0
+                elif op == NE:
+                    stack[-1] = 1 if left != right else 0
+                elif op == LT:
+                    stack[-1] = 1 if left < right else 0
+                elif op == LE:
+                    stack[-1] = 1 if left <= right else 0
+                elif op == GT:
+                    stack[-1] = 1 if left > right else 0
+                else:
+                    stack[-1] = 1 if left >= right else 0
+
+            elif op == TO_F32:
+                stack[-1] = single(float(stack[-1]))
+            elif op == TO_F64:
+                stack[-1] = float(stack[-1])
+            elif op == TO_I32:
+                stack[-1] = to_int(stack[-1], 32)
+            elif op == TO_I64:
+                stack[-1] = to_int(stack[-1], 64)
+            elif op == DUP:
+                push(stack[-1])
+
+            elif op <= PRINT_STR:
+                if op == PRINT_FLOAT:
+                    text = format_float(pop()) + "\n"
+                elif op == PRINT_INT:
+                    text = str(pop()) + "\n"
+                else:
+                    text = pop() + "\n"
+
+                written += len(text)
+                if written > self.max_output:
+                    write(text[: len(text) - (written - self.max_output)])
+                    return TRUNCATED
+                write(text)
+
+            elif op == INPUT:
+                value = self.reader.read(code.kinds[arg])
+                if value is not None:
+                    slots[arg] = value
+
+            elif op == HALT:
+                return HALTED
+
+            else:
+                self.abort(f"Unknown opcode {op}")
+
+
+def execute(code, input_text="", timeout=None, max_output=None):
+    """Runs code with input_text as stdin, returning (stdout, status)"""
+
+    output = io.StringIO()
+    status = VM(output, io.StringIO(input_text), max_output).run(code, timeout)
+    return output.getvalue(), status
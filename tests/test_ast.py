@@ -0,0 +1,54 @@
+"""AST test module"""
+
+import unittest
+
+from src.ast import Bin_Op, Num, Var
+from src.parse import Parser
+from src.string_token import Token
+from src.table_lex import TableLexer
+from src.token_type import TokenType
+
+
+class TestAst(unittest.TestCase):
+    """Tests the compact AST node classes"""
+
+    def test_nodes_have_no_dict(self):
+        """Every node in a parsed tree is slotted"""
+
+        source = 'LET a = 1\nIF a > 0 THEN\nPRINT "x"\nENDIF\nINPUT b\n'
+        tree = Parser(TableLexer(source)).program()
+        nodes = [tree, *tree.statements, tree.statements[1].condition]
+
+        for node in nodes:
+            self.assertFalse(hasattr(node, "__dict__"), node)
+
+    def test_leaf_token(self):
+        """Leaves rebuild an equivalent token on demand"""
+
+        token = Num(Token("42", TokenType.INTEGER)).token
+        self.assertEqual((token.text, token.kind), ("42", TokenType.INTEGER))
+
+    def test_var_names_are_interned(self):
+        """Repeated variable references share one string"""
+
+        first = Var(Token("".join(["co", "unt"]), TokenType.IDENT))
+        second = Var(Token("".join(["cou", "nt"]), TokenType.IDENT))
+        self.assertIs(first.value, second.value)
+
+    def test_to_dict(self):
+        """Serialization is unchanged"""
+
+        node = Bin_Op(
+            Num(Token("1", TokenType.INTEGER)),
+            Token("+", TokenType.PLUS),
+            Var(Token("a", TokenType.IDENT)),
+        )
+        self.assertEqual(
+            node.to_dict(),
+            {
+                "type": "Bin_Op",
+                "operator": "+",
+                "left": {"type": "Num", "value": "1"},
+                "right": {"type": "Var", "value": "a"},
+            },
+        )
@@ -0,0 +1,137 @@
+"""AST store test module"""
+
+import json
+import unittest
+
+from src.ast_store import AstStore, AstTree
+from src.pipeline import compile_source
+from src.serialize import dumps
+
+SOURCE = (
+    "LET a = 1 + 2\nWHILE a < 9 REPEAT\nIF a > 3 THEN\nPRINT a * 2\nENDIF\n"
+    "LET a = a + 1\nENDWHILE\nPRINT \"done\"\n"
+)
+
+
+def strip(page):
+    """Return a page without the keys paging adds, like to_dict's output"""
+
+    if isinstance(page, list):
+        return [strip(item) for item in page]
+    if not isinstance(page, dict):
+        return page
+    return {
+        key: strip(value)
+        for key, value in page.items()
+        if key not in ("id", "children") and not key.endswith("_total")
+    }
+
+
+class TestAstStore(unittest.TestCase):
+    """Tests node numbering, paging and the store's eviction and loading"""
+
+    def setUp(self):
+        _, self.ast_json = compile_source(SOURCE)
+        self.tree = AstTree(json.loads(self.ast_json))
+
+    def test_full_page_matches_tree(self):
+        """A page deep enough holds the whole tree, with pre-order IDs"""
+
+        page = self.tree.page(0, 100)
+
+        self.assertEqual(strip(page), json.loads(self.ast_json))
+        self.assertEqual(page["id"], 0)
+        self.assertEqual(page["children"], 3)
+        self.assertEqual(
+            [statement["id"] for statement in page["statements"]], [1, 5, 21]
+        )
+        self.assertEqual(len(self.tree.nodes), 23)
+        self.assertEqual(self.tree.sizes[0], 23)
+
+    def test_top_levels(self):
+        """Nodes at the last level keep their fields and child count only"""
+
+        page = self.tree.page(0, 1)
+
+        self.assertEqual(
+            page["statements"][1], {"id": 5, "type": "While", "children": 3}
+        )
+        self.assertEqual(
+            page["statements"][2], {"id": 21, "type": "Print", "children": 1}
+        )
+
+    def test_subtree_pages(self):
+        """Paging from a node gives the subtree under it, IDs unchanged"""
+
+        whole = self.tree.page(0, 100)
+        loop = whole["statements"][1]
+
+        self.assertEqual(self.tree.page(loop["id"], 100), loop)
+
+        condition = self.tree.page(loop["id"], 1)["condition"]
+        self.assertEqual(self.tree.page(condition["id"], 100), loop["condition"])
+
+    def test_child_list_pages(self):
+        """Child lists are cut at limit at every level, with their length,
+        and offset pages through those of the requested node"""
+
+        whole = self.tree.page(0, 100)
+        loop = whole["statements"][1]
+
+        page = self.tree.page(0, 100, limit=2)
+        self.assertEqual(page["statements_total"], 3)
+        self.assertEqual(page["statements"], whole["statements"][:2])
+
+        page = self.tree.page(0, 100, offset=1, limit=1)
+        self.assertEqual(page["statements"][0]["body"], loop["body"][:1])
+        self.assertEqual(page["statements"][0]["body_total"], 2)
+
+        page = self.tree.page(loop["id"], 100, offset=1)
+        self.assertEqual(page["body"], loop["body"][1:])
+        self.assertEqual(self.tree.page(0, 1, offset=5)["statements"], [])
+
+    def test_deep_tree(self):
+        """Trees deeper than the recursion limit are stored and paged"""
+
+        _, ast_json = compile_source("PRINT 1" + " + 1" * 20000 + "\n")
+        tree = AstStore().put("deep", ast_json)
+        self.assertEqual(len(tree.nodes), 2 + 2 * 20000 + 1)
+
+        page = tree.page(0, len(tree.nodes))
+        node = page["statements"][0]["expression"]
+        depth = 0
+        while "left" in node:
+            node = node["left"]
+            depth += 1
+
+        self.assertEqual(depth, 20000)
+        self.assertEqual(
+            node, {"id": 20002, "type": "Num", "value": "1", "children": 0}
+        )
+        self.assertTrue(dumps(page).startswith('{"id": 0, "type": "Program"'))
+
+    def test_store(self):
+        """The least recently used tree is evicted, and trees the store
+        does not hold are loaded"""
+
+        loaded = []
+
+        def load(ast_id):
+            loaded.append(ast_id)
+            return self.ast_json if ast_id == "cached" else None
+
+        store = AstStore(max_entries=2, load=load)
+        first = store.put("a", self.ast_json)
+        store.put("b", self.ast_json)
+
+        self.assertIs(store.get("a"), first)
+        store.put("c", self.ast_json)
+
+        self.assertEqual(list(store.trees), ["a", "c"])
+        self.assertIsNone(store.get("b"))
+        self.assertEqual(store.get("cached").page(0, 0)["children"], 3)
+        self.assertEqual(loaded, ["b", "cached"])
+
+
+if __name__ == "__main__":
+    unittest.main()
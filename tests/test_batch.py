@@ -0,0 +1,95 @@
+"""Batch compile test module"""
+
+import multiprocessing
+import os
+import time
+import unittest
+
+from src.batch import BatchCompiler
+from src.pipeline import compile_source
+
+
+def crash(source):
+    """Kills the worker process it runs in"""
+
+    os._exit(1)
+
+
+def stall(source):
+    """Sleeps far longer than any test waits"""
+
+    time.sleep(60)
+    return source
+
+
+class TestBatch(unittest.TestCase):
+    """Tests compiling batches in worker processes"""
+
+    def setUp(self):
+        with open("test_file.txt", "r", encoding="utf-8") as source_file:
+            self.source = source_file.read()
+
+    def test_results_in_order_with_errors(self):
+        """Each source gets its own result, errors included, in order"""
+
+        sources = [
+            self.source,
+            "PRINT x\n",
+            "LET a = 1\nPRINT a\n",
+            "GOTO nowhere\n",
+        ]
+
+        for workers in [1, 2]:
+            compiler = BatchCompiler(workers)
+            try:
+                results = compiler.compile(sources)
+            finally:
+                compiler.shutdown()
+
+            self.assertEqual(len(results), len(sources))
+            self.assertEqual(results[0], (None,) + compile_source(self.source))
+            self.assertIn("before assignment: x", results[1][0])
+            self.assertEqual(results[2], (None,) + compile_source(sources[2]))
+            self.assertIn("GOTO label undeclared", results[3][0])
+
+
+    def test_dead_worker(self):
+        """Items of a batch whose worker died fail, and the next batch gets
+        a new pool"""
+
+        compiler = BatchCompiler(2)
+        try:
+            results = compiler.map(crash, ["a", "b", "c"], failed=lambda e: e)
+            self.assertEqual(results, ["Error: A compile worker process died"] * 3)
+
+            source = "LET a = 1\nPRINT a\n"
+            results = compiler.compile([source, source])
+            self.assertEqual(results, [(None,) + compile_source(source)] * 2)
+        finally:
+            compiler.shutdown()
+
+    def test_timeout_stops_workers(self):
+        """Items not done within the timeout fail, their workers are stopped
+        and the next batch gets a new pool"""
+
+        compiler = BatchCompiler(2)
+        try:
+            results = compiler.map(
+                stall, ["a", "b", "c"], failed=lambda e: e, timeout=0.5
+            )
+            self.assertEqual(results, ["Error: Batch compile timed out"] * 3)
+
+            deadline = time.monotonic() + 5
+            while multiprocessing.active_children() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(multiprocessing.active_children(), [])
+
+            source = "LET a = 1\nPRINT a\n"
+            results = compiler.compile([source, source])
+            self.assertEqual(results, [(None,) + compile_source(source)] * 2)
+        finally:
+            compiler.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
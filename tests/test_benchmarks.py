@@ -0,0 +1,43 @@
+"""Benchmark suite test module"""
+
+import unittest
+
+from benchmarks.programs import WORKLOADS
+from benchmarks.suite import compare, measure
+from src.pipeline import compile_source
+
+
+class TestBenchmarks(unittest.TestCase):
+    """Tests the synthetic programs and baseline comparison"""
+
+    def test_workloads_compile(self):
+        """Every generated program is valid at small sizes"""
+
+        for name, (generate, _) in WORKLOADS.items():
+            for size in [1, 2, 10]:
+                with self.subTest(name=name, size=size):
+                    c_code, _ = compile_source(generate(size))
+                    self.assertIn("int main", c_code)
+
+    def test_compare_flags_regressions(self):
+        """Only metrics beyond the tolerance are reported"""
+
+        results = measure("mixed", 0.01, "char", 1)
+        self.assertEqual(
+            list(results),
+            ["lex", "parse", "generate", "to_dict", "to_json", "to_binary"],
+        )
+        results = {"mixed": results}
+        self.assertEqual(compare(results, results, 0.25), [])
+
+        faster = {
+            phase: {"seconds": 0.0, "peak_bytes": result["peak_bytes"]}
+            for phase, result in results["mixed"].items()
+        }
+        messages = compare(results, {"mixed": faster}, 0.25)
+        self.assertEqual(len(messages), 6)
+        self.assertTrue(all("seconds" in message for message in messages))
+
+
+if __name__ == "__main__":
+    unittest.main()
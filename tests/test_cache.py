@@ -0,0 +1,174 @@
+"""Compile cache test module"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from src.cache import CompileCache
+from src.pipeline import compile_source
+from src.scheduler import CANCELLED, DEADLINE, Rejected
+
+SOURCE = "LET a = 1\nPRINT a\n"
+
+
+class TestCache(unittest.TestCase):
+    """Tests CompileCache"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cache.sqlite3")
+        self.calls = 0
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def compile(self, source):
+        """Counting compile function"""
+
+        self.calls += 1
+        return compile_source(source)
+
+    def test_hit_after_miss(self):
+        """The second request is served from the cache"""
+
+        cache = CompileCache(self.path, version="v1")
+        first = cache.get_or_compile(SOURCE, self.compile)
+        second = cache.get_or_compile(SOURCE, self.compile)
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_shared_between_instances(self):
+        """Another worker opening the same file sees the entry"""
+
+        CompileCache(self.path, version="v1").get_or_compile(SOURCE, self.compile)
+        other = CompileCache(self.path, version="v1")
+        other.get_or_compile(SOURCE, self.compile)
+
+        self.assertEqual(self.calls, 1)
+
+    def test_version_and_options_in_key(self):
+        """A new compiler version or different options miss"""
+
+        cache = CompileCache(self.path, version="v1")
+        self.assertNotEqual(cache.key(SOURCE), cache.key(SOURCE, "optimize"))
+        self.assertNotEqual(
+            cache.key(SOURCE), CompileCache(self.path, version="v2").key(SOURCE)
+        )
+
+    def test_lru_eviction(self):
+        """Least recently used entries are evicted past max_entries"""
+
+        cache = CompileCache(self.path, max_entries=2, memory_entries=0, version="v1")
+        cache.put("a", "c", "{}")
+        cache.put("b", "c", "{}")
+        cache.connection().execute("UPDATE entries SET last_used = 0 WHERE key = 'a'")
+        cache.put("c", "c", "{}")
+
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("b"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_single_flight_threads(self):
+        """Concurrent identical requests compile once"""
+
+        cache = CompileCache(self.path, version="v1")
+
+        def slow_compile(source):
+            time.sleep(0.05)
+            return self.compile(source)
+
+        threads = [
+            threading.Thread(target=cache.get_or_compile, args=(SOURCE, slow_compile))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.calls, 1)
+
+    def test_waits_for_other_worker(self):
+        """A follower waits on another worker's lease instead of compiling"""
+
+        cache = CompileCache(self.path, version="v1")
+        other = CompileCache(self.path, version="v1")
+        key = cache.key(SOURCE)
+        other.connection().execute(
+            "INSERT INTO inflight VALUES (?, ?)", (key, time.time())
+        )
+
+        def finish():
+            time.sleep(0.05)
+            other.put(key, "c", "{}")
+            other.connection().execute("DELETE FROM inflight WHERE key = ?", (key,))
+
+        thread = threading.Thread(target=finish)
+        thread.start()
+        entry = cache.get_or_compile(SOURCE, self.compile)
+        thread.join()
+
+        self.assertEqual(entry, ("c", "{}"))
+        self.assertEqual(self.calls, 0)
+
+    def test_takes_over_dead_lease(self):
+        """A follower whose leader never finishes compiles itself once the
+        lease runs out"""
+
+        cache = CompileCache(self.path, version="v1", lease=0.05)
+        cache.connection().execute(
+            "INSERT INTO inflight VALUES (?, ?)", (cache.key(SOURCE), time.time())
+        )
+
+        entry = cache.get_or_compile(SOURCE, self.compile)
+
+        self.assertEqual(entry, compile_source(SOURCE))
+        self.assertEqual(self.calls, 1)
+
+    def test_wait_bounded_by_timeout(self):
+        """Waiting on a live lease gives up at the request's timeout, as do
+        threads waiting on the one that waits"""
+
+        cache = CompileCache(self.path, version="v1")
+        cache.connection().execute(
+            "INSERT INTO inflight VALUES (?, ?)", (cache.key(SOURCE), time.time())
+        )
+        errors = []
+
+        def follow():
+            try:
+                cache.get_or_compile(SOURCE, self.compile, timeout=0.1)
+            except Rejected as e:
+                errors.append(e.reason)
+
+        threads = [threading.Thread(target=follow) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(errors, [DEADLINE] * 3)
+        self.assertEqual(self.calls, 0)
+
+    def test_wait_stops_when_cancelled(self):
+        """Setting the cancel event stops a follower's wait"""
+
+        cache = CompileCache(self.path, version="v1")
+        cache.connection().execute(
+            "INSERT INTO inflight VALUES (?, ?)", (cache.key(SOURCE), time.time())
+        )
+        cancelled = threading.Event()
+        timer = threading.Timer(0.05, cancelled.set)
+        timer.start()
+
+        with self.assertRaises(Rejected) as caught:
+            cache.get_or_compile(SOURCE, self.compile, cancelled=cancelled)
+        timer.join()
+
+        self.assertEqual(caught.exception.reason, CANCELLED)
+        self.assertEqual(self.calls, 0)
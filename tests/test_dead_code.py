@@ -0,0 +1,173 @@
+"""Dead code elimination test module"""
+
+import unittest
+
+from src.dead_code import DeadCodeEliminator
+from src.parse import Parser
+from src.pipeline import compile_source
+from src.table_lex import TableLexer
+from src.type_infer import infer_types
+
+
+def eliminated_c(source, **options):
+    """Return the C body lines for source compiled without dead code"""
+
+    c_code, _ = compile_source(source, eliminate_dead_code=True, **options)
+    return [line.strip() for line in c_code.splitlines()[3:-2]]
+
+
+class TestDeadCode(unittest.TestCase):
+    """Tests reachability, dead store removal and the report"""
+
+    def test_code_after_goto_and_unused_labels(self):
+        """Statements skipped by a GOTO and labels never jumped to go"""
+
+        self.assertEqual(
+            eliminated_c(
+                'GOTO end\nPRINT "skipped"\nLABEL unused\nPRINT "also"\n'
+                'LABEL end\nPRINT "done"\n'
+            ),
+            ["goto end;", "end:", 'printf("%s\\n", "done");'],
+        )
+
+    def test_dead_stores(self):
+        """Overwritten and never read values go, values read later stay"""
+
+        self.assertEqual(
+            eliminated_c(
+                "LET a = 1\nLET b = a + 2\nLET a = 5\nLET c = 3\n"
+                "LET c = c + 1\nPRINT a\n"
+            ),
+            ["int a = 1;", "a = 5;", 'printf("%.2f\\n", (float) a);'],
+        )
+
+    def test_constant_false_blocks(self):
+        """Folded false conditions drop their block, and a loop that never
+        ends makes what follows it unreachable"""
+
+        self.assertEqual(
+            eliminated_c(
+                'IF 1 > 2 THEN\nPRINT "never"\nENDIF\n'
+                'WHILE 2 < 1 REPEAT\nPRINT "never"\nENDWHILE\n'
+                'WHILE 1 < 2 REPEAT\nENDWHILE\nPRINT "after"\n'
+            ),
+            ["while (1 < 2) {", "}"],
+        )
+
+    def test_loops_and_jumps_keep_values_live(self):
+        """Values read on a later iteration or after a backward GOTO stay"""
+
+        source = (
+            "LET i = 0\nLET s = 0\nLABEL top\nWHILE i < 3 REPEAT\n"
+            "LET s = s + i\nLET i = i + 1\nENDWHILE\nLET i = 0\n"
+            "IF s < 10 THEN\nLET s = s + 5\nGOTO top\nENDIF\nPRINT s\n"
+        )
+        self.assertEqual(
+            [line for line in eliminated_c(source) if "=" in line],
+            [
+                "int i = 0;",
+                "int s = 0;",
+                "s = s + i;",
+                "i = i + 1;",
+                "i = 0;",
+                "s = s + 5;",
+            ],
+        )
+
+    def test_legacy_declarations_are_kept(self):
+        """The first LET of a variable declares it in the C, so it stays
+        while the variable is used, with a dead Bin_Op value zeroed"""
+
+        self.assertEqual(
+            eliminated_c("LET a = 1 + 2\nLET a = 4\nPRINT a\n"),
+            ["float a = 0.0;", "a = 4;", 'printf("%.2f\\n", (float) a);'],
+        )
+        self.assertEqual(
+            eliminated_c("GOTO l\nLET a = 1\nLABEL l\nLET a = 2\nPRINT a\n"),
+            ["goto l;", "int a = 1;", "l:", "a = 2;", 'printf("%.2f\\n", (float) a);'],
+        )
+
+    def test_typed_declarations_are_pruned(self):
+        """With inferred types unused variables are not declared"""
+
+        self.assertEqual(
+            eliminated_c(
+                "LET a = 1 + 2\nLET b = 7\nLET a = 4\nPRINT a\n", infer_types=True
+            ),
+            ["int a = 0;", "a = 4;", 'printf("%d\\n", a);'],
+        )
+
+    def test_side_effects_are_kept(self):
+        """INPUT, PRINT and a condition assigning in C stay though the
+        values they write are never read"""
+
+        self.assertEqual(
+            eliminated_c("LET x = 1\nINPUT y\nIF x = 2 THEN\nENDIF\n"),
+            [
+                "int x = 1;",
+                "float y;",
+                'scanf("%f", &y);',
+                "if (x = 2) {",
+                "}",
+            ],
+        )
+
+    def test_report_and_input_unchanged(self):
+        """Removed statements are counted by reason; the tree passed in is
+        left as it was"""
+
+        program = Parser(
+            TableLexer(
+                "LET a = 1\nIF a > 0 THEN\nLET b = 2\nENDIF\nGOTO end\n"
+                'PRINT "x"\nIF 1 > 2 THEN\nPRINT a\nENDIF\nLABEL end\nPRINT a\n'
+            )
+        ).program()
+        before = program.to_dict()
+
+        eliminator = DeadCodeEliminator()
+        result = eliminator.program(program)
+
+        self.assertEqual(program.to_dict(), before)
+        self.assertEqual(len(result.statements), 4)
+        self.assertEqual(
+            eliminator.counts,
+            {
+                "unreachable": 3,
+                "dead stores": 1,
+                "unused labels": 0,
+                "constant false blocks": 0,
+                "empty blocks": 1,
+            },
+        )
+        self.assertEqual((eliminator.before, eliminator.after), (9, 4))
+        self.assertEqual(eliminator.unused_variables, 1)
+        self.assertTrue(eliminator.summary().startswith("Dead code: removed 5 of 9"))
+
+    def test_types_follow_input(self):
+        """Without dead code the types map is unchanged"""
+
+        program = Parser(TableLexer("LET a = 1\nPRINT a\n")).program()
+        types = infer_types(program)
+        eliminator = DeadCodeEliminator(types)
+        eliminator.program(program)
+        self.assertEqual(eliminator.types, types)
+
+    def test_deep_nesting(self):
+        """Nesting deeper than the recursion limit does not recurse"""
+
+        depth = 3000
+        source = (
+            "LET a = 1\n"
+            + "IF a < 2 THEN\n" * depth
+            + "LET b = a\n"
+            + "ENDIF\n" * depth
+            + "PRINT a\n"
+        )
+        self.assertEqual(
+            eliminated_c(source, engine="table"),
+            ["int a = 1;", 'printf("%.2f\\n", (float) a);'],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+"""Deep nesting test module"""
+
+import json
+import unittest
+
+from src.code_gen import CodeGenerator
+from src.parse import Parser
+from src.serialize import dumps, encode
+from src.table_lex import TableLexer
+
+DEPTH = 20000
+
+
+class TestDeepNesting(unittest.TestCase):
+    """Tests that nesting far past the recursion limit compiles"""
+
+    def compile(self, source):
+        """Runs every phase that used to recurse per nesting level"""
+
+        tree = Parser(TableLexer(source)).program()
+        c_code = CodeGenerator().generate(tree)
+        ast_json = dumps(tree.to_dict())
+        return c_code, ast_json
+
+    def test_nested_blocks(self):
+        """Deeply nested IF/WHILE blocks"""
+
+        opening = "LET a = 1\n" + "IF a > 0 THEN\nWHILE a > 0 REPEAT\n" * (DEPTH // 2)
+        closing = "ENDWHILE\nENDIF\n" * (DEPTH // 2)
+        c_code, ast_json = self.compile(opening + "PRINT a\n" + closing)
+
+        self.assertEqual(c_code.count("while (a > 0) {"), DEPTH // 2)
+        self.assertEqual(ast_json.count('"type": "If"'), DEPTH // 2)
+
+    def test_long_expression(self):
+        """A left deep Bin_Op chain"""
+
+        c_code, ast_json = self.compile("LET a = 1" + " + 1" * DEPTH + "\n")
+
+        self.assertIn("float a = 1" + " + 1" * DEPTH + ";", c_code)
+        self.assertEqual(ast_json.count("Bin_Op"), DEPTH)
+
+    def test_dumps_matches_json(self):
+        """The stack based encoder matches the json module"""
+
+        with open("test_file.txt", "r", encoding="utf-8") as source_file:
+            tree = Parser(TableLexer(source_file.read())).program()
+
+        self.assertEqual(
+            encode(tree.to_dict(), indent=4), json.dumps(tree.to_dict(), indent=4)
+        )
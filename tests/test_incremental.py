@@ -0,0 +1,111 @@
+"""Incremental reparsing test module"""
+
+import unittest
+
+from src.incremental import IncrementalParser
+from src.parse import Parser
+from src.table_lex import TableLexer
+
+SOURCE = """LET a = 1
+LABEL top
+WHILE a < 10 REPEAT
+  LET a = a + 1
+  PRINT a
+ENDWHILE
+LET b = a * 2
+PRINT b
+GOTO top
+"""
+
+
+def full_parse(source):
+    """Parses source from scratch"""
+
+    return Parser(TableLexer(source)).program().to_dict()
+
+
+class TestIncremental(unittest.TestCase):
+    """Tests edits against a full reparse of the edited source"""
+
+    def setUp(self):
+        self.parser = IncrementalParser(SOURCE)
+
+    def test_initial_parse_matches_full_parse(self):
+        """With no edits the program matches a full parse"""
+
+        self.assertEqual(self.parser.program().to_dict(), full_parse(SOURCE))
+
+    def test_edit_matches_full_parse(self):
+        """An edit inside a block gives the same tree as a full parse"""
+
+        start = SOURCE.index("a + 1") + 4
+        program = self.parser.edit(start, start + 1, "5")
+        source = SOURCE[:start] + "5" + SOURCE[start + 1 :]
+
+        self.assertEqual(self.parser.source, source)
+        self.assertEqual(program.to_dict(), full_parse(source))
+
+    def test_unchanged_statements_are_reused(self):
+        """Statements outside the edited chunk keep their nodes"""
+
+        before = self.parser.program().statements
+        start = SOURCE.index("b = a * 2") + 8
+        after = self.parser.edit(start, start + 1, "3").statements
+
+        self.assertEqual(len(before), len(after))
+        for index in [0, 1, 2, 4, 5]:
+            self.assertIs(before[index], after[index])
+        self.assertIsNot(before[3], after[3])
+
+    def test_removing_assignment_breaks_later_reference(self):
+        """Deleting a definition reports uses in later chunks"""
+
+        with self.assertRaisesRegex(Exception, "before assignment: a"):
+            self.parser.edit(0, len("LET a = 1\n"), "")
+
+        # Restoring it repairs the program
+        program = self.parser.edit(0, 0, "LET a = 1\n")
+        self.assertEqual(program.to_dict(), full_parse(SOURCE))
+
+    def test_label_checks(self):
+        """Duplicate labels and missing GOTO targets are reported"""
+
+        with self.assertRaisesRegex(Exception, "Label already exists: top"):
+            self.parser.edit(0, 0, "LABEL top\n")
+
+        self.parser = IncrementalParser(SOURCE)
+        start = SOURCE.index("LABEL top")
+        with self.assertRaisesRegex(Exception, "GOTO label undeclared: top"):
+            self.parser.edit(start, start + len("LABEL top\n"), "")
+
+    def test_program_after_failed_label_check(self):
+        """program() keeps raising the label error a failed edit reported"""
+
+        parser = IncrementalParser("LABEL x\nGOTO x\n")
+        end = len("LABEL x\nGOTO x")
+        with self.assertRaisesRegex(Exception, "GOTO label undeclared: xa"):
+            parser.edit(end, end, "a")
+
+        for _ in range(2):
+            with self.assertRaisesRegex(Exception, "GOTO label undeclared: xa"):
+                parser.program()
+
+        # Renaming the label to match repairs it
+        end = len("LABEL x")
+        program = parser.edit(end, end, "a")
+        self.assertEqual(program.to_dict(), full_parse("LABEL xa\nGOTO xa\n"))
+
+    def test_edit_across_chunks(self):
+        """An edit opening a block absorbs the chunks it now spans"""
+
+        start = SOURCE.index("PRINT b")
+        with self.assertRaises(Exception):
+            self.parser.edit(start, start, "IF b > 1 THEN\n")
+
+        end = self.parser.source.index("GOTO top")
+        program = self.parser.edit(end, end, "ENDIF\n")
+        self.assertEqual(program.to_dict(), full_parse(self.parser.source))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -37,3 +37,10 @@ class TestLex(unittest.TestCase):
         print(token)
         if token is not None:
             self.assertEqual(token.kind, TokenType.IF)
+
+    def test_two_char_operator_text(self):
+        """Two character operators keep their own text"""
+
+        lexer = Lexer(source="<= >= != ==")
+        texts = [lexer.get_token().text for _ in range(4)]
+        self.assertEqual(texts, ["<=", ">=", "!=", "=="])
@@ -0,0 +1,199 @@
+"""Loop optimization test module"""
+
+import shutil
+import tempfile
+import unittest
+
+from src.bytecode import compile_program
+from src.code_gen import CodeGenerator
+from src.loops import LoopOptimizer
+from src.native import NativeBuilder
+from src.parse import Parser
+from src.pipeline import compile_source, transform
+from src.table_lex import TableLexer
+from src.vm import execute
+
+PROGRAMS = [
+    "LET a = 3\nLET b = 4\nLET i = 0\nLET s = 0\nWHILE i < 10 REPEAT\n"
+    "LET s = s + a * b + i * 4\nPRINT s + a * b\nLET i = i + 1\nPRINT i * 4\n"
+    "ENDWHILE\n",
+    "LET n = 4\nLET i = 0\nWHILE i < n REPEAT\nLET j = 10\n"
+    "WHILE j > 0 REPEAT\nPRINT n * 3 + i * n + j * 7\nLET j = j - 3\nENDWHILE\n"
+    "LET i = i + 1\nENDWHILE\n",
+    "INPUT x\nINPUT y\nLET i = 0\nWHILE i * 2 < 9 REPEAT\nPRINT 1 + x * y / 3\n"
+    "IF x * y > 1 THEN\nPRINT i * 2 + x * y\nENDIF\nLET i = i + 2\nENDWHILE\n",
+    "LET a = 7\nLET d = 0\nLET i = 5\nWHILE i > 0 REPEAT\nLET q = a / 2\n"
+    "LET r = 0.5 * a\nIF d > 0 THEN\nPRINT a / d\nENDIF\nPRINT q + r\n"
+    "LET i = i - 1\nENDWHILE\n",
+    "LET a = 2\nLET i = 0\nLABEL top\nWHILE i < 3 REPEAT\nPRINT a * 5 + i * 3\n"
+    "LET i = i + 1\nIF i > 1 THEN\nLET a = a + 1\nENDIF\nENDWHILE\n"
+    "IF a < 6 THEN\nLET i = 0\nGOTO top\nENDIF\n",
+    "LET k = 3\nLET i = 0\nWHILE i < 4 REPEAT\nLABEL inside\nPRINT k * k + i * k\n"
+    "LET i = i + 1\nENDWHILE\nLET t = 2147483647\nLET i = 0\n"
+    "WHILE i < 3 REPEAT\nPRINT t * 2 + i * 1000000000\nLET i = i + 1\nENDWHILE\n",
+]
+
+
+def run(tree, types, input_text="3 2.5\n"):
+    """Return the output of tree run on the VM"""
+
+    return execute(compile_program(tree, types), input_text)[0]
+
+
+def loop_c(source, **options):
+    """Return the C body lines for source compiled with loop optimization"""
+
+    c_code, _ = compile_source(source, optimize_loops=True, **options)
+    return [line.strip() for line in c_code.splitlines()[3:-2]]
+
+
+class TestLoops(unittest.TestCase):
+    """Tests invariant hoisting, strength reduction and that neither
+    changes what a program prints"""
+
+    def test_hoists_invariants(self):
+        """Invariant expressions move before the loop, once each. The value
+        of a declaring LET stays, so t is still declared float"""
+
+        self.assertEqual(
+            loop_c(
+                "LET a = 3\nLET b = 4\nLET s = 0\nWHILE s < 50 REPEAT\n"
+                "LET s = s + a * b\nLET t = a * b - s\nENDWHILE\n"
+            ),
+            [
+                "int a = 3;",
+                "int b = 4;",
+                "int s = 0;",
+                "int _inv0 = 0;",
+                "_inv0 = a * b;",
+                "while (s < 50) {",
+                "s = s + _inv0;",
+                "float t = _inv0 - s;",
+                "}",
+            ],
+        )
+
+    def test_hoists_to_outermost_invariant_loop(self):
+        """An expression goes out of every loop it is invariant in"""
+
+        c_lines = loop_c(PROGRAMS[1], infer_types=True)
+
+        self.assertEqual(
+            c_lines[c_lines.index("_inv1 = n * 3;") + 1], "while (i < n) {"
+        )
+        self.assertEqual(
+            c_lines[c_lines.index("while (j > 0) {") - 1], "_inv3 = _inv1 + _ind0;"
+        )
+        self.assertIn('printf("%d\\n", _inv3 + _ind2);', c_lines)
+
+    def test_reduces_induction_multiplications(self):
+        """i * k becomes a variable stepped after each increment of i"""
+
+        self.assertEqual(
+            loop_c(
+                "LET i = 0\nLET s = 0\nWHILE i < 9 REPEAT\nLET s = s + i * 4\n"
+                "LET i = i + 3\nENDWHILE\n",
+                infer_types=True,
+            ),
+            [
+                "int i = 0;",
+                "int s = 0;",
+                "int _ind0 = 0;",
+                "i = 0;",
+                "s = 0;",
+                "_ind0 = i * 4;",
+                "while (i < 9) {",
+                "s = s + _ind0;",
+                "i = i + 3;",
+                "_ind0 = _ind0 + 12;",
+                "}",
+            ],
+        )
+
+    def test_unsafe_code_stays(self):
+        """Loops a label can enter and int divisions that may trap are left
+        alone, as are values whose C type the generator picks by context"""
+
+        source = (
+            "LET a = 3\nLET d = 0\nLET i = 0\nWHILE i < 3 REPEAT\n"
+            "LABEL l\nPRINT 1 + a * 2\nLET i = i + 1\nENDWHILE\n"
+            "WHILE i > 0 REPEAT\nIF d > 0 THEN\nLET q = a / d\nENDIF\n"
+            "LET r = a * 2\nPRINT a * 2 + i\nLET i = i - 1\nENDWHILE\n"
+        )
+        program = Parser(TableLexer(source)).program()
+        optimizer = LoopOptimizer()
+
+        self.assertEqual(
+            CodeGenerator().generate(optimizer.program(program)),
+            CodeGenerator().generate(program),
+        )
+        self.assertEqual(optimizer.counts, {"hoisted": 0, "reduced": 0, "loops": 0})
+
+    def test_matches_unoptimized(self):
+        """Every sample program prints the same with and without the pass"""
+
+        for options in [(False, False), (False, True), (True, False), (True, True)]:
+            for source in PROGRAMS:
+                with self.subTest(source=source, options=options):
+                    program = Parser(TableLexer(source)).program()
+                    plain = run(*transform(program, *options))
+                    optimized = run(*transform(program, *options, False, True))
+
+                    self.assertEqual(optimized, plain)
+
+    @unittest.skipIf(shutil.which("cc") is None, "no C compiler")
+    def test_matches_unoptimized_natively(self):
+        """The generated C prints the same with and without the pass"""
+
+        with tempfile.TemporaryDirectory() as directory:
+            builder = NativeBuilder(directory)
+
+            for infer_types in (False, True):
+                for source in PROGRAMS:
+                    with self.subTest(source=source, infer_types=infer_types):
+                        outputs = []
+                        for optimize_loops in (False, True):
+                            c_code, _ = compile_source(
+                                source,
+                                infer_types=infer_types,
+                                optimize_loops=optimize_loops,
+                            )
+                            path, _, _ = builder.build(c_code, "0")
+                            outputs.append(builder.run(path, "3 2.5\n")["stdout"])
+
+                        self.assertEqual(outputs[1], outputs[0])
+
+    def test_input_unchanged_and_report(self):
+        """The tree passed in is left as it was and the work is counted"""
+
+        program = Parser(TableLexer(PROGRAMS[0])).program()
+        before = program.to_dict()
+        optimizer = LoopOptimizer()
+        optimizer.program(program)
+
+        self.assertEqual(program.to_dict(), before)
+        self.assertEqual(optimizer.counts, {"hoisted": 1, "reduced": 1, "loops": 1})
+        self.assertEqual(
+            optimizer.summary(),
+            "Loops: hoisted 1 invariant expressions and reduced 1 multiplications"
+            " in 1 loops",
+        )
+
+    def test_deep_nesting(self):
+        """Nesting deeper than the recursion limit does not recurse"""
+
+        depth = 1500
+        source = (
+            "LET a = 1\nLET i = 0\n"
+            + "WHILE i < 1 REPEAT\nIF a > 0 THEN\n" * depth
+            + "PRINT 1 + a * 2\n"
+            + "ENDIF\nLET i = i + 1\nENDWHILE\n" * depth
+        )
+        c_lines = loop_c(source, engine="table")
+
+        self.assertEqual(c_lines[2:4], ["int _inv0 = 0;", "_inv0 = a * 2;"])
+        self.assertIn('printf("%.2f\\n", (float) 1 + _inv0);', c_lines)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+"""Metrics test module"""
+
+import unittest
+
+from src.metrics import CompileMetrics, Counter, Histogram, Registry, count_nodes
+from src.metrics import stats_samples
+from src.parse import Parser
+from src.scheduler import Deadline, Scheduler, compile_checked
+from src.table_lex import TableLexer
+
+
+class TestMetrics(unittest.TestCase):
+    """Tests the Prometheus text rendering and what compiles record"""
+
+    def test_render(self):
+        """Histograms render cumulative buckets, sum and count per label,
+        counters one sample per label, collectors one series each"""
+
+        registry = Registry()
+        histogram = registry.add(Histogram("h", "A histogram", (1, 10), "phase"))
+        counter = registry.add(Counter("c_total", "A counter", "phase"))
+        registry.collect(
+            lambda: stats_samples("s", {"hits": 3, "size": 1.5}, ("hits",), "Stats")
+        )
+
+        histogram.observe(0.5, "lex")
+        histogram.observe(1, "lex")
+        histogram.observe(20, "lex")
+        counter.inc('say "hi"')
+
+        self.assertEqual(
+            registry.render(),
+            "# HELP h A histogram\n"
+            "# TYPE h histogram\n"
+            'h_bucket{phase="lex",le="1.0"} 2\n'
+            'h_bucket{phase="lex",le="10.0"} 2\n'
+            'h_bucket{phase="lex",le="+Inf"} 3\n'
+            'h_sum{phase="lex"} 21.5\n'
+            'h_count{phase="lex"} 3\n'
+            "# HELP c_total A counter\n"
+            "# TYPE c_total counter\n"
+            'c_total{phase="say \\"hi\\""} 1\n'
+            "# HELP s_hits_total Stats\n"
+            "# TYPE s_hits_total counter\n"
+            "s_hits_total 3\n"
+            "# HELP s_size Stats\n"
+            "# TYPE s_size gauge\n"
+            "s_size 1.5\n",
+        )
+
+    def test_count_nodes(self):
+        """Every node of the tree is counted, nested blocks included"""
+
+        program = Parser(
+            TableLexer("LET a = 1 + 2\nWHILE a < 3 REPEAT\nPRINT a\nENDWHILE\n")
+        ).program()
+
+        # Program, Let, Bin_Op, 2 Num, While, Bin_Op, Var, Num, Print, Var
+        self.assertEqual(count_nodes(program), 11)
+
+    def test_scheduler_records_compiles(self):
+        """Finished compiles record every phase, source size and AST size,
+        failed ones the phase they failed in"""
+
+        metrics = CompileMetrics()
+        scheduler = Scheduler(1, metrics=metrics)
+        source = "LET a = 1\nPRINT a\n"
+
+        scheduler.compile(source)
+        with self.assertRaises(Exception):
+            scheduler.compile("PRINT b\n")
+
+        self.assertEqual(
+            set(metrics.phase_seconds.series),
+            {"lex", "parse", "codegen", "serialize"},
+        )
+        self.assertEqual(metrics.phase_seconds.series["lex"][0][-1], 0)
+        self.assertEqual(sum(metrics.phase_seconds.series["parse"][0]), 1)
+        self.assertEqual(sum(metrics.source_chars.series[None][0]), 2)
+        self.assertEqual(metrics.ast_nodes.series[None][1], 5)
+        self.assertEqual(metrics.errors.values, {"parse": 1})
+        self.assertIn(
+            'pytoc_compile_errors_total{phase="parse"} 1\n', metrics.render()
+        )
+
+    def test_deadline_timings(self):
+        """A Deadline records the time each finished phase took"""
+
+        times = iter(range(0, 100, 2))
+        deadline = Deadline({}, clock=lambda: next(times))
+        compile_checked("PRINT 1\n", deadline)
+
+        self.assertEqual(
+            set(deadline.timings), {"lex", "parse", "codegen", "serialize"}
+        )
+        self.assertTrue(all(seconds > 0 for seconds in deadline.timings.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Multi-file compile test module"""
+
+import os
+import tempfile
+import unittest
+
+from src.multifile import COMPILED, FAILED, UP_TO_DATE, compile_paths
+from src.pipeline import compile_source
+
+
+def write(path, text):
+    """Writes text to path, creating its directory"""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as source_file:
+        source_file.write(text)
+
+
+class TestMultiFile(unittest.TestCase):
+    """Tests compiling directories of sources into an output directory"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sources = os.path.join(self.directory.name, "src")
+        self.out = os.path.join(self.directory.name, "out")
+
+        write(os.path.join(self.sources, "a.txt"), "LET a = 1\nPRINT a\n")
+        write(os.path.join(self.sources, "sub", "b.txt"), 'PRINT "b"\n')
+        write(os.path.join(self.sources, "bad.txt"), "PRINT x\n")
+        write(os.path.join(self.sources, "notes.md"), "not a source\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def compile(self, **settings):
+        """Return {output stem: status} for a compile of the sources"""
+
+        results, _, _ = compile_paths([self.sources], self.out, workers=2, **settings)
+        return {
+            os.path.relpath(result["c_file"], self.out): result["status"]
+            for result in results
+        }
+
+    def test_mirrors_directories(self):
+        """Each matching source gets C and AST outputs under its own path"""
+
+        statuses = self.compile()
+
+        self.assertEqual(
+            statuses,
+            {"a.c": COMPILED, os.path.join("sub", "b.c"): COMPILED, "bad.c": FAILED},
+        )
+        with open(os.path.join(self.out, "a.c"), encoding="utf-8") as c_file:
+            self.assertEqual(c_file.read(), compile_source("LET a = 1\nPRINT a\n")[0])
+        self.assertTrue(os.path.exists(os.path.join(self.out, "sub", "b.json")))
+        self.assertFalse(os.path.exists(os.path.join(self.out, "bad.c")))
+
+    def test_skips_up_to_date(self):
+        """Unchanged sources are skipped unless forced or the options change"""
+
+        self.compile()
+        self.assertEqual(
+            list(self.compile().values()), [UP_TO_DATE, FAILED, UP_TO_DATE]
+        )
+
+        write(os.path.join(self.sources, "a.txt"), "LET a = 22\nPRINT a\n")
+        self.assertEqual(self.compile()["a.c"], COMPILED)
+        self.assertEqual(self.compile(force=True)["a.c"], COMPILED)
+        self.assertEqual(self.compile(optimize=True)["a.c"], COMPILED)
+
+        statuses = self.compile(ast_format="binary")
+        self.assertEqual(statuses["a.c"], COMPILED)
+        self.assertTrue(os.path.exists(os.path.join(self.out, "a.ast.bin")))
+
+    def test_new_compiler_version_recompiles(self):
+        """Outputs of another compiler version are not up to date"""
+
+        self.compile(version="v1")
+        self.assertEqual(self.compile(version="v1")["a.c"], UP_TO_DATE)
+        self.assertEqual(self.compile(version="v2")["a.c"], COMPILED)
+        self.assertEqual(self.compile()["a.c"], COMPILED)
+
+    def test_failure_removes_stale_outputs(self):
+        """A source that stops compiling loses its earlier outputs"""
+
+        self.compile()
+        write(os.path.join(self.sources, "a.txt"), "PRINT y\n")
+
+        self.assertEqual(self.compile()["a.c"], FAILED)
+        self.assertFalse(os.path.exists(os.path.join(self.out, "a.c")))
+        self.assertFalse(os.path.exists(os.path.join(self.out, "a.json")))
+
+    def test_stem_collision(self):
+        """Two inputs writing the same output are rejected"""
+
+        other = os.path.join(self.directory.name, "a.txt")
+        write(other, "PRINT 1\n")
+
+        with self.assertRaises(Exception):
+            compile_paths([self.sources, other], self.out, workers=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
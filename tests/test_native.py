@@ -0,0 +1,100 @@
+"""Native build and run test module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.native import NativeBuilder
+from src.pipeline import compile_source
+
+
+@unittest.skipIf(shutil.which("cc") is None, "no C compiler")
+class TestNative(unittest.TestCase):
+    """Tests building, caching and running executables"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.builder = NativeBuilder(self.directory.name, max_entries=2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def build(self, source, opt_level="0"):
+        """Builds source, returning (path, cached)"""
+
+        c_code, _ = compile_source(source)
+        path, cached, _ = self.builder.build(c_code, opt_level)
+        return path, cached
+
+    def test_build_is_cached(self):
+        """The same C and flags reuse the executable; new flags rebuild"""
+
+        path, cached = self.build("PRINT 1\n")
+        self.assertFalse(cached)
+        self.assertEqual(self.build("PRINT 1\n"), (path, True))
+
+        other, cached = self.build("PRINT 1\n", "2")
+        self.assertNotEqual(other, path)
+        self.assertFalse(cached)
+
+    def test_run_with_input(self):
+        """stdin is fed to the program and stdout captured"""
+
+        path, _ = self.build("INPUT x\nPRINT x * 2\n")
+        result = self.builder.run(path, "2.5\n")
+
+        self.assertEqual(result["stdout"], "5.00\n")
+        self.assertEqual(result["exit_code"], 0)
+        self.assertFalse(result["timed_out"])
+
+    def test_runaway_programs_are_stopped(self):
+        """Endless loops time out and endless output is truncated"""
+
+        path, _ = self.build("LET a = 1\nWHILE a > 0 REPEAT\nLET a = a + 0\nENDWHILE\n")
+        self.assertTrue(self.builder.run(path, timeout=0.2)["timed_out"])
+
+        path, _ = self.build("WHILE 1 > 0 REPEAT\nPRINT 1\nENDWHILE\n")
+        result = self.builder.run(path, timeout=5, max_output=1000)
+        self.assertTrue(result["truncated"])
+        self.assertEqual(len(result["stdout"]), 1000)
+
+    def test_compile_errors_and_eviction(self):
+        """cc errors are reported and old executables evicted"""
+
+        with self.assertRaisesRegex(Exception, "C compiler failed"):
+            self.builder.build("int main(void) { return x; }", "0")
+
+        self.build("PRINT 1\n")
+        self.build("PRINT 2\n")
+        self.build("PRINT 3\n")
+        self.assertFalse(self.build("PRINT 1\n")[1])
+
+    def test_shared_cache_directory_is_refused(self):
+        """A cache directory others can write to is not used"""
+
+        shared = os.path.join(self.directory.name, "shared")
+        os.mkdir(shared)
+        os.chmod(shared, 0o777)
+        with self.assertRaisesRegex(Exception, "writable by others"):
+            NativeBuilder(shared)
+
+        private = os.path.join(self.directory.name, "private")
+        NativeBuilder(private)
+        self.assertEqual(os.stat(private).st_mode & 0o777, 0o700)
+
+    def test_slow_compiler_times_out(self):
+        """A cc that hangs is stopped after build_timeout seconds"""
+
+        cc = os.path.join(self.directory.name, "slow-cc")
+        with open(cc, "w") as script:
+            script.write('#!/bin/sh\n[ "$1" = --version ] && exit 0\nsleep 10\n')
+        os.chmod(cc, 0o700)
+
+        builder = NativeBuilder(self.directory.name, cc=cc, build_timeout=0.5)
+        with self.assertRaisesRegex(Exception, "C compiler timed out"):
+            builder.build("int main(void) { return 0; }", "0")
+
+
+if __name__ == "__main__":
+    unittest.main()
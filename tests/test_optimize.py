@@ -0,0 +1,217 @@
+"""Optimization pass test module"""
+
+import itertools
+import unittest
+
+from src.bytecode import compile_program
+from src.code_gen import CodeGenerator
+from src.optimize import Optimizer
+from src.parse import Parser
+from src.pipeline import compile_source
+from src.table_lex import TableLexer
+from src.type_infer import infer_types
+from src.vm import execute
+
+
+def optimized_c(source):
+    """Return the C body lines for source compiled with the optimizer"""
+
+    c_code, _ = compile_source(source, optimize=True)
+    return [line.strip() for line in c_code.splitlines()[3:-2]]
+
+
+def typed_c(source, types):
+    """Return the C body lines for source optimized and generated with the
+    given variable types"""
+
+    program = Parser(TableLexer(source)).program()
+    c_code = CodeGenerator(types).generate(Optimizer(types=types).program(program))
+    return [line.strip() for line in c_code.splitlines()[3:-2]]
+
+
+class TestOptimize(unittest.TestCase):
+    """Tests constant folding, identities and constant propagation"""
+
+    def test_folds_constants_with_c_semantics(self):
+        """Int division truncates and folded LET values keep their C type"""
+
+        self.assertEqual(
+            optimized_c("LET a = 7 / 2\nLET b = -7 / 2\nLET c = 1.5 * 2\n"),
+            ["float a = 3.0;", "float b = -3.0;", "float c = 3.0;"],
+        )
+
+    def test_unsafe_constants_are_kept(self):
+        """Division by zero, int overflow and octal literals fold like C"""
+
+        self.assertEqual(
+            optimized_c("LET a = 1 / 0\nLET b = 2147483647 + 1\nLET c = 010 + 1\n"),
+            ["float a = 1 / 0;", "float b = 2147483647 + 1;", "float c = 9.0;"],
+        )
+
+    def test_identities(self):
+        """x * 1 drops below the LET root, and x + 0 and double negation do
+        too for integer x"""
+
+        source = (
+            "INPUT x\nLET y = x * 1 + 0\nPRINT x * 1 + 0\n"
+            "IF 0 - -x > 1 THEN\nENDIF\n"
+        )
+
+        self.assertEqual(
+            optimized_c(source),
+            [
+                "float x;",
+                'scanf("%f", &x);',
+                "float y = x + 0;",
+                'printf("%.2f\\n", (float) x + 0);',
+                "if (0 - (0 - x) > 1) {",
+                "}",
+            ],
+        )
+        self.assertEqual(
+            typed_c(source, {"x": "int", "y": "int"}),
+            [
+                "int x = 0;",
+                "int y = 0;",
+                'scanf("%d", &x);',
+                "y = x;",
+                'printf("%d\\n", x);',
+                "if (x > 1) {",
+                "}",
+            ],
+        )
+
+    def test_print_cast_folds_in_single_precision(self):
+        """The float cast of a PRINT applies to its leftmost operand"""
+
+        self.assertEqual(
+            optimized_c("PRINT 1 / 20\nPRINT 1 / 2.5\n"),
+            [
+                'printf("%.2f\\n", (float) 0.05000000074505806);',
+                'printf("%.2f\\n", (float) 1 / 2.5);',
+            ],
+        )
+
+    def test_propagates_int_constants(self):
+        """Straight line int constants reach later uses"""
+
+        self.assertEqual(
+            optimized_c("LET a = 3\nLET b = a * 2\nPRINT b\nLET f = 1.5\nPRINT f\n"),
+            [
+                "int a = 3;",
+                "float b = 6.0;",
+                'printf("%.2f\\n", (float) b);',
+                "float f = 1.5;",
+                'printf("%.2f\\n", (float) f);',
+            ],
+        )
+
+    def test_loops_and_labels_stop_propagation(self):
+        """Values assigned in a loop, or live at a label, are not constants"""
+
+        source = (
+            "LET i = 0\nLET k = 2\n"
+            "WHILE i < 3 REPEAT\nPRINT k\nLET i = i + 1\nENDWHILE\n"
+            "PRINT i\nLABEL top\nPRINT k\n"
+        )
+        self.assertEqual(
+            optimized_c(source),
+            [
+                "int i = 0;",
+                "int k = 2;",
+                "while (i < 3) {",
+                'printf("%.2f\\n", (float) 2);',
+                "i = i + 1;",
+                "}",
+                'printf("%.2f\\n", (float) i);',
+                "top:",
+                'printf("%.2f\\n", (float) k);',
+            ],
+        )
+
+    def test_branches_merge_agreeing_constants(self):
+        """After an IF only constants both paths agree on are known"""
+
+        source = (
+            "LET a = 1\nLET b = 1\nINPUT x\n"
+            "IF x > 0 THEN\nLET a = 2\nLET b = 1\nENDIF\nPRINT a + b\n"
+        )
+        self.assertEqual(optimized_c(source)[-1], 'printf("%.2f\\n", (float) a + 1);')
+
+    def test_input_tree_unchanged(self):
+        """The parsed tree and its JSON are left as parsed"""
+
+        source = "LET a = 2 + 3\nPRINT a * 1\n"
+        program = Parser(TableLexer(source)).program()
+        before = program.to_dict()
+        Optimizer().program(program)
+
+        self.assertEqual(program.to_dict(), before)
+        self.assertEqual(
+            compile_source(source, optimize=True)[1], compile_source(source)[1]
+        )
+
+    def test_unary_minus_grouping(self):
+        """Negated operands keep their grouping in the generated C"""
+
+        program = Parser(TableLexer("INPUT a\nINPUT b\nPRINT a * -b - -a\n")).program()
+        c_code = CodeGenerator().generate(program)
+        self.assertIn("(float) a * (0 - b) - (0 - a));", c_code)
+
+    def test_negated_operands(self):
+        """Adding or subtracting an integer negation flips the operator"""
+
+        source = "INPUT x\nINPUT y\nLET a = x - -y\nIF x + -y > 1 THEN\nENDIF\n"
+
+        self.assertEqual(
+            typed_c(source, {"x": "int", "y": "long long", "a": "long long"}),
+            [
+                "int x = 0;",
+                "long long y = 0;",
+                "long long a = 0;",
+                'scanf("%d", &x);',
+                'scanf("%lld", &y);',
+                "a = x + y;",
+                "if (x - y > 1) {",
+                "}",
+            ],
+        )
+        self.assertIn("float a = x - (0 - y);", optimized_c(source))
+
+    def test_signed_zero_kept(self):
+        """Floating -0 prints the same with and without the optimizer"""
+
+        sources = [
+            "LET v = 0.5\nPRINT -1 * v * 0 + 0\nPRINT 0 + -1 * v * 0\n",
+            "LET v = 0.5\nLET z = -1 * v * 0\nLET a = 0.0\nPRINT z - -a\n",
+            "LET v = 0.5\nLET z = -1 * v * 0\nLET w = 0 - -z\nPRINT w\n",
+        ]
+
+        for source, typed in itertools.product(sources, (False, True)):
+            with self.subTest(source=source, typed=typed):
+                program = Parser(TableLexer(source)).program()
+                types = infer_types(program) if typed else None
+                tree = Optimizer(types=types).program(program)
+                self.assertEqual(
+                    execute(compile_program(tree, types)),
+                    execute(compile_program(program, types)),
+                )
+
+    def test_negation_emitted_as_unary_minus(self):
+        """0 - x is emitted as -x for int literals and variables only, since
+        a float zero would become -0"""
+
+        program = Parser(
+            TableLexer("LET i = 1\nLET x = 0.5\nPRINT 2 * -i - -x\nPRINT 1 - -7\n")
+        ).program()
+
+        c_code = CodeGenerator({"i": "int", "x": "double"}).generate(program)
+        self.assertIn('printf("%.2f\\n", 2 * -i - (0 - x));', c_code)
+        self.assertIn('printf("%d\\n", 1 - -7);', c_code)
+
+        c_code = CodeGenerator().generate(program)
+        self.assertIn("(float) 2 * (0 - i) - (0 - x));", c_code)
+
+
+if __name__ == "__main__":
+    unittest.main()
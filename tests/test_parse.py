@@ -0,0 +1,139 @@
+"""Expression parsing test module"""
+
+import random
+import unittest
+
+from src.ast import Bin_Op, Num, Var
+from src.parse import Parser
+from src.serialize import to_json
+from src.string_token import Token
+from src.table_lex import TableLexer
+from src.token_type import TokenType
+
+
+def parse(source):
+    """Return the Program parsed from source"""
+
+    return Parser(TableLexer(source)).program()
+
+
+def reference(tokens):
+    """Return the tree of an expression given as (text, kind, start)
+    tokens, by plain recursive descent: sums of products of signed
+    operands, grouped to the left"""
+
+    position = [0]
+
+    def operand():
+        text, kind, start = tokens[position[0]]
+        position[0] += 1
+        if kind in (TokenType.PLUS, TokenType.MINUS):
+            right = operand()
+            node = Bin_Op(Num(Token("0", TokenType.INTEGER)), Token(text, kind), right)
+            node.start, node.end = start, right.end
+            return node
+        node = (Num if kind is TokenType.INTEGER else Var)(Token(text, kind))
+        node.start, node.end = start, start + len(text)
+        return node
+
+    def level(kinds, next_level):
+        left = next_level()
+        while position[0] < len(tokens) and tokens[position[0]][1] in kinds:
+            text, kind, _ = tokens[position[0]]
+            position[0] += 1
+            right = next_level()
+            node = Bin_Op(left, Token(text, kind), right)
+            node.start, node.end = left.start, right.end
+            left = node
+        return left
+
+    def product():
+        return level((TokenType.ASTERISK, TokenType.SLASH), operand)
+
+    return level((TokenType.PLUS, TokenType.MINUS), product)
+
+
+class TestParse(unittest.TestCase):
+    """Tests that precedence climbing builds the Bin_Op trees of the
+    grammar, spans included, and reports the same errors"""
+
+    def test_precedence_and_grouping(self):
+        """Products bind tighter than sums, signs tightest, and operators of
+        one precedence group to the left, each keeping its own operator"""
+
+        program = parse(
+            "LET a = 1\nPRINT 8 / 2 * 2 - -a + 3\nIF a * 2 >= 1 - a THEN\nENDIF\n"
+        )
+
+        self.assertEqual(
+            repr(program.statements[1].expression),
+            "Bin_Op(Bin_Op(Bin_Op(Bin_Op(Num(8), '/', Num(2)), '*', Num(2)), '-', "
+            "Bin_Op(Num(0), '-', Var(a))), '+', Num(3))",
+        )
+        self.assertEqual(
+            repr(program.statements[2].condition),
+            "Bin_Op(Bin_Op(Var(a), '*', Num(2)), '>=', Bin_Op(Num(1), '-', Var(a)))",
+        )
+
+    def test_matches_recursive_descent(self):
+        """Random expressions parse to the reference tree and spans"""
+
+        generator = random.Random(25)
+        operators = ["+", "-", "*", "/"]
+        kinds = {
+            "+": TokenType.PLUS,
+            "-": TokenType.MINUS,
+            "*": TokenType.ASTERISK,
+            "/": TokenType.SLASH,
+        }
+
+        for _ in range(200):
+            prefix = "LET a = 1\nLET b = "
+            tokens = []
+            offset = len(prefix)
+            parts = []
+
+            for index in range(generator.randint(1, 12)):
+                if index:
+                    op = generator.choice(operators)
+                    parts.append(op)
+                    tokens.append((op, kinds[op], offset))
+                    offset += len(op) + 1
+                if generator.random() < 0.3:
+                    sign = generator.choice("+-")
+                    parts.append(sign)
+                    tokens.append((sign, kinds[sign], offset))
+                    offset += 2
+                text = generator.choice(["a", "7", "12"])
+                parts.append(text)
+                kind = TokenType.IDENT if text == "a" else TokenType.INTEGER
+                tokens.append((text, kind, offset))
+                offset += len(text) + 1
+
+            source = prefix + " ".join(parts) + "\n"
+            with self.subTest(source=source):
+                expression = parse(source).statements[1].expression
+                self.assertEqual(
+                    to_json(expression, spans=True),
+                    to_json(reference(tokens), spans=True),
+                )
+
+    def test_errors(self):
+        """Comparisons are required in conditions and do not chain"""
+
+        cases = [
+            ("LET a = 1\nIF a THEN\nENDIF\n", "Expected comparison operator at THEN"),
+            ("LET a = 1\nIF a < 2 < 3 THEN\nENDIF\n", "Expected THEN, got LT"),
+            ("LET a = 1\nPRINT - -a\n", "Unexpected token at -"),
+            ("PRINT 1 + b\n", "Referencing variable before assignment: b"),
+        ]
+
+        for source, message in cases:
+            with self.subTest(source=source):
+                with self.assertRaises(Exception) as caught:
+                    parse(source)
+                self.assertTrue(str(caught.exception).startswith("Error: " + message))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,202 @@
+"""Compile scheduler test module"""
+
+import itertools
+import threading
+import unittest
+
+from src.lex import ENGINES
+from src.pipeline import compile_bytecode, compile_mapped, compile_source
+from src.scheduler import (
+    CANCELLED,
+    DEADLINE,
+    QUEUE_FULL,
+    QUEUE_TIMEOUT,
+    TOO_LARGE,
+    Deadline,
+    Rejected,
+    Scheduler,
+    compile_checked,
+)
+from src.serialize import to_json
+
+SOURCE = (
+    'PRINT "start"\nINPUT n\nLET i = 0\nWHILE i < n REPEAT\nLET x = i * 2 + 1.5\n'
+    "IF x > 3 THEN\nPRINT x / 2\nENDIF\nLET i = i + 1\nENDWHILE\nLABEL done\n"
+)
+
+# Statements enough for every phase to pass several deadline checks
+LONG_SOURCE = "LET a = 1\n" + "LET a = a + 2 * a - 3\n" * 2000
+
+
+def ticking():
+    """Return a clock advancing one second each time it is read"""
+
+    return itertools.count().__next__
+
+
+class TestScheduler(unittest.TestCase):
+    """Tests compiles under the scheduler match compile_source, and that
+    limits, queues and deadlines refuse or stop them"""
+
+    def test_matches_compile_source(self):
+        """Output and errors are those of compile_source on every engine"""
+
+        sources = [
+            SOURCE,
+            LONG_SOURCE,
+            "LET a = 1\nLET b = !a\n",
+            "PRINT x\nLET a = $\n",
+            'LET a = 1\nPRINT "tab\there"\n',
+            "GOTO nowhere\n",
+        ]
+        options = {"optimize": True, "infer_types": True}
+
+        for engine, source in itertools.product(ENGINES, sources):
+            with self.subTest(engine=engine, source=source[:30]):
+                try:
+                    expected = compile_source(source, engine, None, **options)
+                except Exception as e:
+                    with self.assertRaises(Exception) as caught:
+                        compile_checked(source, Deadline({}), engine, **options)
+                    self.assertEqual(str(caught.exception), str(e))
+                    continue
+
+                _, c_code, ast_json = compile_checked(
+                    source, Deadline({}), engine, **options
+                )
+                self.assertEqual((c_code, ast_json), expected)
+
+    def test_phase_deadlines_stop_mid_run(self):
+        """A phase over its budget stops partway, naming the phase"""
+
+        for phase in ("lex", "parse", "codegen"):
+            with self.subTest(phase=phase):
+                deadline = Deadline({phase: 3}, clock=ticking())
+
+                with self.assertRaises(Rejected) as caught:
+                    compile_checked(LONG_SOURCE, deadline, "table")
+
+                self.assertEqual(caught.exception.reason, DEADLINE)
+                self.assertEqual(caught.exception.phase, phase)
+                self.assertEqual(
+                    str(caught.exception),
+                    f"Error: Compile deadline exceeded during {phase}",
+                )
+
+    def test_bytecode(self):
+        """Bytecode compiles match compile_bytecode and run under deadlines"""
+
+        for infer_types in (False, True):
+            with self.subTest(infer_types=infer_types):
+                code = Scheduler(1).compile_bytecode(SOURCE, "table", infer_types)
+                expected = compile_bytecode(SOURCE, "table", infer_types)
+                self.assertEqual(
+                    (code.instructions, code.names, code.kinds),
+                    (expected.instructions, expected.names, expected.kinds),
+                )
+
+        scheduler = Scheduler(1, timeout=3, clock=ticking())
+        with self.assertRaises(Rejected) as caught:
+            scheduler.compile_bytecode(LONG_SOURCE, "table")
+
+        self.assertEqual(caught.exception.reason, DEADLINE)
+        self.assertEqual(scheduler.stats()[DEADLINE], 1)
+
+    def test_mapped(self):
+        """Mapped compiles match compile_mapped and run under deadlines"""
+
+        for options in ({}, {"optimize": True, "infer_types": True}):
+            with self.subTest(**options):
+                program, c_code, source_map = Scheduler(1).compile_mapped(
+                    SOURCE, "table", **options
+                )
+                expected = compile_mapped(SOURCE, "table", **options)
+                self.assertEqual(
+                    (to_json(program, spans=True), c_code, source_map.to_dict()),
+                    (
+                        to_json(expected[0], spans=True),
+                        expected[1],
+                        expected[2].to_dict(),
+                    ),
+                )
+
+        scheduler = Scheduler(1, timeout=3, clock=ticking())
+        with self.assertRaises(Rejected) as caught:
+            scheduler.compile_mapped(LONG_SOURCE, "table")
+
+        self.assertEqual(caught.exception.reason, DEADLINE)
+
+    def test_cancel(self):
+        """Setting the cancel event stops the compile at its next check"""
+
+        cancelled = threading.Event()
+        cancelled.set()
+        scheduler = Scheduler(1)
+
+        with self.assertRaises(Rejected) as caught:
+            scheduler.compile(SOURCE, cancelled=cancelled)
+
+        self.assertEqual(caught.exception.reason, CANCELLED)
+        self.assertEqual(caught.exception.phase, "lex")
+        self.assertEqual(scheduler.stats()[CANCELLED], 1)
+
+    def test_overall_deadline(self):
+        """The request timeout bounds every phase together"""
+
+        scheduler = Scheduler(1, timeout=3, clock=ticking())
+
+        with self.assertRaises(Rejected) as caught:
+            scheduler.compile(LONG_SOURCE, "table")
+
+        self.assertEqual(caught.exception.reason, DEADLINE)
+        self.assertEqual(scheduler.stats()[DEADLINE], 1)
+        self.assertEqual(scheduler.stats()["running"], 0)
+
+    def test_size_limit(self):
+        """Sources over the limit are refused before they are lexed"""
+
+        scheduler = Scheduler(1, max_chars=len(SOURCE) - 1)
+
+        with self.assertRaises(Rejected) as caught:
+            scheduler.compile(SOURCE)
+
+        self.assertEqual(caught.exception.reason, TOO_LARGE)
+        self.assertEqual(scheduler.stats()["admitted"], 0)
+
+    def test_saturated_queue(self):
+        """With every slot busy, a full queue refuses at once and a waiting
+        compile gives up after the queue timeout"""
+
+        scheduler = Scheduler(1, queue_limit=0, queue_timeout=0.01)
+
+        with scheduler.slot(Deadline({})):
+            with self.assertRaises(Rejected) as caught:
+                scheduler.compile(SOURCE)
+            self.assertEqual(caught.exception.reason, QUEUE_FULL)
+
+            scheduler.queue_limit = 1
+            with self.assertRaises(Rejected) as caught:
+                scheduler.compile(SOURCE)
+            self.assertEqual(caught.exception.reason, QUEUE_TIMEOUT)
+
+        self.assertEqual(scheduler.compile(SOURCE), compile_source(SOURCE))
+        self.assertEqual(
+            scheduler.stats(),
+            {
+                "concurrency": 1,
+                "running": 0,
+                "queue_limit": 1,
+                "waiting": 0,
+                "admitted": 2,
+                "completed": 1,
+                TOO_LARGE: 0,
+                QUEUE_FULL: 1,
+                QUEUE_TIMEOUT: 1,
+                DEADLINE: 0,
+                CANCELLED: 0,
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+"""AST serialization test module"""
+
+import io
+import json
+import unittest
+
+from src.parse import Parser
+from src.serialize import decode, dumps, dumps_binary, loads, loads_binary, to_json
+from src.serialize import write_json
+from src.table_lex import TableLexer
+
+SOURCE = """LET a = 1 + 2 * 3
+INPUT b
+PRINT "hi"
+LABEL top
+IF a > b THEN
+WHILE a != 0 REPEAT
+LET a = a - 1.5
+ENDWHILE
+ENDIF
+GOTO top
+"""
+
+
+def parse(source):
+    """Return the Program parsed from source"""
+
+    return Parser(TableLexer(source)).program()
+
+
+class TestSerialize(unittest.TestCase):
+    """Tests the streaming JSON writer and the binary AST format"""
+
+    def test_json_matches_dumps(self):
+        """Streamed JSON is the text json.dumps gives for the tree's dicts"""
+
+        tree = parse(SOURCE)
+
+        for indent in (None, 4):
+            with self.subTest(indent=indent):
+                self.assertEqual(to_json(tree, indent), dumps(tree.to_dict(), indent))
+
+        output = io.StringIO()
+        write_json(tree.statements[0], output, indent=4, level=2)
+        expected = dumps(tree.statements[0].to_dict(), indent=4)
+        self.assertEqual(output.getvalue(), expected.replace("\n", "\n" + " " * 8))
+
+    def test_decode_matches_json_loads(self):
+        """decode reads what json.loads does, and trees too deep for it"""
+
+        texts = [
+            to_json(parse(SOURCE), indent=4),
+            '{"a": [1, -2.5e3, "\\u00e9\\"", true, false, null, {}, []], "b": {}}',
+            ' [ [ ] , 0 ] ',
+        ]
+        for text in texts:
+            with self.subTest(text=text[:20]):
+                self.assertEqual(decode(text), json.loads(text))
+
+        deep = to_json(parse("PRINT 1" + " - 1" * 5000 + "\n"))
+        self.assertEqual(dumps(loads(deep)), deep)
+
+        for bad in ("[1,]", '{"a" 1}', "[1 2]", "tru", "[1] x", ""):
+            with self.subTest(bad=bad):
+                with self.assertRaises(Exception):
+                    decode(bad)
+
+    def test_binary_round_trip(self):
+        """Reading the binary format back gives an equal tree"""
+
+        tree = parse(SOURCE)
+        data = dumps_binary(tree)
+
+        self.assertEqual(loads_binary(data).to_dict(), tree.to_dict())
+        self.assertLess(len(data), len(to_json(tree)) // 4)
+
+    def test_binary_word_width(self):
+        """Large trees use wider words and still round trip"""
+
+        tree = parse("".join(f"LET v{i} = v{i} + {i}\n" for i in range(17000)))
+        data = dumps_binary(tree)
+
+        self.assertEqual(data[5], 4)
+        self.assertEqual(to_json(loads_binary(data)), to_json(tree))
+
+    def test_binary_rejects_bad_data(self):
+        """Foreign, truncated and corrupt data raise errors"""
+
+        data = dumps_binary(parse(SOURCE))
+
+        for bad in (
+            b"",
+            b"JSON" + data[4:],
+            data[:-1],
+            data[:20] + b"\xff" + data[21:],
+        ):
+            with self.subTest(bad=bad[:8]):
+                with self.assertRaises(Exception):
+                    loads_binary(bad)
+
+
+if __name__ == "__main__":
+    unittest.main()
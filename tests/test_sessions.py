@@ -0,0 +1,116 @@
+"""Editor session test module"""
+
+import asyncio
+import json
+import threading
+import unittest
+
+from src.pipeline import compile_source
+from src.scheduler import CANCELLED, Rejected, Scheduler
+from src.sessions import Session, SessionApp
+
+
+class TestSessions(unittest.TestCase):
+    """Tests that sessions compile only the newest edit and push results
+    as they are ready"""
+
+    def test_newest_edit_wins(self):
+        """An edit cancels the running compile and replaces the waiting one,
+        so only the newest is compiled and sent"""
+
+        started = threading.Event()
+
+        def compile(source, cancelled, on_ast):
+            if source == "slow":
+                started.set()
+                cancelled.wait(5)
+                raise Rejected(CANCELLED, "Compile cancelled")
+            on_ast(json.dumps(source))
+            return "C " + source, json.dumps(source)
+
+        async def edit():
+            outbox = asyncio.Queue()
+            session = Session(compile, None, outbox)
+
+            session.submit(1, "slow")
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+            session.submit(2, "older")
+            session.submit(3, "newest")
+            await session.task
+
+            messages = []
+            while not outbox.empty():
+                messages.append(outbox.get_nowait())
+            return session, messages
+
+        session, messages = asyncio.run(edit())
+
+        self.assertEqual(
+            messages,
+            [
+                {"type": "ast", "id": 3, "ast": '"newest"'},
+                {"type": "c", "id": 3, "c_code": "C newest"},
+            ],
+        )
+        self.assertEqual(
+            session.counts, {"compiled": 1, "cancelled": 1, "coalesced": 1}
+        )
+
+    def test_websocket_session(self):
+        """The ASGI app answers each edit with its AST, then its C code, and
+        reports errors on the same connection"""
+
+        scheduler = Scheduler(2)
+        app = SessionApp(
+            lambda source, cancelled, on_ast: scheduler.compile(
+                source, cancelled=cancelled, on_ast=on_ast
+            ),
+            workers=2,
+        )
+        source = "LET a = 1\nPRINT a * 2\n"
+
+        async def connect():
+            incoming = asyncio.Queue()
+            sent = []
+            replied = asyncio.Event()
+
+            async def send(message):
+                sent.append(message)
+                if len(sent) == 4:
+                    replied.set()
+
+            edit = json.dumps({"id": 7, "code": source})
+            for message in [
+                {"type": "websocket.connect"},
+                {"type": "websocket.receive", "text": edit},
+                {"type": "websocket.receive", "text": "not json"},
+            ]:
+                incoming.put_nowait(message)
+
+            async def receive():
+                if incoming.empty():
+                    await replied.wait()
+                    return {"type": "websocket.disconnect"}
+                return incoming.get_nowait()
+
+            await app({"type": "websocket", "path": "/session"}, receive, send)
+            return sent
+
+        sent = asyncio.run(connect())
+        c_code, ast_json = compile_source(source)
+
+        self.assertEqual(sent[0], {"type": "websocket.accept"})
+        replies = [json.loads(message["text"]) for message in sent[1:]]
+        self.assertIn({"type": "error", "error": "Invalid message"}, replies)
+        replies.remove({"type": "error", "error": "Invalid message"})
+        self.assertEqual(
+            replies,
+            [
+                {"type": "ast", "id": 7, "ast": json.loads(ast_json)},
+                {"type": "c", "id": 7, "c_code": c_code},
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+"""Source position test module"""
+
+import io
+import unittest
+
+from src.lex import create_lexer
+from src.parse import Parser
+from src.pipeline import compile_mapped, compile_source
+from src.serialize import to_json
+from src.source_map import LineTable, SourceMap
+from src.table_lex import StreamLexer
+
+ENGINES = ["char", "table", "buffer"]
+
+SOURCE = (
+    "LET a = 1 + 2 * 3\n"
+    "# comment\n"
+    'PRINT "hi"\n'
+    "WHILE a < 10 REPEAT\n"
+    "  LET a = -a + 3\n"
+    "ENDWHILE\n"
+    "PRINT a"
+)
+
+
+def parse(source, engine="table"):
+    """Return the Program for source"""
+
+    return Parser(create_lexer(source, engine)).program()
+
+
+def error(source, engine="table"):
+    """Return the message of the error parsing source"""
+
+    try:
+        parse(source, engine)
+    except Exception as exception:
+        return str(exception)
+
+
+class TestSourceMap(unittest.TestCase):
+    """Tests offsets, line lookups, node spans and the C to source map"""
+
+    def test_line_table(self):
+        """Offsets map to 1-based lines and columns, for text given whole or
+        in pieces"""
+
+        table = LineTable("ab\n\ncd\n")
+        self.assertEqual(len(table), 4)
+        self.assertEqual(table.location(0), (1, 1))
+        self.assertEqual(table.location(2), (1, 3))
+        self.assertEqual(table.location(3), (2, 1))
+        self.assertEqual(table.location(5), (3, 2))
+
+        pieces = LineTable()
+        pieces.extend(b"ab\n")
+        pieces.extend("\ncd\n")
+        self.assertEqual(list(pieces.starts), list(table.starts))
+
+    def test_errors_have_locations(self):
+        """Lexer and parser errors name the line and column, the same for
+        every lexer"""
+
+        cases = {
+            "LET a = 1\n  LET b = $\n": "Unknown token: $ (line 2, column 11)",
+            'LET a = 1\nPRINT "x%"\n': "Illegal character in string (line 2, column 7)",
+            "LET a = 1\nPRINT b\n": "before assignment: b (line 2, column 7)",
+            "GOTO x\nLET a = 1\n": "GOTO label undeclared: x (line 1, column 1)",
+            "IF 1 < 2 THEN\nPRINT 1\n": "got EOF (line 3, column 1)",
+        }
+
+        for source, message in cases.items():
+            for engine in ENGINES:
+                with self.subTest(source=source, engine=engine):
+                    self.assertTrue(error(source, engine).endswith(message))
+
+    def test_spans(self):
+        """Nodes span the source they were parsed from, whatever the lexer"""
+
+        program = parse(SOURCE)
+        let, printed, loop, last = program.statements
+
+        self.assertEqual(SOURCE[slice(*let.span)], "LET a = 1 + 2 * 3")
+        self.assertEqual(SOURCE[slice(*let.expression.right.span)], "2 * 3")
+        self.assertEqual(SOURCE[slice(*printed.expression.span)], '"hi"')
+        self.assertTrue(SOURCE[slice(*loop.span)].endswith("+ 3\nENDWHILE"))
+        self.assertEqual(SOURCE[slice(*loop.body[0].expression.left.span)], "-a")
+        self.assertEqual(SOURCE[slice(*last.span)], "PRINT a")
+        self.assertIsNone(loop.body[0].expression.left.left.span)
+
+        expected = to_json(program, spans=True)
+        for engine in ENGINES:
+            self.assertEqual(to_json(parse(SOURCE, engine), spans=True), expected)
+
+        stream = Parser(StreamLexer(io.StringIO(SOURCE), chunk_size=8)).program()
+        self.assertEqual(to_json(stream, spans=True), expected)
+
+    def test_json_spans_are_opt_in(self):
+        """The default JSON has no spans"""
+
+        program = parse(SOURCE)
+        self.assertEqual(to_json(program), compile_source(SOURCE, "table")[1])
+        self.assertIn('"start": 0, "end": 17', to_json(program, spans=True))
+
+    def test_c_lines_map_to_source_lines(self):
+        """Each C statement maps to its source line and block braces to the
+        line closing the block, also after optimizing"""
+
+        for optimize in (False, True):
+            _, c_code, source_map = compile_mapped(SOURCE, "table", optimize)
+            lines = c_code.split("\n")
+            mapped = {
+                lines[number - 1].strip(): source_map.source_line(number)
+                for number in range(1, len(lines) + 1)
+            }
+
+            self.assertEqual(mapped['printf("%s\\n", "hi");'], 3)
+            self.assertEqual(mapped["while (a < 10) {"], 4)
+            self.assertEqual(source_map.source_line(lines.index("  }") + 1), 6)
+            self.assertEqual(mapped['printf("%.2f\\n", (float) a);'], 7)
+            self.assertIsNone(source_map.source_line(1))
+            self.assertIsNone(source_map.source_line(len(lines)))
+
+    def test_source_map_lookup(self):
+        """Runs of C lines from one source line are stored once"""
+
+        source_map = SourceMap()
+        for c_line, source_line in [(4, 1), (5, 1), (6, 2), (9, 0)]:
+            source_map.add(c_line, source_line)
+
+        self.assertEqual(
+            source_map.to_dict(), {"c_lines": [4, 6, 9], "source_lines": [1, 2, 0]}
+        )
+        self.assertEqual(
+            [source_map.source_line(line) for line in range(3, 11)],
+            [None, 1, 1, 2, 2, 2, None, None],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+"""Streaming pipeline test module"""
+
+import io
+import json
+import unittest
+
+from src.code_gen import CodeGenerator
+from src.parse import Parser
+from src.pipeline import compile_stream
+from src.table_lex import StreamLexer, TableLexer
+from src.token_type import TokenType
+
+
+def tokens(lexer):
+    """Drains lexer into (text, kind) pairs up to and including EOF"""
+
+    result = []
+    while True:
+        token = lexer.get_token()
+        result.append((token.text, token.kind))
+        if token.kind == TokenType.EOF:
+            return result
+
+
+class TestStream(unittest.TestCase):
+    """Tests the streaming lexer and compile pipeline"""
+
+    def setUp(self):
+        with open("test_file.txt", "r", encoding="utf-8") as source_file:
+            self.source = source_file.read()
+
+    def test_stream_lexer_matches_table_lexer(self):
+        """Chunk boundaries do not change the token stream"""
+
+        expected = tokens(TableLexer(self.source))
+        for chunk_size in [1, 7, 64, 1 << 16]:
+            lexer = StreamLexer(io.StringIO(self.source), chunk_size)
+            self.assertEqual(tokens(lexer), expected)
+
+    def test_compile_stream_matches_program(self):
+        """Streamed C and AST JSON match the whole program pipeline"""
+
+        tree = Parser(TableLexer(self.source)).program()
+        expected_c = CodeGenerator().generate(tree)
+        expected_json = json.dumps(tree.to_dict(), indent=4)
+
+        c_file, ast_file = io.StringIO(), io.StringIO()
+        compile_stream(io.StringIO(self.source), c_file, ast_file)
+
+        self.assertEqual(c_file.getvalue(), expected_c)
+        self.assertEqual(ast_file.getvalue(), expected_json)
+
+    def test_compile_stream_empty_program(self):
+        """An empty source still yields a valid C file and AST"""
+
+        c_file, ast_file = io.StringIO(), io.StringIO()
+        compile_stream(io.StringIO(""), c_file, ast_file)
+
+        self.assertEqual(json.loads(ast_file.getvalue())["statements"], [])
+        self.assertIn("int main(void)", c_file.getvalue())
@@ -0,0 +1,59 @@
+"""Table lexer test module"""
+
+import unittest
+
+from src.lex import Lexer, create_lexer
+from src.table_lex import TableLexer
+from src.token_type import TokenType
+
+
+def tokens(lexer):
+    """Drains lexer into (text, kind) pairs up to and including EOF"""
+
+    result = []
+    while True:
+        token = lexer.get_token()
+        result.append((token.text, token.kind))
+        if token.kind == TokenType.EOF:
+            return result
+
+
+class TestTableLex(unittest.TestCase):
+    """Tests TableLexer against the character lexer"""
+
+    def assert_same_stream(self, source):
+        """Both engines produce identical tokens for source"""
+        self.assertEqual(tokens(TableLexer(source)), tokens(Lexer(source)))
+
+    def test_sample_program(self):
+        """Matches the character lexer on the sample program"""
+        with open("test_file.txt", "r", encoding="utf-8") as source_file:
+            self.assert_same_stream(source_file.read())
+
+    def test_operators_and_literals(self):
+        """Matches on every operator, numbers, strings and comments"""
+        self.assert_same_stream(
+            "LET x = 10 + 2.5 * y / 3 - 1 # note\n"
+            'IF x >= 1 THEN\nPRINT "hi there"\nENDIF\n'
+            "WHILE a<=b REPEAT\nLET c=a==b\nENDWHILE\n"
+            "IF a != b THEN\r\n\tGOTO end\nENDIF\nLABEL end\n# trailing"
+        )
+
+    def test_keywords_are_case_sensitive(self):
+        """Lowercase keywords lex as identifiers"""
+        kinds = [kind for _, kind in tokens(TableLexer("let LET"))]
+        self.assertEqual(kinds[:2], [TokenType.IDENT, TokenType.LET])
+
+    def test_errors(self):
+        """Reports the same errors as the character lexer"""
+        for source in ["a ! b", "1.x", '"bad%"', "a $ b"]:
+            with self.assertRaises(Exception) as expected:
+                tokens(Lexer(source))
+            with self.assertRaises(Exception) as actual:
+                tokens(TableLexer(source))
+            self.assertEqual(str(actual.exception), str(expected.exception))
+
+    def test_create_lexer(self):
+        """Engines are selectable by name"""
+        self.assertIsInstance(create_lexer("IF", "table"), TableLexer)
+        self.assertIsInstance(create_lexer("IF"), Lexer)
@@ -0,0 +1,98 @@
+"""Token buffer test module"""
+
+import os
+import tempfile
+import unittest
+
+from src.lex import create_lexer
+from src.parse import Parser
+from src.table_lex import TableLexer
+from src.token_buffer import BufferLexer, TokenBuffer
+from src.token_type import TokenType
+
+SOURCE = (
+    "LET x = 10 + 2.5 * y / 3 - 1 # note\n"
+    'IF x >= 1 THEN\nPRINT "hi there"\nENDIF\n'
+    "WHILE a<=b REPEAT\nLET c=a==b\nENDWHILE\n"
+    "IF a != b THEN\r\n\tGOTO end\nENDIF\nLABEL end\n# trailing"
+)
+
+
+def tokens(lexer):
+    """Drains lexer into (text, kind) pairs up to and including EOF, ending
+    with the error message if lexing fails"""
+
+    result = []
+    try:
+        while True:
+            token = lexer.get_token()
+            result.append((token.text, token.kind))
+            if token.kind == TokenType.EOF:
+                return result
+    except Exception as error:
+        return result + [str(error)]
+
+
+class TestTokenBuffer(unittest.TestCase):
+    """Tests TokenBuffer and BufferLexer against the table lexer"""
+
+    def test_same_tokens_as_table_lexer(self):
+        """Strings and bytes lex to the table lexer's tokens and errors"""
+
+        for source in [SOURCE, "PRINT 1", "a ! b", "a !", "1.x", '"bad%"', "a $ b"]:
+            with self.subTest(source=source):
+                expected = tokens(TableLexer(source))
+                self.assertEqual(tokens(BufferLexer(source)), expected)
+                self.assertEqual(
+                    tokens(BufferLexer(TokenBuffer(source.encode()))), expected
+                )
+
+    def test_parallel_arrays(self):
+        """Kinds and offsets are stored in arrays and text sliced on demand"""
+
+        buffer = TokenBuffer(b"LET abc = 12\n")
+
+        self.assertEqual(list(buffer.kinds[:4]), [105, 3, 201, 1])
+        self.assertEqual((buffer.starts[1], buffer.ends[1]), (4, 7))
+        self.assertEqual(buffer.text(3), "12")
+
+    def test_tokens_are_shared(self):
+        """Equal identifiers share one interned token"""
+
+        buffer = TokenBuffer("LET abc = abc + abc\n")
+
+        self.assertIs(buffer.token(1), buffer.token(3))
+        self.assertIs(buffer.token(1).text, "abc")
+        self.assertIs(buffer.token(0), TokenBuffer("LET").token(0))
+
+    def test_memory_mapped_files(self):
+        """Files are mapped, including empty and non-ASCII ones"""
+
+        with tempfile.TemporaryDirectory() as directory:
+            for source in ["", SOURCE, 'LET é = 1\nPRINT "ü"\n']:
+                path = os.path.join(directory, "source.txt")
+                with open(path, "w", encoding="utf-8") as source_file:
+                    source_file.write(source)
+
+                with self.subTest(source=source):
+                    self.assertEqual(
+                        tokens(BufferLexer(TokenBuffer.from_path(path))),
+                        tokens(TableLexer(source)),
+                    )
+
+    def test_parser_lookahead(self):
+        """Parser.peek reaches any distance, in place over a buffer and
+        through a queue over other lexers"""
+
+        for engine in ["buffer", "table", "char"]:
+            with self.subTest(engine=engine):
+                parser = Parser(create_lexer("LET a = 1\nPRINT a\n", engine))
+                texts = [parser.peek(distance).text for distance in range(1, 8)]
+                self.assertEqual(texts, ["a", "=", "1", "\n", "PRINT", "a", "\n"])
+
+                program = parser.program()
+                self.assertEqual(len(program.statements), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
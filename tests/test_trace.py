@@ -0,0 +1,57 @@
+"""Parser tracing test module"""
+
+import io
+import json
+import unittest
+
+from src.parse import Parser
+from src.table_lex import TableLexer
+from src.trace import PrintTracer, ProfileTracer
+
+SOURCE = "LET a = 1\nLET b = a + 2 * 3\nIF b > 1 THEN\nPRINT b\nENDIF\n"
+
+
+class TestTrace(unittest.TestCase):
+    """Tests parser tracers"""
+
+    def test_untraced_parser_uses_class_methods(self):
+        """Without a tracer no production is wrapped"""
+
+        parser = Parser(TableLexer(SOURCE))
+        self.assertNotIn("statement", vars(parser))
+        self.assertNotIn("next_token", vars(parser))
+
+    def test_profile_counts(self):
+        """Records calls and tokens per production"""
+
+        tracer = ProfileTracer()
+        tree = Parser(TableLexer(SOURCE), tracer).program()
+        stats = tracer.to_dict()["productions"]
+
+        self.assertEqual(len(tree.statements), 3)
+        self.assertEqual(stats["program"]["calls"], 1)
+        self.assertEqual(stats["comparison"]["calls"], 1)
+        self.assertEqual(stats["primary"]["calls"], 7)
+        self.assertEqual(stats["program"]["tokens"], tracer.tokens - 2)
+        self.assertGreaterEqual(
+            stats["program"]["cumulative_time"], stats["statement"]["cumulative_time"]
+        )
+
+    def test_profile_json_and_merge(self):
+        """Merged profiles add up and export as JSON"""
+
+        total = ProfileTracer()
+        for _ in range(2):
+            tracer = ProfileTracer()
+            Parser(TableLexer(SOURCE), tracer).program()
+            total.merge(tracer)
+
+        stats = json.loads(total.to_json())["productions"]
+        self.assertEqual(stats["program"]["calls"], 2)
+
+    def test_print_tracer(self):
+        """Writes one line per production entered"""
+
+        stream = io.StringIO()
+        Parser(TableLexer("LET a = 1\n"), PrintTracer(stream)).program()
+        self.assertTrue(stream.getvalue().startswith("PROGRAM ('LET')\nSTATEMENT"))
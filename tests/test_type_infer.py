@@ -0,0 +1,96 @@
+"""Type inference test module"""
+
+import unittest
+
+from src.parse import Parser
+from src.pipeline import compile_source
+from src.table_lex import TableLexer
+from src.type_infer import infer_types
+
+
+def types_of(source):
+    """Return the inferred variable types of source"""
+
+    return infer_types(Parser(TableLexer(source)).program())
+
+
+def typed_c(source, optimize=False):
+    """Return the C body lines for source compiled with inferred types"""
+
+    c_code, _ = compile_source(source, optimize=optimize, infer_types=True)
+    return [line.strip() for line in c_code.splitlines()[3:-2]]
+
+
+class TestTypeInfer(unittest.TestCase):
+    """Tests variable type inference and typed code generation"""
+
+    def test_counters_stay_int(self):
+        """Integer counters and bounds are int, not float"""
+
+        self.assertEqual(
+            typed_c(
+                "LET i = 0\nWHILE i < 10 REPEAT\nLET i = i + 1\nENDWHILE\nPRINT i\n"
+            ),
+            [
+                "int i = 0;",
+                "i = 0;",
+                "while (i < 10) {",
+                "i = i + 1;",
+                "}",
+                'printf("%d\\n", i);',
+            ],
+        )
+
+    def test_types_widen_across_blocks(self):
+        """A double assigned in any block widens the variable everywhere"""
+
+        source = (
+            "LET a = 1\nLET b = a * 2\nIF a > 0 THEN\nLET a = 0.5\nENDIF\n"
+            "LET c = 3000000000\nLET d = c + 1\n"
+        )
+        self.assertEqual(
+            types_of(source),
+            {"a": "double", "b": "double", "c": "long long", "d": "long long"},
+        )
+
+    def test_input_and_strings(self):
+        """INPUT reads with the variable's format; strings print with %s"""
+
+        self.assertEqual(
+            typed_c('INPUT x\nLET n = 1\nINPUT n\nLET s = "hi"\nPRINT s\nPRINT x\n'),
+            [
+                "double x = 0;",
+                "int n = 0;",
+                'char *s = "";',
+                'scanf("%lf", &x);',
+                "n = 1;",
+                'scanf("%d", &n);',
+                's = "hi";',
+                'printf("%s\\n", s);',
+                'printf("%.2f\\n", x);',
+            ],
+        )
+
+    def test_mixing_strings_and_numbers(self):
+        """A variable cannot hold both a string and a number"""
+
+        with self.assertRaisesRegex(Exception, "Cannot mix strings and numbers"):
+            types_of('LET s = "hi"\nLET s = 1\n')
+
+    def test_declarations_hoisted(self):
+        """Variables first assigned in a block are visible after it"""
+
+        lines = typed_c("LET a = 1\nIF a > 0 THEN\nLET b = 2\nENDIF\nPRINT b\n")
+        self.assertEqual(lines[:2], ["int a = 0;", "int b = 0;"])
+
+    def test_optimizer_keeps_int_types(self):
+        """Folding under inferred types keeps integer constants integers"""
+
+        self.assertEqual(
+            typed_c("LET a = 7 / 2\nPRINT a * 1\n", optimize=True),
+            ["int a = 0;", "a = 3;", 'printf("%d\\n", 3);'],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+"""Bytecode compiler and VM test module"""
+
+import shutil
+import tempfile
+import unittest
+
+from src.bytecode import JUMP, JUMP_IF_FALSE, LOAD, STORE
+from src.native import NativeBuilder
+from src.pipeline import compile_bytecode, compile_source
+from src.vm import HALTED, TIMED_OUT, TRUNCATED, Trap, execute
+
+PROGRAMS = [
+    "LET a = 7\nLET b = 2\nPRINT a / b\nPRINT 7 / 2\nLET c = a / b\nPRINT c\n",
+    "LET i = 2147483647\nLET i = i + 1\nPRINT i\nLET f = 16777216.0\n"
+    "LET f = f + 1\nPRINT f\nLET d = 0 - 7\nLET d = d / 2\nPRINT d\n",
+    "INPUT a\nINPUT b\nPRINT a * -b - -a\nPRINT 0 - a / 3 * b\n",
+    "LET n = 0\nLABEL top\nLET n = n + 1\nIF n < 5 THEN\nGOTO top\nENDIF\n"
+    'PRINT n\nPRINT "done"\n',
+    "INPUT x\nLET s = 0\nWHILE x > 0 REPEAT\nLET s = s + x * 0.1\n"
+    "LET x = x - 1\nENDWHILE\nPRINT s\nLET z = 0.0\nPRINT 1 / z\n",
+]
+
+
+def run(source, input_text="", infer_types=False, **options):
+    """Return (stdout, status) for source run on the VM"""
+
+    return execute(
+        compile_bytecode(source, infer_types=infer_types), input_text, **options
+    )
+
+
+class TestVM(unittest.TestCase):
+    """Tests lowering and C semantics of the in-process VM"""
+
+    def test_c_arithmetic(self):
+        """Ints wrap and truncate, float variables are single precision and
+        PRINT casts only its leftmost operand to float"""
+
+        self.assertEqual(run(PROGRAMS[0])[0], "3.50\n3.50\n3.00\n")
+        self.assertEqual(run(PROGRAMS[1])[0], "-2147483648.00\n16777216.00\n-3.50\n")
+
+    def test_variables_use_slots(self):
+        """Variables are resolved to slot indices and blocks lower to jumps"""
+
+        code = compile_bytecode(
+            "LET a = 1\nWHILE a < 3 REPEAT\nLET a = a + 1\nENDWHILE\n"
+        )
+        opcodes = [opcode for opcode, _ in code.instructions]
+
+        self.assertEqual(code.names, ["a"])
+        self.assertIn((STORE, 0), code.instructions)
+        self.assertIn((LOAD, 0), code.instructions)
+        self.assertIn(JUMP_IF_FALSE, opcodes)
+        self.assertIn((JUMP, 2), code.instructions)
+
+    def test_gotos_and_condition_assignment(self):
+        """GOTO jumps to its label and x = e in a condition assigns"""
+
+        self.assertEqual(run(PROGRAMS[3])[0], "5.00\ndone\n")
+        self.assertEqual(
+            run("LET a = 1\nIF a = 0 THEN\nPRINT 1\nENDIF\nPRINT a\n")[0], "0.00\n"
+        )
+
+    def test_input_reads_like_scanf(self):
+        """Numbers are read past whitespace; a mismatch leaves the variable"""
+
+        source = "INPUT a\nINPUT b\nINPUT c\nPRINT a\nPRINT b\nPRINT c\n"
+        self.assertEqual(run(source, " 1.5\n\n-2 x 3")[0], "1.50\n-2.00\n0.00\n")
+
+    def test_typed_formats(self):
+        """With inferred types ints print as integers"""
+
+        source = (
+            'LET a = 7\nLET b = a / 2\nLET c = b * 1.5\nPRINT b\nPRINT c\nPRINT "s"\n'
+        )
+        self.assertEqual(run(source, infer_types=True)[0], "3\n4.50\ns\n")
+
+    def test_limits(self):
+        """Runaway loops time out, output is cut off and traps raise"""
+
+        self.assertEqual(run("LABEL a\nGOTO a\n", timeout=0.05), ("", TIMED_OUT))
+        self.assertEqual(
+            run("LABEL a\nPRINT 1\nGOTO a\n", max_output=12),
+            ("1.00\n1.00\n1.", TRUNCATED),
+        )
+        self.assertEqual(run("PRINT 1\n"), ("1.00\n", HALTED))
+
+        with self.assertRaises(Trap):
+            run("LET a = 0\nLET b = 1 / a\n")
+
+    @unittest.skipIf(shutil.which("cc") is None, "no C compiler")
+    def test_matches_native(self):
+        """The VM prints what the generated C prints"""
+
+        with tempfile.TemporaryDirectory() as directory:
+            builder = NativeBuilder(directory)
+
+            for infer_types in (False, True):
+                for source in PROGRAMS:
+                    with self.subTest(source=source, infer_types=infer_types):
+                        c_code, _ = compile_source(source, infer_types=infer_types)
+                        path, _, _ = builder.build(c_code, "0")
+                        native = builder.run(path, "4 -2.5\n")["stdout"]
+
+                        self.assertEqual(
+                            run(source, "4 -2.5\n", infer_types)[0], native
+                        )
+
+
+if __name__ == "__main__":
+    unittest.main()